@@ -2,7 +2,8 @@
 # distutils: language = c++
 
 import numpy as np
-from syri.scripts.func import readfasta, fileRemove, revcomp
+from syri.scripts.func import getGenomeStore, fileRemove, revcomp
+from syri.srdata import srResults
 from igraph import *
 from collections import defaultdict
 # from scipy.stats import *
@@ -20,83 +21,15 @@ np.random.seed(1)
 
 chrsnps = defaultdict(dict)
 
-def readSRData(cwdPath, prefix, dup = False):
+def readSRData(cwdPath, prefix, dup = False, srdata = None):
+    """Alignments of the SR blocks. srdata is the srResults of the SR stage, it is read from the output files when not given."""
     if not isinstance(dup, bool):
         sys.exit("need boolean")
-    if dup:
-        fin = ["synOut.txt","invOut.txt", "TLOut.txt", "invTLOut.txt", "dupOut.txt", "invDupOut.txt", "ctxOut.txt"]
-    else:
-        fin = ["synOut.txt","invOut.txt", "TLOut.txt", "invTLOut.txt","ctxOut.txt"]
-
-    annoCoords = pd.DataFrame()
-    for fileType in fin[:-1]:
-        try:
-            fileData = pd.read_table(cwdPath+prefix+fileType, header=None, dtype = object)
-        except pd.errors.ParserError as _e:
-            fileData = pd.read_table(cwdPath+prefix+fileType, header=None, dtype = object, engine ="python")
-        except pd.errors.EmptyDataError:
-            print(fileType, " is empty. Skipping analysing it.")
-            continue
-        except Exception as _e:
-            print("ERROR: while trying to read ", fileType, _e)
-            continue
-
-        annoIndices = np.where(fileData[0] == "#")[0]
-        annoIndices = np.append(annoIndices,len(fileData))
-        repCount = annoIndices[1:] - annoIndices[:-1] - 1
-
-        annoData = fileData.loc[fileData[0] == "#"].copy()
-        coordsData = fileData.loc[fileData[0] !="#"].copy()
-        coordsData = coordsData[[0,1,2,3]].astype(dtype = "int64")
-
-        reps = []
-        for i in annoData[1].unique():
-            reps.extend(list(range(len(np.where(annoData[1] == i)[0]))))
-        reps = np.repeat(reps, repCount)
-
-        coordsData["group"] = reps
-        coordsData["aChr"] = list(np.repeat(annoData[1], repCount))
-        coordsData["bChr"] = list(np.repeat(annoData[5], repCount))
-        coordsData["state"] = fileType.split("Out.txt")[0]
-        # annoCoords = annoCoords.append(coordsData.copy())
-        annoCoords = pd.concat([annoCoords, coordsData.copy()])
-
-    fileData = None
-    try:
-        fileData = pd.read_table(cwdPath+prefix+"ctxOut.txt", header = None, dtype = object)
-    except pd.errors.ParserError as e:
-        fileData = pd.read_table(cwdPath+prefix+"ctxOut.txt", header=None, dtype = object, engine ="python")
-    except pd.errors.EmptyDataError:
-        print("ctxOut.txt is empty. Skipping analysing it.")
-    except Exception as e:
-        print("ERROR: while trying to read ", fileType, "Out.txt", e)
-
-    if fileData is not None:
-        annoIndices = np.where(fileData[0] =="#")[0]
-        states = list(fileData[8].loc[annoIndices])
-        coordsData = fileData.loc[fileData[0] =="#"].copy()
-        coordsData1 = fileData.loc[fileData[0] !="#", [0,1,2,3]].copy().astype(dtype="int")
-        annoIndices = np.append(annoIndices,len(fileData))
-        repCount = annoIndices[1:] - annoIndices[:-1] - 1
-        reps = np.repeat(range(len(annoIndices)-1), repCount)
-        stateReps = np.repeat(states, repCount)
-        coordsData1["aChr"] = np.repeat(coordsData[1], repCount).tolist()
-        coordsData1["bChr"] = np.repeat(coordsData[5], repCount).tolist()
-        coordsData1["group"] = reps
-        coordsData1["state"] = stateReps
-        coordsData1 = coordsData1[[0,1,2,3,"group","aChr","bChr","state"]]
-        coordsData1.loc[coordsData1.state == "translocation","state"] = "ctx"
-        coordsData1.loc[coordsData1.state == "invTranslocation","state"] = "invCtx"
-        coordsData1.loc[coordsData1.state == "duplication","state"] = "ctxDup"
-        coordsData1.loc[coordsData1.state == "invDuplication","state"] = "ctxinvDup"
-        if not dup:
-            coordsData1 = coordsData1.loc[coordsData1["state"].isin(["ctx","invCtx"])]
-        # annoCoords = annoCoords.append(coordsData1)
-        annoCoords = pd.concat([annoCoords, coordsData1])
-
-    annoCoords.columns = ["aStart","aEnd","bStart","bEnd","group","aChr","bChr","state"]
-    annoCoords.sort_values(by = ["aChr", "aStart","aEnd","bChr", "bStart","bEnd"], inplace = True)
-    annoCoords.index = range(len(annoCoords))
+    if srdata is None:
+        srdata = srResults.fromFiles(cwdPath, prefix)
+    annoCoords = srdata.alignments(dup)
+    # Alignments of inverted CTX duplications are marked as inverted by 'inv' in their id
+    annoCoords.loc[annoCoords.state == "ctxInvDup", "state"] = "ctxinvDup"
     return annoCoords
 
 def getsnps(blocks, allAlignments):
@@ -143,7 +76,7 @@ def getsnps(blocks, allAlignments):
                           pd.unique(alignments["bChr"])[0]])+ "\n" + outsnps.to_csv(sep='\t', header=False, index=False)
     return outstring
 
-def getshv(args, coords, chrlink):
+def getshv(args, coords, chrlink, srdata=None):
     logger = logging.getLogger("ShV")
     cwdpath = args.dir
     prefix = args.prefix
@@ -154,7 +87,7 @@ def getshv(args, coords, chrlink):
 
         global chrsnps                          # Use global variable to save SNPs divided based on chromosomes. Using global variable, saves memory when classifying snps/indels using parallel processing
 
-        allAlignments = readSRData(cwdpath, prefix, args.all)
+        allAlignments = readSRData(cwdpath, prefix, args.all, srdata)
         mapit = 0
         if os.path.isfile(cwdpath+prefix+"mapids.txt"):
             mapit = 1
@@ -246,16 +179,17 @@ def getshv(args, coords, chrlink):
 
     else:
         logger.debug("finding short variation using CIGAR string")
-        allAlignments = readSRData(cwdpath, prefix, args.all)
+        allAlignments = readSRData(cwdpath, prefix, args.all, srdata)
         allAlignments["id"] = allAlignments.group.astype("str") + allAlignments.aChr + allAlignments.bChr + allAlignments.state
         allBlocks = pd.unique(allAlignments.id)
 
-        refg = readfasta(args.ref.name)
-        qryg = readfasta(args.qry.name)
-
+        refg = getGenomeStore(args.ref.name)
+        qryg = getGenomeStore(args.qry.name)
+        # Query chromosome ID for each reference chromosome ID
+        qchr = {}
         if len(chrlink) > 0 :
             try:
-                qryg = {chrlink[k]:v for k,v in qryg.items()}
+                qchr = {chrlink[k]:k for k in qryg.lengths.keys()}
             except Exception as e:
                 print(e)
                 logger.error("Unequal number of chromosomes in the two genomes.")
@@ -287,8 +221,8 @@ def getshv(args, coords, chrlink):
                                 logger.error('Invalid CIGAR string. Only (X/=/I/D) operators are allowed')
                                 sys.exit()
 
-                        refseq = refg[row.aChr][(row.aStart-1):row.aEnd]
-                        qryseq = qryg[row.bChr][(row.bStart-1):row.bEnd]
+                        refseq = refg.fetch(row.aChr, row.aStart-1, row.aEnd).decode()
+                        qryseq = qryg.fetch(qchr.get(row.bChr, row.bChr), row.bStart-1, row.bEnd).decode()
 
                         posa = 0                    # number of bases covered in genome a
                         posb = 0                    # number of bases covered in genome b
@@ -328,8 +262,8 @@ def getshv(args, coords, chrlink):
                                 logger.error('Invalid CIGAR string. Only (X/=/I/D) operators are allowed')
                                 sys.exit()
 
-                        refseq = refg[row.aChr][(row.aStart-1):row.aEnd]
-                        qryseq = revcomp(qryg[row.bChr][(row.bEnd-1):row.bStart])
+                        refseq = refg.fetch(row.aChr, row.aStart-1, row.aEnd).decode()
+                        qryseq = revcomp(qryg.fetch(qchr.get(row.bChr, row.bChr), row.bEnd-1, row.bStart)).decode()
                     # with open('snps.txt', 'w') as fout:
                         posa = 0                    # number of bases covered in genome a
                         posb = 0                    # number of bases covered in genome b
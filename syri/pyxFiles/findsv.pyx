@@ -3,6 +3,7 @@
 
 import numpy as np
 from syri.scripts.func import *
+from syri.srdata import srResults
 from igraph import *
 # from scipy.stats import *
 import pandas as pd
@@ -13,423 +14,139 @@ cimport cython
 
 np.random.seed(1)
 
-def readSRData(cwdPath, prefix, dup = False):
+def readSRData(cwdPath, prefix, dup = False, srdata = None):
+    """Alignments of the SR blocks. srdata is the srResults of the SR stage, it is read from the output files when not given."""
     if not isinstance(dup, bool):
         sys.exit("need boolean")
-    if dup:
-        fin = ["synOut.txt","invOut.txt", "TLOut.txt", "invTLOut.txt", "dupOut.txt", "invDupOut.txt", "ctxOut.txt"]
-    else:
-        fin = ["synOut.txt","invOut.txt", "TLOut.txt", "invTLOut.txt","ctxOut.txt"]
-
-    annoCoords = pd.DataFrame()
-    for fileType in fin[:-1]:
-        try:
-            fileData = pd.read_table(cwdPath+prefix+fileType, header=None, dtype = object)
-        except pd.errors.ParserError as _e:
-            fileData = pd.read_table(cwdPath+prefix+fileType, header=None, dtype = object, engine ="python")
-        except pd.errors.EmptyDataError:
-            print(fileType, " is empty. Skipping analysing it.")
-            continue
-        except Exception as _e:
-            print("ERROR: while trying to read ", fileType, _e)
-            continue
-
-        annoIndices = np.where(fileData[0] == "#")[0]
-        annoIndices = np.append(annoIndices,len(fileData))
-        repCount = annoIndices[1:] - annoIndices[:-1] - 1
-
-        annoData = fileData.loc[fileData[0] == "#"].copy()
-        coordsData = fileData.loc[fileData[0] !="#"].copy()
-        coordsData = coordsData[[0,1,2,3]].astype(dtype = "int64")
-
-        reps = []
-        for i in annoData[1].unique():
-            reps.extend(list(range(len(np.where(annoData[1] == i)[0]))))
-        reps = np.repeat(reps, repCount)
-
-        coordsData["group"] = reps
-        coordsData["aChr"] = list(np.repeat(annoData[1], repCount))
-        coordsData["bChr"] = list(np.repeat(annoData[5], repCount))
-        coordsData["state"] = fileType.split("Out.txt")[0]
-        # annoCoords = annoCoords.append(coordsData.copy())
-        annoCoords = pd.concat([annoCoords, coordsData.copy()])
-
-    fileData = None
-
-    try:
-        fileData = pd.read_table(cwdPath+prefix+"ctxOut.txt", header = None, dtype = object)
-    except pd.errors.ParserError as e:
-        fileData = pd.read_table(cwdPath+prefix+"ctxOut.txt", header=None, dtype = object, engine ="python")
-    except pd.errors.EmptyDataError:
-        print("ctxOut.txt is empty. Skipping analysing it.")
-    except Exception as e:
-        print("ERROR: while trying to read ", fileType, "Out.txt", e)
-
-    if fileData is not None:
-        annoIndices = np.where(fileData[0] =="#")[0]
-        states = list(fileData[8].loc[annoIndices])
-        coordsData = fileData.loc[fileData[0] =="#"].copy()
-        coordsData1 = fileData.loc[fileData[0] !="#", [0,1,2,3]].copy().astype(dtype="int")
-        annoIndices = np.append(annoIndices,len(fileData))
-        repCount = annoIndices[1:] - annoIndices[:-1] - 1
-        reps = np.repeat(range(len(annoIndices)-1), repCount)
-        stateReps = np.repeat(states, repCount)
-        coordsData1["aChr"] = np.repeat(coordsData[1], repCount).tolist()
-        coordsData1["bChr"] = np.repeat(coordsData[5], repCount).tolist()
-        coordsData1["group"] = reps
-        coordsData1["state"] = stateReps
-        coordsData1 = coordsData1[[0,1,2,3,"group","aChr","bChr","state"]]
-        coordsData1.loc[coordsData1.state == "translocation","state"] = "ctx"
-        coordsData1.loc[coordsData1.state == "invTranslocation","state"] = "invCtx"
-        coordsData1.loc[coordsData1.state == "duplication","state"] = "ctxDup"
-        coordsData1.loc[coordsData1.state == "invDuplication","state"] = "ctxInvDup"
-        if not dup:
-            coordsData1 = coordsData1.loc[coordsData1["state"].isin(["ctx","invCtx"])]
-        # annoCoords = annoCoords.append(coordsData1)
-        annoCoords = pd.concat([annoCoords, coordsData1])
-
-    annoCoords.columns = ["aStart","aEnd","bStart","bEnd","group","aChr","bChr","state"]
-    annoCoords.sort_values(by = ["aChr", "aStart","aEnd","bChr", "bStart","bEnd"], inplace = True)
-    annoCoords.index = range(len(annoCoords))
-    return annoCoords
+    if srdata is None:
+        srdata = srResults.fromFiles(cwdPath, prefix)
+    return srdata.alignments(dup)
 # END
 
 
-def getSV(cwdPath, allAlignments, prefix, offset):
+def getSV(cwdPath, allAlignments, prefix, offset, nc=1):
     """
     inverted regions are output in reverse as well
     :param cwdPath:
     :param allAlignments:
     :param prefix:
     :param offset:
+    :param nc: number of processes. Blocks are split between them by reference chromosome
     :return: Output coordinate info:
         In reference: HDR/DEL coordinates consists of the affected bases, INS coordinate consists of 1bp upstream coordinate. This ensure that the inserted sequence (as in VCF) matches the query genome sequence
         In query: HDR/INS coordinates consists of the affected bases, DEL coordinate consists of 1bp upstream coordinate (towards the 5' end for directed alignment and towards the 3' end for inverted alignments)
     """
     logger = logging.getLogger("getSV")
     offset = -abs(offset)
-    fout = open(cwdPath + prefix + "sv.txt", "w")
     allAlignments["id"] = allAlignments.group.astype("str") + 'Chr' + allAlignments.aChr + 'Chr' + allAlignments.bChr + allAlignments.state
-    allBlocks = pd.unique(allAlignments.id)
-
-    for i in allBlocks:
-        blocksAlign = allAlignments.loc[allAlignments.id == i].copy()
-        if len(pd.unique(blocksAlign["aChr"])) > 1 or len(pd.unique(blocksAlign["aChr"])) > 1:
-            logger.error("More than one chromosome found for a SR\n"+blocksAlign.to_string())
-            sys.exit()
-        fout.write("\t".join(["#",
-                              str(blocksAlign[["aStart","aEnd"]].min().min()),
-                              str(blocksAlign[["aStart", "aEnd"]].max().max()),
-                              str(blocksAlign[["bStart", "bEnd"]].min().min()),
-                              str(blocksAlign[["bStart", "bEnd"]].max().max()),
-                              pd.unique(blocksAlign["aChr"])[0],
-                              pd.unique(blocksAlign["bChr"])[0]]) + "\n")
-        ordered = 1 if "inv" not in blocksAlign.state.iloc[0] else 0
-        for j in range(len(blocksAlign) - 1):
-            m = blocksAlign.iat[j + 1, 0] - blocksAlign.iat[j, 1] - 1
-            if ordered:
-                n = blocksAlign.iat[j + 1, 2] - blocksAlign.iat[j, 3] - 1
-            else:
-                n = blocksAlign.iat[j, 3] - blocksAlign.iat[j + 1, 2] - 1
-
-            if offset <= m <= 0:  ## No significant overlap in reference genome
-                if offset <= n <= 0:  ## No significant overlap in query genome
-                    continue
-                elif n > 0:
-                    # s = str(max(blocksAlign.iat[j, 1], blocksAlign.iat[j + 1, 0]))
-                    # Use the base upstream to the insertion
-                    s = str(blocksAlign.iat[j, 1])
-                    if ordered:
-                        fout.write("\t".join(["INS",
-                                              s,
-                                              s,
-                                              str(blocksAlign.iat[j, 3] + 1),
-                                              str(blocksAlign.iat[j + 1, 2] - 1),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        fout.write("\t".join(["INS",
-                                              s,
-                                              s,
-                                              str(blocksAlign.iat[j, 3] - 1),
-                                              str(blocksAlign.iat[j + 1, 2] + 1),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-
-                elif n < offset:
-                    if ordered:
-                        j_prop = abs(n) / (blocksAlign.iat[j, 3] - blocksAlign.iat[j, 2])
-                        j1_prop = abs(n) / (blocksAlign.iat[j + 1, 3] - blocksAlign.iat[j + 1, 2])
-                        sCoord = round(
-                            blocksAlign.iat[j, 1] - j_prop * (blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0]))
-                        eCoord = round(blocksAlign.iat[j + 1, 0] + j1_prop * (
-                                    blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0]))
-                        fout.write("\t".join(["CPL",
-                                              str(sCoord),
-                                              str(eCoord),
-                                              str(blocksAlign.iat[j + 1, 2]),
-                                              str(blocksAlign.iat[j, 3]),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        j_prop = abs(n) / (blocksAlign.iat[j, 2] - blocksAlign.iat[j, 3])
-                        j1_prop = abs(n) / (blocksAlign.iat[j + 1, 2] - blocksAlign.iat[j + 1, 3])
-                        sCoord = round(
-                            blocksAlign.iat[j, 1] - j_prop * (blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0]))
-                        eCoord = round(blocksAlign.iat[j + 1, 0] + j1_prop * (
-                                    blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0]))
-                        fout.write("\t".join(["CPL",
-                                              str(sCoord),
-                                              str(eCoord),
-                                              str(blocksAlign.iat[j + 1, 2]),
-                                              str(blocksAlign.iat[j, 3]),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-
-            elif m == 1:
-                if offset <= n <= 0:
-                    # e = str(min(blocksAlign.iat[j, 3], blocksAlign.iat[j + 1, 2]))
-                    # Using the base upstream to the deletion in the direction of alignment
-                    e = str(blocksAlign.iat[j, 3])
-                    if ordered:
-                        fout.write("\t".join(["DEL",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              e,
-                                              e,
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        # e = str(max(blocksAlign.iat[j, 3], blocksAlign.iat[j + 1, 2]))
-                        fout.write("\t".join(["DEL",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              e,
-                                              e,
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-
-                elif n == 1:
-                    if ordered:
-                        fout.write("\t".join(["SNP",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              str(blocksAlign.iat[j, 3] + 1),
-                                              str(blocksAlign.iat[j + 1, 2] - 1),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        fout.write("\t".join(["SNP",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              str(blocksAlign.iat[j, 3] - 1),
-                                              str(blocksAlign.iat[j + 1, 2] + 1),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                elif n > 1:
-                    if ordered:
-                        fout.write("\t".join(["HDR",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              str(blocksAlign.iat[j, 3] + 1),
-                                              str(blocksAlign.iat[j + 1, 2] - 1),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        fout.write("\t".join(["HDR",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              str(blocksAlign.iat[j, 3] - 1),
-                                              str(blocksAlign.iat[j + 1, 2] + 1),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
+    # Blocks are numbered in the order of their first alignment. The alignments of a block stay in the order of allAlignments
+    blockid = pd.factorize(allAlignments.id)[0]
+    order = np.argsort(blockid, kind='stable')
+    ptr = np.concatenate(([0], np.cumsum(np.bincount(blockid)))).astype(np.int64)
+    data = allAlignments.iloc[order]
+    astart = data.aStart.values.astype(np.int64)
+    aend = data.aEnd.values.astype(np.int64)
+    bstart = data.bStart.values.astype(np.int64)
+    bend = data.bEnd.values.astype(np.int64)
+    achr = data.aChr.values[ptr[:-1]]
+    bchr = data.bChr.values[ptr[:-1]]
+    ordered = np.array(["inv" not in s for s in data.state.values[ptr[:-1]]], dtype=bool)
+    nblocks = len(ptr) - 1
+    logger.debug("Number of SR blocks: " + str(nblocks))
+
+    if nc > 1 and nblocks > 0:
+        from multiprocessing import Pool
+        chroms = np.unique(achr, return_inverse=True)[1]
+        chunks = [np.flatnonzero(np.isin(chroms, c)) for c in np.array_split(np.arange(chroms.max()+1), nc)]
+        chunks = [c for c in chunks if len(c) > 0]
+        args = []
+        for c in chunks:
+            rows = np.concatenate([np.arange(ptr[i], ptr[i+1]) for i in c])
+            args.append((astart[rows], aend[rows], bstart[rows], bend[rows], ordered[c], achr[c], bchr[c], np.concatenate(([0], np.cumsum(ptr[c+1] - ptr[c]))), offset))
+        with Pool(processes=nc) as pool:
+            out = pool.starmap(getBlockSVs, args)
+        svs = [None]*nblocks
+        for c, o in zip(chunks, out):
+            for i, s in zip(c, o):
+                svs[i] = s
+    else:
+        svs = getBlockSVs(astart, aend, bstart, bend, ordered, achr, bchr, ptr, offset)
 
-                elif n < offset:
-                    if ordered:
-                        j_prop = abs(n) / (blocksAlign.iat[j, 3] - blocksAlign.iat[j, 2])
-                        j1_prop = abs(n) / (blocksAlign.iat[j + 1, 3] - blocksAlign.iat[j + 1, 2])
-                        sCoord = round(
-                            blocksAlign.iat[j, 1] - j_prop * (blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0]))
-                        eCoord = round(blocksAlign.iat[j + 1, 0] + j1_prop * (
-                                    blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0]))
-                        fout.write("\t".join(["CPL",
-                                              str(sCoord),
-                                              str(eCoord),
-                                              str(blocksAlign.iat[j + 1, 2]),
-                                              str(blocksAlign.iat[j, 3]),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        j_prop = abs(n) / (blocksAlign.iat[j, 2] - blocksAlign.iat[j, 3])
-                        j1_prop = abs(n) / (blocksAlign.iat[j + 1, 2] - blocksAlign.iat[j + 1, 3])
-                        sCoord = round(
-                            blocksAlign.iat[j, 1] - j_prop * (blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0]))
-                        eCoord = round(blocksAlign.iat[j + 1, 0] + j1_prop * (
-                                    blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0]))
-                        fout.write("\t".join(["CPL",
-                                              str(sCoord),
-                                              str(eCoord),
-                                              str(blocksAlign.iat[j + 1, 2]),
-                                              str(blocksAlign.iat[j, 3]),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
+    with open(cwdPath + prefix + "sv.txt", "w") as fout:
+        fout.write("".join(svs))
+    return None
+# END
 
-            elif m > 1:
-                if offset <= n <= 0:
-                    # e = str(min(blocksAlign.iat[j, 3], blocksAlign.iat[j + 1, 2]))
-                    # Using the base upstream to the deletion in the direction of alignment
-                    e = str(blocksAlign.iat[j, 3])
-                    if ordered:
-                        # e = str(min(blocksAlign.iat[j, 3], blocksAlign.iat[j + 1, 2]))
-                        fout.write("\t".join(["DEL",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              e,
-                                              e,
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        # e = str(max(blocksAlign.iat[j, 3], blocksAlign.iat[j + 1, 2]))
-                        fout.write("\t".join(["DEL",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              e,
-                                              e,
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                elif n > 0:
-                    if ordered:
-                        fout.write("\t".join(["HDR",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              str(blocksAlign.iat[j, 3] + 1),
-                                              str(blocksAlign.iat[j + 1, 2] - 1),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        fout.write("\t".join(["HDR",
-                                              str(blocksAlign.iat[j, 1] + 1),
-                                              str(blocksAlign.iat[j + 1, 0] - 1),
-                                              str(blocksAlign.iat[j, 3] - 1),
-                                              str(blocksAlign.iat[j + 1, 2] + 1),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                elif n < offset:
-                    if ordered:
-                        j_prop = abs(n) / (blocksAlign.iat[j, 3] - blocksAlign.iat[j, 2])
-                        j1_prop = abs(n) / (blocksAlign.iat[j + 1, 3] - blocksAlign.iat[j + 1, 2])
-                        sCoord = round(
-                            blocksAlign.iat[j, 1] - j_prop * (blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0]))
-                        eCoord = round(blocksAlign.iat[j + 1, 0] + j1_prop * (
-                                    blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0]))
-                        fout.write("\t".join(["CPL",
-                                              str(sCoord),
-                                              str(eCoord),
-                                              str(blocksAlign.iat[j + 1, 2]),
-                                              str(blocksAlign.iat[j, 3]),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        j_prop = abs(n) / (blocksAlign.iat[j, 2] - blocksAlign.iat[j, 3])
-                        j1_prop = abs(n) / (blocksAlign.iat[j + 1, 2] - blocksAlign.iat[j + 1, 3])
-                        sCoord = round(
-                            blocksAlign.iat[j, 1] - j_prop * (blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0]))
-                        eCoord = round(blocksAlign.iat[j + 1, 0] + j1_prop * (
-                                    blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0]))
-                        fout.write("\t".join(["CPL",
-                                              str(sCoord),
-                                              str(eCoord),
-                                              str(blocksAlign.iat[j + 1, 2]),
-                                              str(blocksAlign.iat[j, 3]),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
 
-            elif m < offset:
-                j_prop = abs(m) / (blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0])
-                j1_prop = abs(m) / (blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0])
-                if n >= offset:
-                    if ordered:
-                        sCoord = round(
-                            blocksAlign.iat[j, 3] - j_prop * (blocksAlign.iat[j, 3] - blocksAlign.iat[j, 2]))
-                        eCoord = round(blocksAlign.iat[j + 1, 2] + j1_prop * (
-                                    blocksAlign.iat[j + 1, 3] - blocksAlign.iat[j + 1, 2]))
-                        fout.write("\t".join(["CPG",
-                                              str(blocksAlign.iat[j + 1, 0]),
-                                              str(blocksAlign.iat[j, 1]),
-                                              str(sCoord),
-                                              str(eCoord),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        sCoord = round(blocksAlign.iat[j, 3] + j_prop * (blocksAlign.iat[j, 2] - blocksAlign.iat[j, 3]))
-                        eCoord = round(blocksAlign.iat[j + 1, 2] - j1_prop * (blocksAlign.iat[j + 1, 2] - blocksAlign.iat[j + 1, 3]))
-                        fout.write("\t".join(["CPG",
-                                              str(blocksAlign.iat[j + 1, 0]),
-                                              str(blocksAlign.iat[j, 1]),
-                                              str(sCoord),
-                                              str(eCoord),
-                                              blocksAlign.iat[0, 5],
-                                              blocksAlign.iat[0, 6]]) + "\n")
-                if n < offset:
-                    maxOverlap = max(abs(m), abs(n))
-                    if abs(m - n) < 0.1 * maxOverlap:  ## no SV if the overlap on both genomes is of similar size
-                        continue
-                    if abs(m) > abs(n):
-                        if ordered:
-                            sCoord = round(blocksAlign.iat[j, 3] - j_prop * (
-                                        blocksAlign.iat[j, 3] - blocksAlign.iat[j, 2]))
-                            eCoord = round(blocksAlign.iat[j + 1, 2] + j1_prop * (
-                                        blocksAlign.iat[j + 1, 3] - blocksAlign.iat[j + 1, 2]))
-                            fout.write("\t".join(["TDM",
-                                                  str(blocksAlign.iat[j + 1, 0]),
-                                                  str(blocksAlign.iat[j, 1]),
-                                                  str(sCoord),
-                                                  str(eCoord),
-                                                  blocksAlign.iat[0, 5],
-                                                  blocksAlign.iat[0, 6]]) + "\n")
-                        else:
-                            sCoord = round(blocksAlign.iat[j, 3] + j_prop * (
-                                        blocksAlign.iat[j, 2] - blocksAlign.iat[j, 3]))
-                            eCoord = round(blocksAlign.iat[j + 1, 2] - j1_prop * (
-                                        blocksAlign.iat[j + 1, 2] - blocksAlign.iat[j + 1, 3]))
-                            fout.write("\t".join(["TDM",
-                                                  str(blocksAlign.iat[j + 1, 0]),
-                                                  str(blocksAlign.iat[j, 1]),
-                                                  str(sCoord),
-                                                  str(eCoord),
-                                                  blocksAlign.iat[0, 5],
-                                                  blocksAlign.iat[0, 6]]) + "\n")
-                    else:
-                        if ordered:
-                            k_prop = abs(n) / (blocksAlign.iat[j, 3] - blocksAlign.iat[j, 2])
-                            k1_prop = abs(n) / (blocksAlign.iat[j + 1, 3] - blocksAlign.iat[j + 1, 2])
-                            sCoord = round(blocksAlign.iat[j, 1] - k_prop * (
-                                        blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0]))
-                            eCoord = round(blocksAlign.iat[j + 1, 0] + k1_prop * (
-                                        blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0]))
-                            fout.write("\t".join(["TDM",
-                                                  str(sCoord),
-                                                  str(eCoord),
-                                                  str(blocksAlign.iat[j + 1, 2]),
-                                                  str(blocksAlign.iat[j, 3]),
-                                                  blocksAlign.iat[0, 5],
-                                                  blocksAlign.iat[0, 6]]) + "\n")
-                        else:
-                            k_prop = abs(n) / (blocksAlign.iat[j, 2] - blocksAlign.iat[j, 3])
-                            k1_prop = abs(n) / (blocksAlign.iat[j + 1, 2] - blocksAlign.iat[j + 1, 3])
-                            sCoord = round(blocksAlign.iat[j, 1] - k_prop * (
-                                        blocksAlign.iat[j, 1] - blocksAlign.iat[j, 0]))
-                            eCoord = round(blocksAlign.iat[j + 1, 0] + k1_prop * (
-                                        blocksAlign.iat[j + 1, 1] - blocksAlign.iat[j + 1, 0]))
-                            fout.write("\t".join(["TDM",
-                                                  str(sCoord),
-                                                  str(eCoord),
-                                                  str(blocksAlign.iat[j + 1, 2]),
-                                                  str(blocksAlign.iat[j, 3]),
-                                                  blocksAlign.iat[0, 5],
-                                                  blocksAlign.iat[0, 6]]) + "\n")
-    fout.close()
-    return None
+def getBlockSVs(astart, aend, bstart, bend, ordered, achr, bchr, ptr, offset):
+    """
+    SVs between consecutive alignments of SR blocks. The alignments of block
+    i are rows ptr[i]:ptr[i+1]. ordered[i] is False for inverted blocks.
+    Returns the sv.txt text for each block.
+    """
+    nblocks = len(ptr) - 1
+    if nblocks == 0:
+        return []
+    # Consecutive alignments j, j+1 of the same block
+    j = np.setdiff1d(np.arange(len(astart) - 1), ptr[1:-1] - 1)
+    blk = np.searchsorted(ptr, j, side='right') - 1
+    o = ordered[blk]
+    a0, a1, b0, b1 = astart[j], aend[j], bstart[j], bend[j]
+    A0, A1, B0, B1 = astart[j+1], aend[j+1], bstart[j+1], bend[j+1]
+    m = A0 - a1 - 1
+    n = np.where(o, B0 - b1 - 1, b1 - B0 - 1)
+    # Alignment lengths in the query genome, in the direction of the alignment
+    bl = np.where(o, b1 - b0, b0 - b1)
+    Bl = np.where(o, B1 - B0, B0 - B1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Overlap in query: the alignments are trimmed proportionally in the reference
+        jp = np.abs(n) / bl
+        j1p = np.abs(n) / Bl
+        cplS = np.rint(a1 - jp * (a1 - a0))
+        cplE = np.rint(A0 + j1p * (A1 - A0))
+        # Overlap in reference: the alignments are trimmed proportionally in the query
+        jp = np.abs(m) / (a1 - a0)
+        j1p = np.abs(m) / (A1 - A0)
+        cpgS = np.where(o, np.rint(b1 - jp * (b1 - b0)), np.rint(b1 + jp * (b0 - b1)))
+        cpgE = np.where(o, np.rint(B0 + j1p * (B1 - B0)), np.rint(B0 - j1p * (B0 - B1)))
+
+    mzero = (offset <= m) & (m <= 0)
+    nzero = (offset <= n) & (n <= 0)
+    nover = n < offset
+    mover = m < offset
+    # TDM is not called when the overlaps on both genomes are of similar size
+    similar = np.abs(m - n) < 0.1 * np.maximum(np.abs(m), np.abs(n))
+    conds = [mzero & (n > 0),
+             (m >= 1) & nzero,
+             (m == 1) & (n == 1),
+             (m >= 1) & (n > 0),
+             (mzero | (m >= 1)) & nover,
+             mover & ~nover,
+             mover & nover & ~similar & (np.abs(m) > np.abs(n)),
+             mover & nover & ~similar & (np.abs(m) <= np.abs(n))]
+    vartype = np.select(conds, np.arange(1, len(conds)+1), 0)
+    names = ["", "INS", "DEL", "SNP", "HDR", "CPL", "CPG", "TDM", "TDM"]
+    # In inverted blocks, the query gap is bounded by one base before b1 and after B0
+    qs = np.where(o, b1 + 1, b1 - 1)
+    qe = np.where(o, B0 - 1, B0 + 1)
+    # Unused entries of cplS/cpgS can be inf or nan
+    with np.errstate(invalid='ignore'):
+        c1 = np.select([vartype == 1, vartype <= 4, vartype == 5, vartype <= 7], [a1, a1 + 1, cplS, A0], cplS).astype(np.int64)
+        c2 = np.select([vartype == 1, vartype <= 4, vartype == 5, vartype <= 7], [a1, A0 - 1, cplE, a1], cplE).astype(np.int64)
+        c3 = np.select([vartype == 1, vartype == 2, vartype <= 4, vartype == 5, vartype <= 7], [qs, b1, qs, B0, cpgS], B0).astype(np.int64)
+        c4 = np.select([vartype == 1, vartype == 2, vartype <= 4, vartype == 5, vartype <= 7], [qe, b1, qe, b1, cpgE], b1).astype(np.int64)
+
+    svs = [[] for _ in range(nblocks)]
+    for k in np.flatnonzero(vartype):
+        i = blk[k]
+        svs[i].append("\t".join([names[vartype[k]], str(c1[k]), str(c2[k]), str(c3[k]), str(c4[k]), achr[i], bchr[i]]) + "\n")
+
+    amin = np.minimum.reduceat(np.minimum(astart, aend), ptr[:-1])
+    amax = np.maximum.reduceat(np.maximum(astart, aend), ptr[:-1])
+    bmin = np.minimum.reduceat(np.minimum(bstart, bend), ptr[:-1])
+    bmax = np.maximum.reduceat(np.maximum(bstart, bend), ptr[:-1])
+    return ["\t".join(["#", str(amin[i]), str(amax[i]), str(bmin[i]), str(bmax[i]), achr[i], bchr[i]]) + "\n" + "".join(svs[i]) for i in range(nblocks)]
 # END
 
 
@@ -449,7 +166,7 @@ def addsvseq(svfin: str, refname: str, qryname: str, chrlink: dict):
     with open(svfin, 'r') as fin:
         for line in fin:
             svdata.append(line.strip().split())
-    gseq = readfasta(refname)
+    gseq = getGenomeStore(refname)
     # Add reference genome sequence
     for sv in svdata:
         if sv[0] not in vt:
@@ -458,13 +175,11 @@ def addsvseq(svfin: str, refname: str, qryname: str, chrlink: dict):
         if sv[0] == 'INS':
             sv.append('-')
             continue
-        sv.append(gseq[sv[5]][(int(sv[1])-1):int(sv[2])])
+        sv.append(gseq.fetch(sv[5], int(sv[1])-1, int(sv[2])).decode())
     # Add query genome sequence
-    gseq = readfasta(qryname)
-    if len(chrlink) > 0:
-        for k, v in chrlink.items():
-            gseq[chrlink[k]] = gseq[k]
-            gseq.pop(k)
+    gseq = getGenomeStore(qryname)
+    # Query chromosome IDs for the reference chromosome IDs used in sv.txt
+    qchr = {v: k for k, v in chrlink.items()}
     for sv in svdata:
         if sv[0] not in vt:
             sv.append('-')
@@ -474,110 +189,73 @@ def addsvseq(svfin: str, refname: str, qryname: str, chrlink: dict):
             continue
         # Check whether SV corresponds to inversion
         if int(sv[3]) < int(sv[4]):
-            sv.append(gseq[sv[6]][(int(sv[3]) - 1):int(sv[4])])
+            sv.append(gseq.fetch(qchr.get(sv[6], sv[6]), int(sv[3]) - 1, int(sv[4])).decode())
         else:
             # reverse complement sequence from SVs in inverted regions
-            sv.append(revcomp(gseq[sv[6]][(int(sv[4])-1):int(sv[3])]))
+            sv.append(revcomp(gseq.fetch(qchr.get(sv[6], sv[6]), int(sv[4])-1, int(sv[3]))).decode())
     with open(svfin, 'w') as fout:
         for sv in svdata:
             fout.write("\t".join(sv) + '\n')
 # END
 
 
-def getNotAligned(cwdPath, prefix, ref, qry, chrlink):
-    logger = logging.getLogger("getNA")
+def getUncovered(chrom, start, end, size):
+    """
+    Regions of the chromosomes not covered by the intervals (start, end).
+    size is a dict of chromosome lengths. Covered intervals are merged per
+    chromosome with a cumulative maximum of the ends, in the order of
+    (chrom, start, end).
+    :return: chromosome, start and end of the uncovered regions, sorted by chromosome and position
+    """
+    chrs, code = np.unique(np.asarray(chrom, dtype=object), return_inverse=True)
+    order = np.lexsort((end, start, code))
+    code = code[order]
+    start = np.asarray(start, dtype=np.int64)[order]
+    end = np.asarray(end, dtype=np.int64)[order]
+    chrsize = np.array([size[c] for c in chrs], dtype=np.int64)
+    if len(start) == 0:
+        return chrs[code], start, end
+    first = np.r_[True, code[1:] != code[:-1]]
+    last = np.r_[code[1:] != code[:-1], True]
+    # Shifting each chromosome above the previous ones makes the running maximum restart at every chromosome
+    shift = code * (max(end.max(), 0) + 1)
+    maxend = np.maximum.accumulate(end + shift) - shift
+    # The running maximum before each interval starts at the end of the first interval of the chromosome
+    prevmax = np.where(first, end, np.r_[0, maxend[:-1]])
+    # Regions before the first interval, between intervals and after the last interval of each chromosome
+    lead = first & (start > 1)
+    gap = start > prevmax + 1
+    trail = last & (maxend < chrsize[code])
+    rows = np.concatenate((np.flatnonzero(lead), np.flatnonzero(gap), np.flatnonzero(trail)))
+    slot = np.repeat([0, 1, 2], [lead.sum(), gap.sum(), trail.sum()])
+    gs = np.concatenate((np.ones(lead.sum(), dtype=np.int64), prevmax[gap] + 1, maxend[trail] + 1))
+    ge = np.concatenate((start[lead] - 1, start[gap] - 1, chrsize[code[trail]]))
+    o = np.lexsort((slot, rows))
+    return chrs[code[rows[o]]], gs[o], ge[o]
+# END
 
-    refSize = {chrid: len(seq) for chrid, seq in readfasta(ref).items()}
-    qrySize = {chrid: len(seq) for chrid, seq in readfasta(qry).items()}
-    # qrySize = {fasta.id: len(fasta.seq) for fasta in parse(qry,'fasta')}
 
-    annoCoords = pd.DataFrame()
-    for fileType in ["syn","inv", "TL", "invTL","dup", "invDup"]:
-        try:
-            fileData = pd.read_table(cwdPath+prefix+fileType+"Out.txt", header=None, dtype = object)
-        except pd.errors.ParserError as e:
-            fileData = pd.read_table(cwdPath+prefix+fileType+"Out.txt", header=None, dtype = object, engine ="python")
-        except pd.errors.EmptyDataError:
-            print(fileType, "Out.txt is empty. Skipping analysing it.")
-            continue
-        except Exception as e:
-            print("ERROR: while trying to read ", fileType, "Out.txt", e)
-            continue
-        coordsData = fileData.loc[fileData[0] == "#",[2,3,6,7,1,5]].copy()
-        coordsData[[2,3,6,7]] = coordsData[[2,3,6,7]].astype(dtype="int64")
-        coordsData.columns = ["aStart","aEnd","bStart","bEnd","aChr","bChr"]
-        # annoCoords = annoCoords.append(coordsData.copy())
-        annoCoords = pd.concat([annoCoords, coordsData.copy()])
+def getNotAligned(cwdPath, prefix, ref, qry, chrlink, srdata=None):
+    logger = logging.getLogger("getNA")
 
-    try:
-        fileData = pd.read_table(cwdPath+prefix+"ctxOut.txt", header = None, dtype = object)
-    except pd.errors.ParserError as e:
-        fileData = pd.read_table(cwdPath+prefix+"ctxOut.txt", header=None, dtype = object, engine ="python")
-    except pd.errors.EmptyDataError:
-        print("ctxOut.txt is empty. Skipping analysing it.")
-    except Exception as e:
-        print("ERROR: while trying to read ", fileType, "Out.txt", e)
-#    fileData = pd.read_table(cwdPath+prefix+"ctxOut.txt", header = None, names = list(range(11)), dtype = object, sep ="\t")
-    coordsData = fileData.loc[fileData[0] == "#"]
-    coordsData = coordsData[[2,3,6,7,1,5]].copy()
-    coordsData[[2,3,6,7]] = coordsData[[2,3,6,7]].astype(dtype="int64")
-    coordsData.columns = ["aStart","aEnd","bStart","bEnd","aChr","bChr"]
+    refSize = getGenomeStore(ref).lengths
+    qrySize = getGenomeStore(qry).lengths
+    # qrySize = {fasta.id: len(fasta.seq) for fasta in parse(qry,'fasta')}
 
-    # annoCoords = annoCoords.append(coordsData.copy())
-    annoCoords = pd.concat([annoCoords, coordsData.copy()])
-    annoCoords.sort_values(by = ["aChr", "aStart","aEnd","bChr", "bStart","bEnd"], inplace = True)
-    annoCoords.index = range(len(annoCoords))
+    if srdata is None:
+        srdata = srResults.fromFiles(cwdPath, prefix)
+    annoCoords = srdata.blocks()
 
-    for i in annoCoords.bChr:
+    for i in pd.unique(annoCoords.bChr):
         if i not in qrySize.keys():
             for k,v in chrlink.items():
                 if v == i:
                     qrySize[i] = qrySize.pop(k)
 
     with open(cwdPath + prefix+"notAligned.txt","w") as fout:
-        df = annoCoords[["aStart","aEnd","aChr"]].copy()
-        df.sort_values(["aChr", "aStart", "aEnd"], inplace = True)
-        for chrom in sorted(annoCoords.aChr.unique()):
-            chromData = df.loc[df.aChr == chrom]
-            maxEnd = chromData.iloc[0,1]
-            if chromData.iloc[0,0] > 1:
-                fout.write("\t".join(["R",str(1),
-                                          str(chromData.iloc[0,0] - 1),
-                                          chrom]) + "\n")
-            for row in chromData.itertuples(index = False):
-                if row.aStart > maxEnd+1:
-                    fout.write("\t".join(["R",str(maxEnd+1),
-                                          str(row.aStart - 1),
-                                          chrom]) + "\n")
-                if row.aEnd > maxEnd:
-                    maxEnd = row.aEnd
-            if maxEnd < refSize[chrom]:
-                fout.write("\t".join(["R",str(maxEnd+1),
-                                          str(refSize[chrom]),
-                                          chrom]) + "\n")
-
-
-        df = annoCoords[["bStart","bEnd","bChr"]].copy()
-        df.sort_values(["bChr", "bStart", "bEnd"], inplace = True)
-        for chrom in sorted(annoCoords.bChr.unique()):
-            chromData = df.loc[df.bChr == chrom]
-            maxEnd = chromData.iloc[0,1]
-            if chromData.iloc[0,0] > 1:
-                fout.write("\t".join(["Q",str(1),
-                                          str(chromData.iloc[0,0] - 1),
-                                          chrom]) + "\n")
-            for row in chromData.itertuples(index = False):
-                if row.bStart > maxEnd+1:
-                    fout.write("\t".join(["Q",str(maxEnd+1),
-                                          str(row.bStart - 1),
-                                          chrom]) + "\n")
-                if row.bEnd > maxEnd:
-                    maxEnd = row.bEnd
-            if maxEnd < qrySize[chrom]:
-                fout.write("\t".join(["Q",str(maxEnd+1),
-                                          str(qrySize[chrom]),
-                                          chrom]) + "\n")
-
-#    fout.close()
+        for g, (c, s, e), size in [("R", ["aChr", "aStart", "aEnd"], refSize), ("Q", ["bChr", "bStart", "bEnd"], qrySize)]:
+            chrom, start, end = getUncovered(annoCoords[c].values, annoCoords[s].values, annoCoords[e].values, size)
+            fout.write("".join([g + "\t" + str(start[i]) + "\t" + str(end[i]) + "\t" + chrom[i] + "\n" for i in range(len(chrom))]))
     return None
 # END
+
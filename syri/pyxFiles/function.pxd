@@ -3,41 +3,87 @@
 
 import numpy as np
 from syri.scripts.func import *
-from igraph import Graph
 from collections import deque
 from scipy.stats import *
 import logging
 import sys
 
 from libcpp.vector cimport vector as cpp_vec
+from libcpp.algorithm cimport sort as cpp_sort
 
 cimport numpy as np
 cimport cython
 np.random.seed(1)
 
+@cython.boundscheck(False)
+@cython.wraparound(False)
 cpdef inline getOverlapWithSynBlocks(np.ndarray[np.int64_t, ndim=1] start, np.ndarray[np.int64_t, ndim=1] end, np.ndarray chrom, np.ndarray[np.int64_t, ndim=1] in_start, np.ndarray[np.int64_t, ndim=1] in_end, np.ndarray in_chrom, np.int64_t threshold, np.int64_t count, np.int64_t tUC, np.float_t tUP):
+    # For each region, check whether it has enough sequence not covered by the in-place blocks.
+    # In-place blocks are sorted once by chromosome and start. The overlapping blocks of a region
+    # are found with binary search on the start and on the running maximum of the end, and are then
+    # processed in their input order.
 
     assert(len(start) == len(end) == len(chrom) ==count)
     assert(len(in_start) == len(in_end) == len(in_chrom))
 
-    cdef Py_ssize_t i, j, n = len(in_start)
-    cdef np.int64_t blockuni, s, e
+    cdef Py_ssize_t i, k, p, lo, hi, mid, bs, be, n = len(in_start)
+    cdef np.int64_t blockuni, s, e, j
     cdef np.ndarray[np.npy_bool, ndim = 1, cast=True] uni = np.zeros(count, dtype="bool")
-    cdef np.ndarray[np.int64_t, ndim=1] blocks
+    cdef long[::1] code, in_code, order, ss, se, cm, bucketstart, bucketend
+    cdef cpp_vec[long] blocks
 
-    for i in range(count):
-        blocks = np.zeros(n, dtype="int")
-        blockuni = 0
-        s = start[i]
-        e = end[i]
-        c = chrom[i]
-        for j in range(n):
-            if (in_start[j] < end[i]) and (in_end[j] > start[i]) and (in_chrom[j] == c):
-                blocks[j] = 1
+    _, codes = np.unique(np.concatenate((chrom, in_chrom)).astype(str), return_inverse=True)
+    code = codes[:count].astype(np.int64)
+    in_code = codes[count:].astype(np.int64)
+    order = np.lexsort((np.arange(n), in_start, in_code)).astype(np.int64)
+    ss = in_start[order]
+    se = in_end[order]
+    cm = np.empty(n, dtype=np.int64)
+    # Range of sorted in-place blocks for each chromosome code
+    sortedcode = np.asarray(in_code)[order]
+    bucketstart = np.searchsorted(sortedcode, np.arange(codes.max()+1 if len(codes) > 0 else 0), side='left').astype(np.int64)
+    bucketend = np.searchsorted(sortedcode, np.arange(codes.max()+1 if len(codes) > 0 else 0), side='right').astype(np.int64)
 
+    with nogil:
+        # Running maximum of block ends within each chromosome
+        for p in range(n):
+            if p == 0 or in_code[order[p]] != in_code[order[p-1]]:
+                cm[p] = se[p]
+            else:
+                cm[p] = max(cm[p-1], se[p])
 
-        for j in range(len(blocks)):
-            if blocks[j] == 1:
+        for i in range(count):
+            blockuni = 0
+            s = start[i]
+            e = end[i]
+            bs = bucketstart[code[i]]
+            be = bucketend[code[i]]
+            # Blocks starting before the end of the region
+            lo, hi = bs, be
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if ss[mid] < end[i]:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            hi = lo
+            # First block in that range whose running maximum end is after the region start
+            lo = bs
+            k = hi
+            while lo < k:
+                mid = (lo + k) // 2
+                if cm[mid] > start[i]:
+                    k = mid
+                else:
+                    lo = mid + 1
+            blocks.clear()
+            for p in range(lo, hi):
+                if se[p] > start[i]:
+                    blocks.push_back(order[p])
+            cpp_sort(blocks.begin(), blocks.end())
+
+            for k in range(<Py_ssize_t> blocks.size()):
+                j = blocks[k]
                 if (in_start[j] - s < threshold) and (e - in_end[j] < threshold):
                     s = e
                     break
@@ -50,118 +96,168 @@ cpdef inline getOverlapWithSynBlocks(np.ndarray[np.int64_t, ndim=1] start, np.nd
                     else:
                         s = e
                         break
-        blockuni+= (e-s)
+            blockuni+= (e-s)
 
-        if (blockuni > tUC) or (blockuni > tUP*(end[i]-start[i])):
-            uni[i]=True
+            if (blockuni > tUC) or (blockuni > tUP*(end[i]-start[i])):
+                uni[i]=True
     return uni
 
 
+cdef inline void mesearch(long i, long[::1] st, long[::1] en, long[::1] grpptr, long[::1] grpidx, long g, int threshold, float tdolp, cpp_vec[unsigned int] &out) noexcept nogil:
+    # Members of group g (sorted by start) which are mutually exclusive with block i
+    cdef long index, j, overlap
+    for index in range(grpptr[g], grpptr[g+1]):
+        j = grpidx[index]
+        if en[j] < st[i]: continue
+        if st[j] > en[i]: break
+        if j==i: continue
+        if st[j] - threshold < st[i] and en[j] + threshold > en[i]:
+            out.push_back(j)
+            continue
+        overlap = min(en[i], en[j]) - max(st[i], st[j])
+        if (<double> overlap)/(en[i] - st[i]) > tdolp:
+            out.push_back(j)
+
+
+cdef inline flatgroups(groups):
+    # Dict of member arrays (keys 0..n-1) to CSR arrays
+    lens = np.array([len(groups[i]) for i in range(len(groups))], dtype=np.int64)
+    ptr = np.zeros(len(lens)+1, dtype=np.int64)
+    np.cumsum(lens, out=ptr[1:])
+    idx = np.concatenate([np.asarray(groups[i], dtype=np.int64) for i in range(len(groups))]) if len(groups) > 0 else np.zeros(0, dtype=np.int64)
+    return ptr, idx
+
+
+cdef inline csrfromvec(cpp_vec[long] &ptr, cpp_vec[unsigned int] &idx):
+    cdef Py_ssize_t k
+    cdef long[::1] optr = np.empty(ptr.size(), dtype=np.int64)
+    cdef unsigned int[::1] oidx = np.empty(idx.size(), dtype=np.uint32)
+    for k in range(<Py_ssize_t> ptr.size()):
+        optr[k] = ptr[k]
+    for k in range(<Py_ssize_t> idx.size()):
+        oidx[k] = idx[k]
+    return np.asarray(optr), np.asarray(oidx)
+
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 cpdef inline getmeblocks(long[:] astart, long[:] aend, long[:] bstart, long[:] bend, int threshold, long[:] aUni, long[:] bUni, long[:] status, long[:] aIndex, long[:] bIndex, aGroups, bGroups, long[:] clstrsize, float tdolp):
     # Function take the coordinates and cluster information of all translocated blocks and identifies mutually exclusive
-    #  blocks (candidates with which a given candidate cannot co-exist) by comparing the coordinates of each block to the coordinates of the member blocks in its cluster
+    #  blocks (candidates with which a given candidate cannot co-exist) by comparing the coordinates of each block to the coordinates of the member blocks in its cluster.
+    # Returns:
+    #   rem: blocks that are not unique in either genome
+    #   mekind: 1 if the block cannot be selected when any block in its meTo row is selected (overlaps inplace blocks in one genome),
+    #           2 if it becomes redundant when blocks from both its meA and meB rows are selected, 0 otherwise
+    #   meto, mea, meb: (indptr, indices) CSR arrays of mutually exclusive blocks
     logger = logging.getLogger("getmeblocks")
-    cdef np.ndarray[np.int64_t, ndim=1] members, temp
-    cdef np.ndarray[np.npy_bool, ndim=1, cast=True] meb, meb_a, meb_b, rem = np.zeros(len(astart), dtype="bool")
-    cdef int overlap
-    cdef np.int64_t i, j, index
-    meblock = {}            ## for blocks which are overlapping with inplace blocks
-    melist = {}             ## for blocks which are not overlapping with inplace blocks
-
-    for i in range(len(astart)):
-        if i%50000 == 0:
-            logger.debug("Number of mutually exclusive blocks identified " + str(i))
-        if not aUni[i] and not bUni[i]:
-            rem[i] = True
-        elif status[i] == 1:
-            continue
-        elif clstrsize[i] >= 10000:
-            continue
-        elif not aUni[i]:
-            members = bGroups[bIndex[i]]
-            meb = np.zeros(len(members), dtype="bool")              ## vector of mutually exclusive block
-            for index in range(len(members)):
-                j = members[index]
-                if bend[j] < bstart[i]: continue
-                if bstart[j] > bend[i]: break
-                if j==i: continue
-                if bstart[j] - threshold < bstart[i] and bend[j] + threshold > bend[i]:
-                    meb[index]=True
-                    continue
-                overlap = min(bend[i], bend[j]) - max(bstart[i], bstart[j])
-                if overlap/(bend[i] - bstart[i]) > tdolp:
-                    meb[index]=True
-            meblock[i] = np.array(members[meb], dtype="uint32")
-        elif not bUni[i]:
-            members = aGroups[aIndex[i]]
-            meb = np.zeros(len(members), dtype="bool")               ## vector of mutually exclusive block
-            for index in range(len(members)):
-                j = members[index]
-                if aend[j] < astart[i]: continue
-                if astart[j] > aend[i]: break
-                if j==i: continue
-                if astart[j] - threshold < astart[i] and aend[j]+threshold > aend[i]:
-                    meb[index] = True
-                    continue
-                overlap = min(aend[i], aend[j]) - max(astart[i], astart[j])
-                if overlap/(aend[i] - astart[i]) > tdolp:
-                    meb[index] = True
-            meblock[i] = np.array(members[meb], dtype="uint32")
-        else:
-            members = aGroups[aIndex[i]]
-            meb_a = np.zeros(len(members), dtype="bool")             ## vector of mutually exclusive block on A genome
-            for index in range(len(members)):
-                j = members[index]
-                if aend[j] < astart[i]: continue
-                if astart[j] > aend[i]: break
-                if j==i: continue
-                if astart[j] - threshold < astart[i] and aend[j]+threshold > aend[i]:
-                    meb_a[index] = True
-                    continue
-                overlap = min(aend[i], aend[j]) - max(astart[i], astart[j])
-                if overlap/(aend[i] - astart[i]) > tdolp:
-                    meb_a[index] = True
-            temp = members[meb_a]
-
-            members = bGroups[bIndex[i]]
-            meb_b = np.zeros(len(members), dtype="bool")             ## vector of mutually exclusive block on B genome
-            for index in range(len(members)):
-                j = members[index]
-                if bend[j] < bstart[i]: continue
-                if bstart[j] > bend[i]: break
-                if j==i: continue
-                if bstart[j] - threshold < bstart[i] and bend[j] + threshold > bend[i]:
-                    meb_b[index] = True
+    cdef:
+        Py_ssize_t                  i, n = len(astart)
+        long                        rowstart
+        long[::1]                   ast = np.ascontiguousarray(astart, dtype=np.int64)
+        long[::1]                   aen = np.ascontiguousarray(aend, dtype=np.int64)
+        long[::1]                   bst = np.ascontiguousarray(bstart, dtype=np.int64)
+        long[::1]                   ben = np.ascontiguousarray(bend, dtype=np.int64)
+        long[::1]                   aptr, aidx, bptr, bidx
+        unsigned char[::1]          rem = np.zeros(n, dtype=np.uint8)
+        unsigned char[::1]          mekind = np.zeros(n, dtype=np.uint8)
+        cpp_vec[long]               toptr, maptr, mbptr
+        cpp_vec[unsigned int]       toidx, maidx, mbidx
+    aptr, aidx = flatgroups(aGroups)
+    bptr, bidx = flatgroups(bGroups)
+    logger.debug("Finding mutually exclusive blocks for " + str(n) + " candidates")
+
+    with nogil:
+        toptr.push_back(0)
+        maptr.push_back(0)
+        mbptr.push_back(0)
+        for i in range(n):
+            if not aUni[i] and not bUni[i]:
+                rem[i] = True
+            elif status[i] == 1:
+                pass
+            elif clstrsize[i] >= 10000:
+                pass
+            elif not aUni[i]:
+                rowstart = toidx.size()
+                mesearch(i, bst, ben, bptr, bidx, bIndex[i], threshold, tdolp, toidx)
+                if <long> toidx.size() > rowstart:
+                    mekind[i] = 1
+            elif not bUni[i]:
+                rowstart = toidx.size()
+                mesearch(i, ast, aen, aptr, aidx, aIndex[i], threshold, tdolp, toidx)
+                if <long> toidx.size() > rowstart:
+                    mekind[i] = 1
+            else:
+                mesearch(i, ast, aen, aptr, aidx, aIndex[i], threshold, tdolp, maidx)
+                mesearch(i, bst, ben, bptr, bidx, bIndex[i], threshold, tdolp, mbidx)
+                mekind[i] = 2
+            toptr.push_back(toidx.size())
+            maptr.push_back(maidx.size())
+            mbptr.push_back(mbidx.size())
+    return np.asarray(rem).astype(bool), np.asarray(mekind), csrfromvec(toptr, toidx), csrfromvec(maptr, maidx), csrfromvec(mbptr, mbidx)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef inline getCandidateEdges(long[:] astart, long[:] aend, long[:] bstart, long[:] bend, long[:] bdir, long[:] achr, long[:] bchr, long threshold, long gap):
+    """
+    Candidate edges between alignments which can be consecutive in a block.
+    Alignment i -> j (i < j) when both are on the same pair of chromosomes
+    (integer codes achr/bchr, None for a single pair), j starts and ends
+    more than threshold after i in the reference, and the gap between them
+    is smaller than gap. In the query, j should follow i in the same way if
+    bdir[i] == 1 (or bdir is None), and precede it otherwise.
+
+    Alignments are bucketed by chromosome pair and sorted by aStart, so only
+    alignments starting within the gap window of i are scanned.
+
+    Returns the edges in CSR format (indptr, indices) with children sorted.
+    """
+    cdef:
+        Py_ssize_t n = astart.shape[0]
+        Py_ssize_t i, j, k, p, lo, hi, mid, rowstart
+        long[::1] order, pos, bucketend, sast
+        long[::1] indptr = np.zeros(n+1, dtype=np.int64)
+        cpp_vec[long] indices
+        bint fwd
+    if n == 0:
+        return np.asarray(indptr), np.zeros(0, dtype=np.int64)
+    ach = np.zeros(n, dtype=np.int64) if achr is None else np.asarray(achr)
+    bch = np.zeros(n, dtype=np.int64) if bchr is None else np.asarray(bchr)
+    order = np.lexsort((np.arange(n), np.asarray(astart), bch, ach)).astype(np.int64)
+    pos = np.empty(n, dtype=np.int64)
+    pos.base[order] = np.arange(n)
+    sast = np.asarray(astart)[order].astype(np.int64)
+    # bucketend[p]: end of the chromosome-pair bucket containing sorted position p
+    brk = np.nonzero((np.diff(ach[order]) != 0) | (np.diff(bch[order]) != 0))[0] + 1
+    bucketend = np.repeat(np.append(brk, n), np.diff(np.concatenate(([0], brk, [n])))).astype(np.int64)
+    with nogil:
+        for i in range(n):
+            fwd = bdir is None or bdir[i] == 1
+            # First alignment in the bucket with aStart > astart[i] + threshold
+            lo, hi = pos[i], bucketend[pos[i]]
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if sast[mid] - astart[i] > threshold:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            rowstart = indices.size()
+            p = lo
+            while p < bucketend[pos[i]] and sast[p] - aend[i] < gap:
+                j = order[p]
+                p += 1
+                if j <= i or aend[j] - aend[i] <= threshold:
                     continue
-                overlap = min(bend[i], bend[j]) - max(bstart[i], bstart[j])
-                if overlap/(bend[i] - bstart[i]) > tdolp:
-                    meb_b[index] = True
-            melist[i] = (np.array(temp, dtype="uint32"), np.array(members[meb_b], dtype="uint32"))
-    return rem, meblock, melist
-
-
-cpdef inline getConnectivityGraph(blocksList):
-    from igraph import Graph
-    outOG = Graph().as_directed()
-    outOG.add_vertices(len(blocksList))
-    if len(blocksList) == 0:
-        return outOG
-
-    ## Add edges and edge weight
-    edgeList = deque()
-    esWeight = deque()
-    sourceList = deque()
-    targetList = deque()
-    for i in blocksList:
-        if len(i.children) > 0:
-            edgeList.extend(list(zip([i.id]*len(i.children), i.children)))
-            esWeight.extend([-i.score]*len(i.children))
-            sourceList.extend([i.id]*len(i.children))
-            targetList.extend(i.children)
-    outOG.add_edges(list(edgeList))
-    outOG.es["weight"] = list(esWeight)
-    outOG.es["source"] = list(sourceList)
-    outOG.es["target"] = list(targetList)
-    return outOG
+                if fwd:
+                    if bstart[j] - bend[i] < gap and bstart[j] - bstart[i] > threshold and bend[j] - bend[i] > threshold:
+                        indices.push_back(j)
+                else:
+                    if bend[i] - bstart[j] < gap and bstart[i] - bstart[j] > threshold and bend[i] - bend[j] > threshold:
+                        indices.push_back(j)
+            cpp_sort(indices.begin() + rowstart, indices.end())
+            indptr[i+1] = indices.size()
+    out = np.empty(indices.size(), dtype=np.int64)
+    for k in range(<Py_ssize_t> indices.size()):
+        out[k] = indices[k]
+    return np.asarray(indptr), out
@@ -7,17 +7,20 @@ from libcpp.map cimport map as cpp_map
 from libcpp.vector cimport vector as cpp_vec
 from libcpp.deque cimport deque as cpp_deq
 from libcpp cimport bool as bool_t
+from libc.math cimport INFINITY
 from syri.scripts.func import unlist
 import pandas as pd
 from gc import collect
+from itertools import chain
 import logging
 from syri.synsearchFunctions import apply_TS, alignmentBlock
-from syri.pyxFiles.function cimport getConnectivityGraph
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from cython.operator cimport dereference as deref, preincrement as inc
 
 
 cimport numpy as np
+cimport cython
 
 np.random.seed(1)
 
@@ -55,173 +58,177 @@ cpdef invPath(cpp_map[long, cpp_vec[long]] invpos, long[:, :] neighbour, float[:
         maxid = parents[maxid]
     return [path[i] for i in range(<Py_ssize_t> path.size())]
 
-cdef getProfitable(invblocks, long[:] aStart, long[:] aEnd, long[:] bStart, long[:] bEnd, float[:] iDen, cpp_map[int, cpp_vec[long]] neighbourSyn, float[:] synBlockScore, long[:] aStartSyn, long[:] aEndSyn, long tUC, float tUP, long threshold, brk = -1):
+def getInvGraph(invblocks):
+    """
+    CSR adjacency of the inverted alignment DAG. Returns out-edges (children
+    sorted by id), in-edges (parents sorted by id) and the weight of the
+    edges leaving each node (negative score of the node).
+    """
     cdef:
-        long                            i, j, k, l, current, count
-        long                            n_topo, n_edges, n_syn
-        long                            leftSyn, rightSyn, leftEnd, rightEnd, overlapLength
-        long                            maxid
-        int                             lp, bothuni
-        float                           maxscore, synscore
-        float                           w, revenue, cost
-        Py_ssize_t                      index
-        long[:]                         n = np.array(range(len(invblocks)), dtype=int)
-        long[:]                         topo
-        long[:]                         source, target
-        long[:]                         pred
-        long[:]                         st_list, end_list, stb_list, endb_list, parents
-        float[:]                        profit_list, totscore
-        float[:]                        dist
-        float[:]                        weight
-        long[:,:]                       nsynmap = np.zeros((neighbourSyn.size(), 2), dtype='int64')                  # neighbours of inverted alignments
-        cpp_map[long, cpp_deq[long]]    nodepath
-        cpp_deq[long]                   path, r_path
-        cpp_deq[long]                   startA, endA, startB, endB
-        cpp_deq[float]                  iden
-        bool_t                          isMore
-        # Variable for invPath identification
-        cpp_deq[long]                   st, end, stb, endb
-        cpp_deq[float]                  profit
-        cpp_deq[long]                   stsyn, endsyn
-        float[:]                        parentscore
-        cpp_map[long, cpp_map[long, cpp_deq[long]]]                         canmap
-        cpp_map[long, cpp_map[long, cpp_deq[long]]]                         staenda
-        cpp_map[long, cpp_map[long, cpp_deq[long]]].reverse_iterator        canmap_rit
-        cpp_map[long, cpp_deq[long]].reverse_iterator                       canmap_rit2
-        cpp_map[long, cpp_map[long, long]].iterator                         staenda_it
-        cpp_map[long, cpp_deq[long]].reverse_iterator                       staenda_it2
-        cpp_map[long, cpp_map[long, float]]                                 minparentscore
-        long[:]                                                             sorted_sa
-    
-    
-    #print('starting')
-    n_syn = len(synBlockScore)
-    invG = getConnectivityGraph(invblocks)
-    out = deque()
-
-    # get neighbours of inverted alignments
-    for i in range(<Py_ssize_t> neighbourSyn.size()):
-        nsynmap[i, 0] = neighbourSyn[i][0]
-        nsynmap[i, 1] = neighbourSyn[i][1]
-
-    ## Get topological ordering of the graph
-    indegree = invG.vs.degree('IN')
-    q = deque()
-    toporder = deque()
-    for i in n:
+        Py_ssize_t      i, k, n = len(invblocks)
+        long[::1]       outptr = np.zeros(n+1, dtype=np.int64)
+        long[::1]       inptr = np.zeros(n+1, dtype=np.int64)
+        long[::1]       outidx, inidx, fill
+    for i in range(n):
+        outptr[i+1] = outptr[i] + len(invblocks[i].children)
+    outidx = np.fromiter(chain.from_iterable(b.children for b in invblocks), dtype=np.int64, count=outptr[n])
+    for k in range(outptr[n]):
+        inptr[outidx[k]+1] += 1
+    for i in range(n):
+        inptr[i+1] += inptr[i]
+    inidx = np.empty(outptr[n], dtype=np.int64)
+    fill = np.array(inptr[:n], dtype=np.int64)
+    for i in range(n):
+        for k in range(outptr[i], outptr[i+1]):
+            inidx[fill[outidx[k]]] = i
+            fill[outidx[k]] += 1
+    nodeweight = np.array([-b.score for b in invblocks], dtype=np.float32)
+    return np.asarray(outptr), np.asarray(outidx), np.asarray(inptr), np.asarray(inidx), nodeweight
+
+
+def getTopoOrder(long[::1] outptr, long[::1] outidx, long[::1] inptr):
+    """
+    Kahn's topological ordering of a CSR DAG. Nodes become ready in the
+    order in which their last incoming edge is removed.
+    """
+    cdef:
+        Py_ssize_t      i, k, head = 0, tail = 0, n = outptr.shape[0] - 1
+        long            u, v
+        long[::1]       indegree = np.empty(n, dtype=np.int64)
+        long[::1]       order = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        indegree[i] = inptr[i+1] - inptr[i]
         if indegree[i] == 0:
-            q.append(i)
-
-    cnt = 0
-    while len(q) > 0:
-        u = q.popleft()
-        toporder.append(u)
-        for i in invG.neighbors(u,'OUT'):
-            indegree[i] -= 1
-            if indegree[i] == 0:
-                q.append(i)
-        cnt += 1
-
-    if cnt != len(indegree):
-        print('Cycle found')
+            order[tail] = i
+            tail += 1
+    while head < tail:
+        u = order[head]
+        head += 1
+        for k in range(outptr[u], outptr[u+1]):
+            v = outidx[k]
+            indegree[v] -= 1
+            if indegree[v] == 0:
+                order[tail] = v
+                tail += 1
+    if tail != n:
+        logger = logging.getLogger('getTopoOrder')
+        logger.error('Cycle found in the inverted alignment graph')
         sys.exit()
-
-    topo = np.array(toporder, dtype = int)
-    n_topo = len(topo)
-    # Get order in which the edges need to be transversed
-    source = np.zeros_like(invG.es['source'], dtype=int)
-    target = np.zeros_like(invG.es['source'], dtype=int)
-    weight = np.zeros_like(invG.es['source'], dtype=np.float32)
-
-    index = 0
-    garb = invG.get_adjlist('OUT')
-    for i in range(n_topo):
-        if len(garb[topo[i]]) == 0:
-            continue
-        w = invG.es[invG.get_eid(topo[i], garb[topo[i]][0])]['weight']
-        for j in range(len(garb[topo[i]])):
-            source[index] = topo[i]
-            target[index] = garb[topo[i]][j]
-            weight[index] = w
-            index += 1
-    n_edges = len(source)
-    
-    # Find nodes which have unique high scoring parent/children node.
-    # These nodes could not be the first/last element of a candidate.
-    # This decreases the number of candidates, increasing the performance.
-    outlist = invG.get_adjlist('OUT')
-    inlist = invG.get_adjlist('IN')
-    unistart = deque()
-    uniend = deque()
-    for i in n:
-        if len(outlist[i]) == 1:
-            if len(inlist[outlist[i][0]]) == 1 and inlist[outlist[i][0]][0]==i:
-                stsyn.clear()
-                endsyn.clear()
-                bothuni = 0
-                for j in range(nsynmap[i][0]+1,nsynmap[i][1]):
-                    if j <= nsynmap[outlist[i][0]][0] or j >= nsynmap[outlist[i][0]][1]:
-                        stsyn.push_back(j)
-                for j in range(nsynmap[outlist[i][0]][0]+1, nsynmap[outlist[i][0]][1]):
-                    if j <= nsynmap[i][0] or j >= nsynmap[i][1]:
-                        endsyn.push_back(j)
-                if stsyn.size()==0 and endsyn.size()==0:
-                    unistart.append(i)
-                    uniend.append(outlist[i][0])
-                
-                ## get start node score
-                synscore = np.sum([synBlockScore[j] for j in range(<Py_ssize_t> stsyn.size())])
-                if (iDen[i]*(aEnd[i] - aStart[i] + 1 + bStart[i] - bEnd[i] + 1)) > synscore:
-                    bothuni += 1
-                else:
-                    continue
-                ## get end node score
-                synscore = np.sum([synBlockScore[j] for j in range(<Py_ssize_t> endsyn.size())])
-                if (iDen[outlist[i][0]]*(aEnd[outlist[i][0]] - aStart[outlist[i][0]] + 1 + bStart[outlist[i][0]] - bEnd[outlist[i][0]] + 1)) > synscore:
-                    bothuni += 1
-                else:
-                    continue
-                if bothuni == 2:
-                    unistart.append(i)
-                    uniend.append(outlist[i][0])
-    unistart = set(list(unistart))
-    uniend = set(list(uniend))    
-
-    # Find shortest path to all other nodes from each node
-    for i in n:
-        if i in uniend:
-            continue
-        nodepath.clear()
-        pred = np.array([-1]* <Py_ssize_t> len(n), dtype = int)
-        dist = np.array([np.float32('inf')]*  <Py_ssize_t> len(n), dtype = np.float32)
+    return np.asarray(order)
+
+
+def getInvSegments(long[:, :] nsynmap, long n, int nc):
+    """
+    Split the start alignments [0, n) into contiguous segments. Segments are
+    cut where the left syntenic anchor of the alignments changes and are
+    merged to get a few segments per core.
+    """
+    if n == 0:
+        return []
+    if nc <= 1:
+        return [(0, n)]
+    cuts = np.nonzero(np.diff(np.asarray(nsynmap[:n, 0])) != 0)[0] + 1
+    size = max(1, n//(4*nc))
+    segments = []
+    start = 0
+    for c in cuts:
+        if c - start >= size:
+            segments.append((start, c))
+            start = c
+    segments.append((start, n))
+    return segments
+
+
+def mapSegments(func, segments, int nc):
+    """
+    Apply func to segments using nc threads. Results are in the order of segments.
+    """
+    if nc <= 1 or len(segments) <= 1:
+        return [func(seg) for seg in segments]
+    with ThreadPoolExecutor(max_workers=nc) as pool:
+        return list(pool.map(func, segments))
+
+
+cdef struct invcand:
+    long    st, end, stb, endb
+    float   profit
+
+
+cdef class invScanner:
+    """
+    Enumerates candidate inversions (paths in the inverted alignment DAG)
+    starting from a given alignment. Candidates from different start nodes
+    are independent, so ranges of start nodes can be scanned concurrently;
+    the scanning itself runs without the GIL.
+    """
+    cdef:
+        long            n, n_topo, n_edges, n_syn, tUC
+        float           tUP
+        long[:]         topo, source, target, aStart, aEnd, bStart, bEnd, aStartSyn, aEndSyn
+        float[:]        weight, iDen, synBlockScore
+        long[:,:]       nsynmap
+        unsigned char[::1]  unistart, uniend
+
+    def __init__(self, topo, source, target, weight, unistart, uniend, nsynmap, aStart, aEnd, bStart, bEnd, iDen, synBlockScore, aStartSyn, aEndSyn, long tUC, float tUP):
+        self.topo, self.source, self.target, self.weight = topo, source, target, weight
+        self.unistart, self.uniend, self.nsynmap = unistart, uniend, nsynmap
+        self.aStart, self.aEnd, self.bStart, self.bEnd, self.iDen = aStart, aEnd, bStart, bEnd, iDen
+        self.synBlockScore, self.aStartSyn, self.aEndSyn = synBlockScore, aStartSyn, aEndSyn
+        self.n = len(unistart)
+        self.n_topo = len(topo)
+        self.n_edges = len(source)
+        self.n_syn = len(synBlockScore)
+        self.tUC, self.tUP = tUC, tUP
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    @cython.cdivision(True)
+    cdef long scan(self, long i, float[::1] dist, long[::1] pred, bint emit, long count, const unsigned char[::1] keep,
+                   cpp_vec[invcand] &cands, cpp_vec[long] &paths, cpp_vec[long] &pathptr, cpp_vec[float] &profits, cpp_vec[long] &syns) noexcept nogil:
+        # Find shortest path to all other nodes from node i and report the profitable ones. When emit is set,
+        # the paths of candidates marked in keep (indexed by the global candidate count) are stored.
+        cdef:
+            long                            j, k, l, current, index
+            long                            leftSyn, rightSyn, leftEnd, rightEnd
+            float                           revenue, cost
+            bool_t                          isMore
+            cpp_map[long, cpp_deq[long]]    nodepath
+            cpp_deq[long]                   path, r_path
+            cpp_deq[long]                   startA, endA, startB, endB
+            cpp_deq[float]                  iden
+            invcand                         c
+        if self.uniend[i]:
+            return count
+        for j in range(self.n):
+            pred[j] = -1
+            dist[j] = INFINITY
         dist[i] = 0
         # Process vertices in topological order
         index = 0
-        for j in range(n_topo):
-            for k in range(index, n_edges):
-                if source[k] != topo[j]:
+        for j in range(self.n_topo):
+            for k in range(index, self.n_edges):
+                if self.source[k] != self.topo[j]:
                     break
-                if dist[target[k]] > dist[source[k]] + weight[k]:
-                    dist[target[k]] = dist[source[k]] + weight[k]
-                    pred[target[k]] = source[k]
+                if dist[self.target[k]] > dist[self.source[k]] + self.weight[k]:
+                    dist[self.target[k]] = dist[self.source[k]] + self.weight[k]
+                    pred[self.target[k]] = self.source[k]
                 index+=1
 
-        for j in range(n_topo):
-            if topo[j] in unistart:
+        for j in range(self.n_topo):
+            if self.unistart[self.topo[j]]:
                 continue
             # Find all connected paths which are profitable
-            if dist[topo[j]] != float("inf"):                    
-                current = topo[j]
+            if dist[self.topo[j]] != INFINITY:
+                current = self.topo[j]
                 path.clear()
                 while current!=i:
                     if nodepath.count(current) > 0:
                         for index in range(<Py_ssize_t> nodepath[current].size()):
                             path.push_back(nodepath[current][index])
-                        # path.extend(nodepath[current].copy())
                         break
                     path.push_back(current)
                     current = pred[current]
-                nodepath[topo[j]] = path
+                nodepath[self.topo[j]] = path
                 path.push_back(i)
                 r_path.clear()
                 current = path.size()
@@ -230,104 +237,215 @@ cdef getProfitable(invblocks, long[:] aStart, long[:] aEnd, long[:] bStart, long
 
                 # calculate revenue of the identified path
                 if r_path.size() == 1:
-                    revenue = iDen[r_path[0]]*(aEnd[r_path[0]] - aStart[r_path[0]] + 1 + bStart[r_path[0]] - bEnd[r_path[0]] + 1)
+                    revenue = self.iDen[r_path[0]]*(self.aEnd[r_path[0]] - self.aStart[r_path[0]] + 1 + self.bStart[r_path[0]] - self.bEnd[r_path[0]] + 1)
                 else:
                     revenue = 0
                     # Initiate by adding coordinates of first alignment
-                    startA.push_back(aStart[r_path[0]])
-                    endA.push_back(aEnd[r_path[0]])
-                    startB.push_back(bEnd[r_path[0]])
-                    endB.push_back(bStart[r_path[0]])
-                    iden.push_back(iDen[r_path[0]])
+                    startA.push_back(self.aStart[r_path[0]])
+                    endA.push_back(self.aEnd[r_path[0]])
+                    startB.push_back(self.bEnd[r_path[0]])
+                    endB.push_back(self.bStart[r_path[0]])
+                    iden.push_back(self.iDen[r_path[0]])
 
                     # Add remaining alignments' coordinates iteratively
                     for k in range(1, current):
                         l = r_path[k]
-                        isMore = True if iDen[k] > iden.back() else False
-                        if aStart[l] < endA.back():
+                        isMore = True if self.iDen[k] > iden.back() else False
+                        if self.aStart[l] < endA.back():
                             # In case of overlapping bases, choose score of the alignment with higher identity
                             if isMore:
                                 endA.pop_back()
-                                endA.push_back(aStart[l])
-                                startA.push_back(aStart[l])
-                                endA.push_back(aEnd[l])
+                                endA.push_back(self.aStart[l])
+                                startA.push_back(self.aStart[l])
+                                endA.push_back(self.aEnd[l])
                             else:
                                 startA.push_back(endA.back())
-                                endA.push_back(aEnd[l])
+                                endA.push_back(self.aEnd[l])
                         else:
-                            startA.push_back(aStart[l])
-                            endA.push_back(aEnd[l])
+                            startA.push_back(self.aStart[l])
+                            endA.push_back(self.aEnd[l])
 
-                        if bStart[l] > startB.back():
+                        if self.bStart[l] > startB.back():
                             # In case of overlapping bases, choose score of the alignment with higher identity
                             if isMore:
                                 startB.pop_back()
-                                startB.push_back(bStart[l])
-                                startB.push_back(bEnd[l])
-                                endB.push_back(bStart[l])
+                                startB.push_back(self.bStart[l])
+                                startB.push_back(self.bEnd[l])
+                                endB.push_back(self.bStart[l])
                             else:
                                 endB.push_back(startB.back())
-                                startB.push_back(bEnd[l])
+                                startB.push_back(self.bEnd[l])
                         else:
-                            startB.push_back(bEnd[l])
-                            endB.push_back(bStart[l])
-                        iden.push_back(iDen[l])
-
-                    if startA.size() == endA.size() == startB.size() == endB.size() == iden.size():
-                        for k in range(<Py_ssize_t> iden.size()):
-                            revenue += iden[k]*((endA[k] - startA[k] + 1) + (endB[k] - startB[k] + 1))
-                        startA.clear()
-                        endA.clear()
-                        startB.clear()
-                        endB.clear()
-                        iden.clear()
-                    else:
-                        print('ERROR in calculating revenue')
-                        
-                
+                            startB.push_back(self.bEnd[l])
+                            endB.push_back(self.bStart[l])
+                        iden.push_back(self.iDen[l])
+
+                    for k in range(<Py_ssize_t> iden.size()):
+                        revenue += iden[k]*((endA[k] - startA[k] + 1) + (endB[k] - startB[k] + 1))
+                    startA.clear()
+                    endA.clear()
+                    startB.clear()
+                    endB.clear()
+                    iden.clear()
+
                 # Calculate cost of the identified path
 
                 # Get left and right syntenic neighbours
-                leftSyn = nsynmap[r_path.front()][0] if nsynmap[r_path.front()][0] < nsynmap[r_path.back()][0] else nsynmap[r_path.back()][0]
-                rightSyn = nsynmap[r_path.front()][1] if nsynmap[r_path.front()][1] > nsynmap[r_path.back()][1] else nsynmap[r_path.back()][1]
+                leftSyn = self.nsynmap[r_path.front(), 0] if self.nsynmap[r_path.front(), 0] < self.nsynmap[r_path.back(), 0] else self.nsynmap[r_path.back(), 0]
+                rightSyn = self.nsynmap[r_path.front(), 1] if self.nsynmap[r_path.front(), 1] > self.nsynmap[r_path.back(), 1] else self.nsynmap[r_path.back(), 1]
 
                 #cost of removing all intersecting neighbours
                 cost = 0
                 for k in range(leftSyn+1, rightSyn):
-                    cost += synBlockScore[k]
+                    cost += self.synBlockScore[k]
 
                 # Check whether inversion is overlapping. If yes, then check for uniqueness. If not sufficiently unique, then set high cost.
-                leftEnd = aEndSyn[leftSyn] if leftSyn > -1 else 0
-                rightEnd = aStartSyn[rightSyn] if rightSyn < n_syn else aEnd[r_path.back()]
-                if rightEnd - leftEnd <= tUC:
-                    overlapLength = (leftEnd - aStart[r_path.front()]) + (aEnd[r_path.back()] - rightEnd)
-                    if (rightEnd - leftEnd)/(aEnd[r_path.back()] - aStart[r_path.front()]) < tUP:
+                leftEnd = self.aEndSyn[leftSyn] if leftSyn > -1 else 0
+                rightEnd = self.aStartSyn[rightSyn] if rightSyn < self.n_syn else self.aEnd[r_path.back()]
+                if rightEnd - leftEnd <= self.tUC:
+                    if (<double> (rightEnd - leftEnd))/(self.aEnd[r_path.back()] - self.aStart[r_path.front()]) < self.tUP:
                         cost = 10000000000000
 
                 #  Select those candidate inversions for which the score of
                 #  adding them would be at least 10% better than the score
                 #  of syntenic regions needed to be removed
                 if revenue > 1.1*cost:
-                    st.push_back(aStart[r_path.front()])
-                    end.push_back(aEnd[r_path.back()])
-                    stb.push_back(bEnd[r_path.back()])
-                    endb.push_back(bStart[r_path.front()])
-                    profit.push_back(revenue - cost)
-                    
-        if i == brk:
-            break
-
-    path.clear()
-    lp = st.size()
-    totscore = np.array([profit[i] for i in range(<Py_ssize_t> profit.size())], dtype=np.float32)
-    st_list  = np.array([st[i] for i in range(<Py_ssize_t> st.size())], dtype=int)
-    end_list  = np.array([end[i] for i in range(<Py_ssize_t> end.size())], dtype=int)
-    stb_list  = np.array([stb[i] for i in range(<Py_ssize_t> stb.size())], dtype=int)
-    endb_list  = np.array([endb[i] for i in range(<Py_ssize_t> endb.size())], dtype=int)
-    profit_list = np.array([profit[i] for i in range(<Py_ssize_t> profit.size())], dtype=np.float32)
+                    if not emit:
+                        c.st = self.aStart[r_path.front()]
+                        c.end = self.aEnd[r_path.back()]
+                        c.stb = self.bEnd[r_path.back()]
+                        c.endb = self.bStart[r_path.front()]
+                        c.profit = revenue - cost
+                        cands.push_back(c)
+                    elif keep[count]:
+                        for index in range(<Py_ssize_t> r_path.size()):
+                            paths.push_back(r_path[index])
+                        pathptr.push_back(paths.size())
+                        profits.push_back(revenue - cost)
+                        syns.push_back(leftSyn)
+                        syns.push_back(rightSyn)
+                    count += 1
+        return count
+
+    def scanrange(self, long start, long end, bint emit=False, long count=0, keep=None):
+        """
+        Scan start nodes in [start, end). Without emit, returns the
+        coordinates and profit of all candidates in order. With emit, returns
+        the candidates selected in keep, numbered from count onwards.
+        """
+        cdef:
+            long                i, k
+            float[::1]          dist = np.empty(self.n, dtype=np.float32)
+            long[::1]           pred = np.empty(self.n, dtype=np.int64)
+            const unsigned char[::1]  keepv = keep if keep is not None else np.zeros(1, dtype=np.uint8)
+            cpp_vec[invcand]    cands
+            cpp_vec[long]       paths, pathptr, syns
+            cpp_vec[float]      profits
+        pathptr.push_back(0)
+        with nogil:
+            for i in range(start, end):
+                count = self.scan(i, dist, pred, emit, count, keepv, cands, paths, pathptr, profits, syns)
+        out = []
+        if not emit:
+            for i in range(<Py_ssize_t> cands.size()):
+                out.append((cands[i].st, cands[i].end, cands[i].stb, cands[i].endb, cands[i].profit))
+            return out
+        for i in range(<Py_ssize_t> profits.size()):
+            out.append(([paths[k] for k in range(pathptr[i], pathptr[i+1])], profits[i], syns[2*i], syns[2*i+1]))
+        return out
+
+
+cdef getProfitable(invblocks, long[:] aStart, long[:] aEnd, long[:] bStart, long[:] bEnd, float[:] iDen, cpp_map[int, cpp_vec[long]] neighbourSyn, float[:] synBlockScore, long[:] aStartSyn, long[:] aEndSyn, long tUC, float tUP, long threshold, brk = -1, int nc = 1):
+    cdef:
+        long                            i, j, k
+        long                            n_nodes
+        long                            maxid
+        int                             lp, bothuni
+        float                           maxscore, synscore
+        long[:]                         n = np.array(range(len(invblocks)), dtype=int)
+        long[:]                         topo
+        long[:]                         st_list, end_list, stb_list, endb_list, parents
+        float[:]                        profit_list, totscore
+        long[:,:]                       nsynmap = np.zeros((neighbourSyn.size(), 2), dtype='int64')                  # neighbours of inverted alignments
+        cpp_deq[long]                   path
+        cpp_deq[long]                   stsyn, endsyn
+        unsigned char[::1]              unistart, uniend
+        unsigned char[::1]              keep
+
+    logger = logging.getLogger("getProfitable")
+    outptr, outidx, inptr, inidx, nodeweight = getInvGraph(invblocks)
+    out = deque()
+
+    # get neighbours of inverted alignments
+    for i in range(<Py_ssize_t> neighbourSyn.size()):
+        nsynmap[i, 0] = neighbourSyn[i][0]
+        nsynmap[i, 1] = neighbourSyn[i][1]
+
+    ## Get topological ordering of the graph
+    topo = getTopoOrder(outptr, outidx, inptr)
+    # Get order in which the edges need to be transversed
+    toposize = np.diff(outptr)[topo]
+    source = np.repeat(topo, toposize)
+    target = outidx[np.repeat(outptr[topo] - np.cumsum(toposize) + toposize, toposize) + np.arange(len(outidx))]
+    weight = np.repeat(nodeweight[topo], toposize)
+
+    # Find nodes which have unique high scoring parent/children node.
+    # These nodes could not be the first/last element of a candidate.
+    # This decreases the number of candidates, increasing the performance.
+    unistart = np.zeros(len(n), dtype=np.uint8)
+    uniend = np.zeros(len(n), dtype=np.uint8)
+    for i in n:
+        if outptr[i+1] - outptr[i] == 1:
+            k = outidx[outptr[i]]
+            if inptr[k+1] - inptr[k] == 1 and inidx[inptr[k]] == i:
+                stsyn.clear()
+                endsyn.clear()
+                bothuni = 0
+                for j in range(nsynmap[i][0]+1,nsynmap[i][1]):
+                    if j <= nsynmap[k][0] or j >= nsynmap[k][1]:
+                        stsyn.push_back(j)
+                for j in range(nsynmap[k][0]+1, nsynmap[k][1]):
+                    if j <= nsynmap[i][0] or j >= nsynmap[i][1]:
+                        endsyn.push_back(j)
+                if stsyn.size()==0 and endsyn.size()==0:
+                    unistart[i] = 1
+                    uniend[k] = 1
+                
+                ## get start node score
+                synscore = np.sum([synBlockScore[j] for j in range(<Py_ssize_t> stsyn.size())])
+                if (iDen[i]*(aEnd[i] - aStart[i] + 1 + bStart[i] - bEnd[i] + 1)) > synscore:
+                    bothuni += 1
+                else:
+                    continue
+                ## get end node score
+                synscore = np.sum([synBlockScore[j] for j in range(<Py_ssize_t> endsyn.size())])
+                if (iDen[k]*(aEnd[k] - aStart[k] + 1 + bStart[k] - bEnd[k] + 1)) > synscore:
+                    bothuni += 1
+                else:
+                    continue
+                if bothuni == 2:
+                    unistart[i] = 1
+                    uniend[k] = 1
+
+    scanner = invScanner(topo, source, target, weight, unistart, uniend, nsynmap, aStart, aEnd, bStart, bEnd, iDen, synBlockScore, aStartSyn, aEndSyn, tUC, tUP)
+    # Start nodes after brk are not scanned (unless brk itself is skipped)
+    n_nodes = brk + 1 if 0 <= brk < len(n) and not uniend[brk] else len(n)
+    segments = getInvSegments(nsynmap, n_nodes, nc)
+    logger.debug("Scanning {} start alignments in {} segments".format(n_nodes, len(segments)))
+
+    # Candidate inversions from each segment, in the order of the start alignments
+    segcands = mapSegments(lambda seg: scanner.scanrange(seg[0], seg[1]), segments, nc)
+    cands = list(chain.from_iterable(segcands))
+    lp = len(cands)
+    totscore = np.array([c[4] for c in cands], dtype=np.float32)
+    st_list  = np.array([c[0] for c in cands], dtype=int)
+    end_list  = np.array([c[1] for c in cands], dtype=int)
+    stb_list  = np.array([c[2] for c in cands], dtype=int)
+    endb_list  = np.array([c[3] for c in cands], dtype=int)
+    profit_list = np.array([c[4] for c in cands], dtype=np.float32)
+    profit = profit_list
 
     parents = np.array([-1]*lp, dtype = 'int')
-    
     for i in range(lp):
         for j in range(lp-1,i,-1):
             if st_list[j] > end_list[i]-threshold:
@@ -350,135 +468,15 @@ cdef getProfitable(invblocks, long[:] aStart, long[:] aEnd, long[:] bStart, long
     while parents[maxid] != -1:
         path.push_front(parents[maxid])
         maxid = parents[maxid]
-    goodinvs = set([path[i] for i in range(<Py_ssize_t> path.size())])
-        
-    count = 0
-    for i in n:
-        if i in uniend:
-            continue
-        nodepath.clear()
-        pred = np.array([-1]* <Py_ssize_t> len(n), dtype = int)
-        dist = np.array([np.float32('inf')]*  <Py_ssize_t> len(n), dtype = np.float32)
-        dist[i] = 0
-
-        # Process vertices in topological order
-        index = 0
-        for j in range(n_topo):
-            for k in range(index, n_edges):
-                if source[k] != topo[j]:
-                    break
-                if dist[target[k]] > dist[source[k]] + weight[k]:
-                    dist[target[k]] = dist[source[k]] + weight[k]
-                    pred[target[k]] = source[k]
-                index+=1
-
-        for j in range(n_topo):
-            if topo[j] in unistart:
-                continue
-            # Find all connected paths which are profitable
-            if dist[topo[j]] != float("inf"):
-                current = topo[j]
-                path.clear()
-                while current!=i:
-                    if nodepath.count(current) > 0:
-                        for index in range(<Py_ssize_t> nodepath[current].size()):
-                            path.push_back(nodepath[current][index])
-                        # path.extend(nodepath[current].copy())
-                        break
-                    path.push_back(current)
-                    current = pred[current]
-                nodepath[topo[j]] = path
-                path.push_back(i)
-                r_path.clear()
-
-                current = path.size()
-                for index in range(<Py_ssize_t> path.size()):
-                    r_path.push_back(path[current-index-1])
-
-                # calculate revenue of the identified path
-                if r_path.size() == 1:
-                    revenue = iDen[r_path[0]]*(aEnd[r_path[0]] - aStart[r_path[0]] + 1 + bStart[r_path[0]] - bEnd[r_path[0]] + 1)
-                else:
-                    revenue = 0
-                    # Initiate by adding coordinates of first alignment
-                    startA.push_back(aStart[r_path[0]])
-                    endA.push_back(aEnd[r_path[0]])
-                    startB.push_back(bEnd[r_path[0]])
-                    endB.push_back(bStart[r_path[0]])
-                    iden.push_back(iDen[r_path[0]])
-
-                    # Add remaining alignments' coordinates iteratively
-                    for k in range(1, current):
-                        l = r_path[k]
-                        isMore = True if iDen[k] > iden.back() else False
-                        if aStart[l] < endA.back():
-                            # In case of overlapping bases, choose score of the alignment with higher identity
-                            if isMore:
-                                endA.pop_back()
-                                endA.push_back(aStart[l])
-                                startA.push_back(aStart[l])
-                                endA.push_back(aEnd[l])
-                            else:
-                                startA.push_back(endA.back())
-                                endA.push_back(aEnd[l])
-                        else:
-                            startA.push_back(aStart[l])
-                            endA.push_back(aEnd[l])
-
-                        if bStart[l] > startB.back():
-                            # In case of overlapping bases, choose score of the alignment with higher identity
-                            if isMore:
-                                startB.pop_back()
-                                startB.push_back(bStart[l])
-                                startB.push_back(bEnd[l])
-                                endB.push_back(bStart[l])
-                            else:
-                                endB.push_back(startB.back())
-                                startB.push_back(bEnd[l])
-                        else:
-                            startB.push_back(bEnd[l])
-                            endB.push_back(bStart[l])
-                        iden.push_back(iDen[l])
-
-                    if startA.size() == endA.size() == startB.size() == endB.size() == iden.size():
-                        for k in range(<Py_ssize_t> iden.size()):
-                            revenue += iden[k]*((endA[k] - startA[k] + 1) + (endB[k] - startB[k] + 1))
-                        startA.clear()
-                        endA.clear()
-                        startB.clear()
-                        endB.clear()
-                        iden.clear()
-                    else:
-                        print('ERROR in calculating revenue')
-
-                # Calculate cost of the identified path
-
-                # Get left and right syntenic neighbours
-                leftSyn = nsynmap[r_path.front()][0] if nsynmap[r_path.front()][0] < nsynmap[r_path.back()][0] else nsynmap[r_path.back()][0]
-                rightSyn = nsynmap[r_path.front()][1] if nsynmap[r_path.front()][1] > nsynmap[r_path.back()][1] else nsynmap[r_path.back()][1]
-
-                #cost of removing all intersecting neighbours
-                cost = 0
-                for k in range(leftSyn+1, rightSyn):
-                    cost += synBlockScore[k]
-
-                # Check whether inversion is overlapping. If yes, then check for uniqueness. If not sufficiently unique, then set high cost.
-                leftEnd = aEndSyn[leftSyn] if leftSyn > -1 else 0
-                rightEnd = aStartSyn[rightSyn] if rightSyn < n_syn else aEnd[r_path.back()]
-                if rightEnd - leftEnd <= tUC:
-                    overlapLength = (leftEnd - aStart[r_path.front()]) + (aEnd[r_path.back()] - rightEnd)
-                    if (rightEnd - leftEnd)/(aEnd[r_path.back()] - aStart[r_path.front()]) < tUP:
-                        cost = 10000000000000
-
-                #  Select those candidate inversions for which the score of
-                #  adding them would be at least 10% better than the score
-                #  of syntenic regions needed to be removed
-                if revenue > 1.1*cost:
-                    if count in goodinvs:
-                        out.append(([r_path[k] for k in range(current)], revenue - cost, leftSyn, rightSyn))
-                    count += 1
-        if i == brk:
-            return out
+    keep = np.zeros(lp, dtype=np.uint8)
+    for i in range(<Py_ssize_t> path.size()):
+        keep[path[i]] = 1
+
+    # Re-scan the segments to get the paths of the selected candidates. Each
+    # segment needs the number of candidates found before it.
+    segbase = np.cumsum([0] + [len(c) for c in segcands])
+    jobs = [(seg[0], seg[1], segbase[i]) for i, seg in enumerate(segments) if np.any(np.asarray(keep)[segbase[i]:segbase[i+1]])]
+    out.extend(chain.from_iterable(mapSegments(lambda job: scanner.scanrange(job[0], job[1], True, job[2], keep), jobs, nc)))
     return out
    
 
@@ -535,7 +533,7 @@ cpdef dict getNeighbourSyn(np.ndarray aStartInv, np.ndarray aEndInv, np.ndarray
 
 
 
-def getInversions(coords,chromo, threshold, synData, tUC, tUP, invgl):
+def getInversions(coords,chromo, threshold, synData, tUC, tUP, invgl, nc=1):
     logger = logging.getLogger("getinversion."+chromo)
 
     class inversion:
@@ -582,7 +580,7 @@ def getInversions(coords,chromo, threshold, synData, tUC, tUP, invgl):
 
     synBlockScore = [(i.aLen + i.bLen)*i.iden for index, i in synData.iterrows()]
         
-    profitable = [inversion(i) for i in getProfitable(invblocks, invertedCoordsOri.aStart.values, invertedCoordsOri.aEnd.values, invertedCoordsOri.bStart.values, invertedCoordsOri.bEnd.values, invertedCoordsOri.iden.values.astype('float32'), neighbourSyn, np.array(synBlockScore, dtype = 'float32'), synData.aStart.values, synData.aEnd.values, tUC, tUP, threshold)]
+    profitable = [inversion(i) for i in getProfitable(invblocks, invertedCoordsOri.aStart.values, invertedCoordsOri.aEnd.values, invertedCoordsOri.bStart.values, invertedCoordsOri.bEnd.values, invertedCoordsOri.iden.values.astype('float32'), neighbourSyn, np.array(synBlockScore, dtype = 'float32'), synData.aStart.values, synData.aEnd.values, tUC, tUP, threshold, -1, nc)]
     logger.debug("found profitable " + chromo)
 
     del(invblocks, invTree, neighbourSyn, synBlockScore)
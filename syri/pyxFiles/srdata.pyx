@@ -0,0 +1,210 @@
+# cython: language_level = 3
+# distutils: language = c++
+
+import numpy as np
+import pandas as pd
+import os
+import logging
+
+# Output files of the SR identification, in the order in which they are read
+SRFILES = ["synOut.txt", "invOut.txt", "TLOut.txt", "invTLOut.txt", "dupOut.txt", "invDupOut.txt", "ctxOut.txt"]
+# Classes of SR blocks. The first six correspond to the files in SRFILES, the others are the CTX classes
+SRCLASSES = ["syn", "inv", "TL", "invTL", "dup", "invDup", "ctx", "invCtx", "ctxDup", "ctxInvDup"]
+CTXCLASSES = {"translocation": 6, "invTranslocation": 7, "duplication": 8, "invDuplication": 9}
+# Class names used in the syri.out table
+TABLECLASSES = ["SYN", "INV", "TRANS", "INVTR", "DUP", "INVDP", "TRANS", "INVTR", "DUP", "INVDP"]
+
+
+def srBlock(cls, achr, astart, aend, bchr, bstart, bend, aln, dupgen="", tags=None):
+    """
+    An SR block as collected by the SR stage. cls is the index in
+    SRCLASSES, aln has the aStart, aEnd, bStart, bEnd of the member
+    alignments and tags has their optional label (e.g. Syn_in_Inv).
+    """
+    aln = np.asarray(aln, dtype=np.int64).reshape(-1, 4)
+    return (cls, achr, bchr, int(astart), int(aend), int(bstart), int(bend), dupgen, aln, tags)
+
+
+class srResults:
+    """
+    SR blocks identified by syri and their member alignments, as typed
+    columns. Block i is in file SRFILES[source[i]], has class
+    SRCLASSES[cls[i]] and is on chromosomes chrs[achr[i]] and
+    chrs[bchr[i]]. dupgen[i] is the genome with the extra copy (A/B) for
+    duplications and '' otherwise. The alignments of block i are rows
+    ptr[i]:ptr[i+1] of the alignment columns.
+
+    The SR stage builds the object with fromBlocks and passes it to the
+    SV, ShV and output stages. toFiles exports it as SRFILES and
+    fromFiles reads such an export back (--nosr).
+    """
+    def __init__(self, chrs, source, cls, achr, bchr, astart, aend, bstart, bend, dupgen, ptr, alnastart, alnaend, alnbstart, alnbend, alntag):
+        self.chrs = chrs
+        self.source = source
+        self.cls = cls
+        self.achr = achr
+        self.bchr = bchr
+        self.astart = astart
+        self.aend = aend
+        self.bstart = bstart
+        self.bend = bend
+        self.dupgen = dupgen
+        self.ptr = ptr
+        self.alnastart = alnastart
+        self.alnaend = alnaend
+        self.alnbstart = alnbstart
+        self.alnbend = alnbend
+        self.alntag = alntag
+
+    def __len__(self):
+        return len(self.source)
+
+    @classmethod
+    def fromBlocks(cls, blocks):
+        """
+        SR blocks from a list of srBlock. Blocks are ordered by their file
+        in SRFILES and keep their order within a file.
+        """
+        blocks = sorted(blocks, key=lambda b: min(b[0], 6))
+        chrid = {}
+        for b in blocks:
+            chrid.setdefault(b[1], len(chrid))
+            chrid.setdefault(b[2], len(chrid))
+        cnt = np.array([len(b[8]) for b in blocks], dtype=np.int64)
+        aln = np.concatenate([b[8] for b in blocks]) if len(blocks) > 0 else np.zeros((0, 4), dtype=np.int64)
+        alntag = np.concatenate([np.array([""]*len(b[8]) if b[9] is None else b[9], dtype=object) for b in blocks]) if len(blocks) > 0 else np.zeros(0, dtype=object)
+        col = lambda k: np.array([b[k] for b in blocks], dtype=np.int64)
+        return cls(np.array(list(chrid.keys()), dtype=object),
+                   np.minimum(col(0), 6),
+                   col(0),
+                   np.array([chrid[b[1]] for b in blocks], dtype=np.int64),
+                   np.array([chrid[b[2]] for b in blocks], dtype=np.int64),
+                   col(3), col(4), col(5), col(6),
+                   np.array([b[7] for b in blocks], dtype=object),
+                   np.concatenate(([0], np.cumsum(cnt))).astype(np.int64),
+                   aln[:, 0].copy(), aln[:, 1].copy(), aln[:, 2].copy(), aln[:, 3].copy(), alntag.astype(object))
+
+    @classmethod
+    def fromFiles(cls, cwdPath, prefix, files=SRFILES):
+        """Reads the SR blocks in files, which must be in the order of SRFILES. Missing and empty files have no blocks."""
+        logger = logging.getLogger("srResults")
+        blocks = []
+        for f in files:
+            if not os.path.isfile(cwdPath + prefix + f):
+                logger.debug(f + " is not present. Skipping it.")
+                continue
+            s = SRFILES.index(f)
+            with open(cwdPath + prefix + f, "r") as fin:
+                for line in fin:
+                    line = line.rstrip("\n").split("\t")
+                    if line[0] == "#":
+                        blocks.append([CTXCLASSES[line[8]] if s == 6 else s, line[1], line[5], int(line[2]), int(line[3]), int(line[6]), int(line[7]), line[9] if len(line) > 9 else "", [], []])
+                    elif line[0] != "":
+                        blocks[-1][8].append((int(line[0]), int(line[1]), int(line[2]), int(line[3])))
+                        blocks[-1][9].append(line[4] if len(line) > 4 else "")
+        return cls.fromBlocks([srBlock(b[0], b[1], b[3], b[4], b[2], b[5], b[6], b[8], b[7], b[9]) for b in blocks])
+
+    def toFiles(self, cwdPath, prefix):
+        """Writes the blocks to SRFILES, in the format read by fromFiles"""
+        ctxnames = {v: k for k, v in CTXCLASSES.items()}
+        for s in range(len(SRFILES)):
+            with open(cwdPath + prefix + SRFILES[s], "w") as fout:
+                for i in np.flatnonzero(self.source == s):
+                    out = ["#", self.chrs[self.achr[i]], str(self.astart[i]), str(self.aend[i]), "-", self.chrs[self.bchr[i]], str(self.bstart[i]), str(self.bend[i])]
+                    if s in (4, 5):
+                        out += ["-", self.dupgen[i]]
+                    elif s == 6:
+                        out += [ctxnames[self.cls[i]], self.dupgen[i]]
+                    fout.write("\t".join(out) + "\n")
+                    for j in range(self.ptr[i], self.ptr[i+1]):
+                        out = [str(self.alnastart[j]), str(self.alnaend[j]), str(self.alnbstart[j]), str(self.alnbend[j])]
+                        if self.alntag[j] != "":
+                            out.append(self.alntag[j])
+                        fout.write("\t".join(out) + "\n")
+
+    def counts(self):
+        return np.diff(self.ptr)
+
+    def group(self):
+        """Block number within its file. It is counted per reference chromosome, except in ctxOut.txt."""
+        grp = np.zeros(len(self), dtype=np.int64)
+        seen = {}
+        for i in range(len(self)):
+            key = self.source[i] if self.source[i] == 6 else (self.source[i], self.achr[i])
+            grp[i] = seen.get(key, 0)
+            seen[key] = grp[i] + 1
+        return grp
+
+    def members(self, ids):
+        """Alignments of the blocks ids, with the block number (group), the chromosomes and the class (state) of their block"""
+        cnt = self.counts()[ids]
+        rows = np.concatenate([np.arange(self.ptr[i], self.ptr[i+1]) for i in ids]) if len(ids) > 0 else np.zeros(0, dtype=np.int64)
+        return pd.DataFrame({"aStart": self.alnastart[rows],
+                             "aEnd": self.alnaend[rows],
+                             "bStart": self.alnbstart[rows],
+                             "bEnd": self.alnbend[rows],
+                             "group": np.repeat(self.group()[ids], cnt),
+                             "aChr": self.chrs[np.repeat(self.achr[ids], cnt)],
+                             "bChr": self.chrs[np.repeat(self.bchr[ids], cnt)],
+                             "state": np.array(SRCLASSES, dtype=object)[np.repeat(self.cls[ids], cnt)]})
+
+    def alignments(self, dup=False):
+        """
+        Member alignments of the SR blocks (see members). Duplications are
+        included only when dup is True. Sorted by the coordinates.
+        """
+        keep = self.cls < 10 if dup else np.isin(self.cls, [0, 1, 2, 3, 6, 7])
+        annoCoords = self.members(np.flatnonzero(keep))
+        annoCoords.sort_values(by = ["aChr", "aStart","aEnd","bChr", "bStart","bEnd"], inplace = True)
+        annoCoords.index = range(len(annoCoords))
+        return annoCoords
+
+    def blocks(self, sources=range(7)):
+        """Coordinates of the blocks read from the files SRFILES[sources], in file order"""
+        ids = np.flatnonzero(np.isin(self.source, list(sources)))
+        return pd.DataFrame({"aStart": self.astart[ids],
+                             "aEnd": self.aend[ids],
+                             "bStart": self.bstart[ids],
+                             "bEnd": self.bend[ids],
+                             "aChr": self.chrs[self.achr[ids]],
+                             "bChr": self.chrs[self.bchr[ids]]})
+
+    def srtable(self):
+        """
+        The SR blocks and their alignments as rows of the syri.out table,
+        with the ids of the blocks (e.g. SYN1) and alignments (e.g. SYNAL1).
+        Blocks are numbered in file order.
+        """
+        ids = np.arange(len(self))
+        cnt = self.counts()
+        vartype = np.array(TABLECLASSES, dtype=object)[self.cls[ids]]
+        blkid = vartype + np.arange(1, len(ids)+1).astype(str).astype(object)
+        dupclass = np.where(np.isin(self.cls[ids], [4, 5, 8, 9]), np.where(self.dupgen[ids] == "B", "copygain", "copyloss"), "-").astype(object)
+        # Each block is followed by its alignments
+        pos = np.arange(len(ids)) + np.concatenate(([0], np.cumsum(cnt)[:-1]))
+        alnpos = np.setdiff1d(np.arange(len(ids) + cnt.sum()), pos)
+        rows = np.arange(self.ptr[-1])
+        n = len(ids) + len(rows)
+        cols = {}
+        for c, blk, al in [('achr', self.chrs[self.achr[ids]], self.chrs[np.repeat(self.achr[ids], cnt)]),
+                           ('astart', self.astart[ids], self.alnastart[rows]),
+                           ('aend', self.aend[ids], self.alnaend[rows]),
+                           ('bchr', self.chrs[self.bchr[ids]], self.chrs[np.repeat(self.bchr[ids], cnt)]),
+                           ('bstart', self.bstart[ids], self.alnbstart[rows]),
+                           ('bend', self.bend[ids], self.alnbend[rows]),
+                           ('vartype', vartype, np.repeat(vartype + "AL", cnt)),
+                           ('parent', np.full(len(ids), "-", dtype=object), np.repeat(blkid, cnt)),
+                           ('dupclass', dupclass, np.full(len(rows), "-", dtype=object))]:
+            cols[c] = np.empty(n, dtype=blk.dtype)
+            cols[c][pos] = blk
+            cols[c][alnpos] = al
+        rowid = np.empty(n, dtype=object)
+        rowid[pos] = blkid
+        rowid[alnpos] = np.repeat(vartype + "AL", cnt) + np.arange(1, len(rows)+1).astype(str).astype(object)
+        anno = pd.DataFrame(cols, index=rowid)
+        anno['aseq'] = "-"
+        anno['bseq'] = "-"
+        anno['id'] = anno.index.values
+        anno = anno.loc[:, ['achr', 'astart', 'aend', 'aseq', 'bseq', 'bchr', 'bstart', 'bend', 'id', 'parent', 'vartype', 'dupclass']]
+        anno.sort_values(['achr', 'astart', 'aend'], inplace=True)
+        return anno
@@ -10,8 +10,9 @@ from collections import deque, defaultdict
 # from scipy.stats import *
 from datetime import datetime
 import pandas as pd
-from multiprocessing import Pool
+from multiprocessing import Pool, shared_memory
 from functools import partial
+from itertools import chain
 import os
 from gc import collect
 import logging
@@ -20,108 +21,383 @@ import psutil
 from cython.operator cimport dereference as deref, preincrement as inc
 from libcpp.map cimport map as cpp_map
 from libcpp.deque cimport deque as cpp_deq
-from syri.pyxFiles.function cimport getmeblocks, getOverlapWithSynBlocks
+from libcpp.vector cimport vector as cpp_vec
+from libcpp.algorithm cimport sort as cpp_sort
+from libcpp.utility cimport pair
+from libc.math cimport INFINITY
+from syri.srdata import srResults, srBlock, SRCLASSES
+from syri.pyxFiles.function cimport getmeblocks, getOverlapWithSynBlocks, getCandidateEdges
 cimport numpy as np
 cimport cython
 
 np.random.seed(1)
 
+# Bytes per alignment in the coords table: eleven numeric/categorical columns and the CIGAR reference, 8 bytes each.
+# The CIGAR string itself is counted separately. Used to estimate the memory saved by filtering while reading.
+COORDSROWBYTES = 12*8
+
+
+cdef struct cgstat:
+    int nops        # Number of CIGAR operations
+    int nclip       # Number of H/S operations
+    bint valid      # True when all operations are in I/D/H/S/X/=
+    bint clip       # True when any H/S operation is present
+    unsigned char fop   # First operation
+    unsigned char lop   # Last operation
+    long lclip      # Length of the leading clip
+    long rclip      # Length of the trailing clip
+    long eq         # Sum of = operations
+    long mm         # Sum of X operations
+    long ins        # Sum of I operations
+    long dele       # Sum of D operations
+    Py_ssize_t alstart  # Offset of the first non-clip operation in the CIGAR string
+    Py_ssize_t alend    # Offset after the last non-clip operation in the CIGAR string
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef cgstat cgstats(const unsigned char[:] cg) noexcept nogil:
+    """
+    Single pass over a CIGAR string to collect the operation counts required
+    for the coords table.
+    """
+    cdef:
+        cgstat st
+        Py_ssize_t i
+        long n = 0
+        unsigned char c
+        bint isclip
+    st.nops = 0
+    st.nclip = 0
+    st.valid = True
+    st.clip = False
+    st.fop = 0
+    st.lop = 0
+    st.lclip = 0
+    st.rclip = 0
+    st.eq = 0
+    st.mm = 0
+    st.ins = 0
+    st.dele = 0
+    st.alstart = 0
+    st.alend = 0
+    for i in range(cg.shape[0]):
+        c = cg[i]
+        if 48 <= c <= 57:
+            n = n*10 + (c - 48)
+            continue
+        isclip = c == 83 or c == 72     # 'S', 'H'
+        if c == 61:         # '='
+            st.eq += n
+        elif c == 88:       # 'X'
+            st.mm += n
+        elif c == 73:       # 'I'
+            st.ins += n
+        elif c == 68:       # 'D'
+            st.dele += n
+        elif isclip:
+            st.clip = True
+            st.nclip += 1
+            if st.nops == 0:
+                st.lclip = n
+                st.alstart = i + 1
+        else:
+            st.valid = False
+        if isclip:
+            st.rclip = n
+        else:
+            st.rclip = 0
+            st.alend = i + 1
+        if st.nops == 0:
+            st.fop = c
+        st.lop = c
+        st.nops += 1
+        n = 0
+    return st
+# END
 
-def samtocoords(f):
-    from pandas import DataFrame
-    from collections import deque
-    logger = logging.getLogger('SAM reader')
-    rc = {}        # Referece chromosomes
-    rcs = {}        # Selected chromosomes
-    al = deque()    # Individual alignment
-    try:
-        with open(f, 'r') as fin:
-            for l in fin:
-                if l[:3] == '@SQ':
-                    c, s = 0, 0
-                    for h in l.strip().split()[1:]:
-                        h = h.split(':')
-                        if h[0] == 'SN': c = h[1]
-                        if h[0] == 'LN': s = int(h[1])
-                    rcs[c] = s
-                    continue
-                elif l[0] == '@': continue
 
-                l = l.split('\t')[:6]
-                # if l[1] == '2064': break
-                if l[2] == '*':
-                    logger.warning(l[0]+ ' do not align with any reference sequence and cannot be analysed. Remove all unplaced scaffolds and contigs from the assemblies.')  # Skip rows corresponding to non-mapping sequences (contigs/scaffolds)
-                    continue
+cdef inline bint hasinnerclip(cgstat st) noexcept nogil:
+    """
+    True if H/S operations are present other than at the two ends of the CIGAR
+    """
+    cdef int n = st.nclip
+    if st.nops > 2:
+        if st.fop == 83 or st.fop == 72:
+            n -= 1
+        if st.lop == 83 or st.lop == 72:
+            n -= 1
+        return n > 0
+    return False
+# END
 
-                if 'M' in l[5]:
-                    logger.error(f'Incorrect CIGAR string found. CIGAR string can only have I/D/H/S/X/=. CIGAR STRING: {l[5]}. If using minimap2 for alignment, then use the --eqx parameter.')
-                    sys.exit()
-                cgt = [[int(j[0]), j[1]] for j in [i.split(';') for i in l[5].replace('S', ';S,').replace('H', ';H,').replace('=', ';=,').replace('X', ';X,').replace('I', ';I,').replace('D', ';D,').split(',')[:-1]]]
-                if len(cgt) > 2:
-                    if True in [True if i[1] in ['S', 'H'] else False for i in cgt[1:-1]]:
-                        logger.error("Incorrect CIGAR string found. Clipped bases inside alignment. H/S can only be in the terminal. CIGAR STRING: " + aln.cigarstring)
-                        sys.exit()
 
-                bf = '{:012b}'.format(int(l[1]))
+cdef inline bint passfilter(double iden, long alen, long blen, filt):
+    """
+    False if the alignment would be removed by the -f filter. filt is None
+    (no filtering) or (minimum identity, minimum alignment length).
+    """
+    if filt is None:
+        return True
+    return iden > filt[0] and alen > filt[1] and blen > filt[1]
+# END
 
-                rs = int(l[3])
-                re = rs - 1 + sum([i[0] for i in cgt if i[1] in ['X', '=', 'D']])
 
-                if bf[7] == '0':    # forward alignment
-                    if cgt[0][1] == '=':
-                        qs = 1
-                    elif cgt[0][1] in ['S', 'H']:
-                        qs = cgt[0][0] + 1
-                    else:
+def logFilterStats(logger, stats, filt):
+    """
+    Logs the number of alignments parsed, kept and dropped by the reader.
+    stats is [parsed, dropped, bytes not stored].
+    """
+    if filt is None:
+        logger.info('Alignments parsed: {}'.format(stats[0]))
+        return
+    logger.info('Alignments parsed: {}, kept: {}, dropped: {} (iden <= {} or length <= {}). Memory saved by dropping alignments while reading: {:.2f} MB'.format(stats[0], stats[0] - stats[1], stats[1], filt[0], filt[1], stats[2]/2.**20))
+# END
+
+
+def workerCall(func, *args):
+    """
+    Runs func in a pool worker. sys.exit() called in the worker is converted
+    to an exception, otherwise the pool would wait for the result indefinitely.
+    """
+    try:
+        return func(*args)
+    except SystemExit:
+        raise RuntimeError('Worker exited while running {}. Check log for errors.'.format(func.__name__))
+# END
+
+
+def samchunks(f, n):
+    """
+    Splits the alignment section of a SAM file in n byte-ranges starting and
+    ending at line boundaries
+    """
+    size = os.path.getsize(f)
+    with open(f, 'rb') as fin:
+        start = 0
+        for line in fin:
+            if line[:1] != b'@':
+                break
+            start += len(line)
+        bounds = [start]
+        for i in range(1, n):
+            pos = max(start + ((size - start)*i)//n, bounds[-1])
+            if pos >= size:
+                break
+            fin.seek(pos)
+            fin.readline()
+            pos = fin.tell()
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(bounds[i], bounds[i+1]) for i in range(len(bounds) - 1) if bounds[i] < bounds[i+1]]
+# END
+
+
+def readsamchunk(f, long start, long end, filt=None):
+    """
+    Parses SAM records in the byte range [start, end) of f. Returns typed
+    arrays for the numeric coords columns, lists for the string columns and
+    the filtering statistics. Alignments failing filt are not stored.
+    """
+    cdef:
+        long n = 0, size = 1024
+        long[:] rs, re, qs, qe, bdir
+        double[:] iden
+        cgstat st
+        bytes cgb
+        long flag, pos
+        long parsed = 0, dropped = 0, savedbytes = 0
+    logger = logging.getLogger('SAM reader')
+    arrays = [np.empty(size, dtype=np.int_) for _ in range(5)] + [np.empty(size, dtype=np.float64)]
+    rs, re, qs, qe, bdir, iden = arrays
+    rchr, qchr, cgs = deque(), deque(), deque()
+    with open(f, 'rb') as fin:
+        fin.seek(start)
+        pos = start
+        for line in fin:
+            if pos >= end:
+                break
+            pos += len(line)
+            l = line.split(b'\t', 6)
+            if l[2] == b'*':
+                logger.warning(l[0].decode() + ' do not align with any reference sequence and cannot be analysed. Remove all unplaced scaffolds and contigs from the assemblies.')  # Skip rows corresponding to non-mapping sequences (contigs/scaffolds)
+                continue
+            cgb = l[5]
+            st = cgstats(cgb)
+            if not st.valid:
+                logger.error(f'Incorrect CIGAR string found. CIGAR string can only have I/D/H/S/X/=. CIGAR STRING: {cgb.decode()}. If using minimap2 for alignment, then use the --eqx parameter.')
+                sys.exit()
+            if hasinnerclip(st):
+                logger.error("Incorrect CIGAR string found. Clipped bases inside alignment. H/S can only be in the terminal. CIGAR STRING: " + cgb.decode())
+                sys.exit()
+            if n == size:
+                size *= 2
+                arrays = [np.concatenate([a, np.empty_like(a)]) for a in arrays]
+                rs, re, qs, qe, bdir, iden = arrays
+            flag = int(l[1])
+            rs[n] = int(l[3])
+            re[n] = rs[n] - 1 + st.eq + st.mm + st.dele
+            bdir[n] = -1 if flag & 16 else 1
+            if bdir[n] == 1:
+                if st.fop == 83 or st.fop == 72:
+                    qs[n] = st.lclip + 1
+                else:
+                    if st.fop != 61:
                         print('ERROR: CIGAR string starting with non-matching base')
-                    qe = qs - 1 + sum([i[0] for i in cgt if i[1] in ['X', '=', 'I']])
-                elif bf[7] == '1':  # inverted alignment
-                    if cgt[-1][1] == '=':
-                        qs = 1
-                    elif cgt[-1][1] in ['S', 'H']:
-                        qs = cgt[-1][0] + 1
-                    else:
+                    qs[n] = 1
+                qe[n] = qs[n] - 1 + st.eq + st.mm + st.ins
+            else:
+                if st.lop == 83 or st.lop == 72:
+                    qe[n] = st.rclip + 1
+                else:
+                    if st.lop != 61:
                         print('ERROR: CIGAR string starting with non-matching base')
-                    qe = qs - 1 + sum([i[0] for i in cgt if i[1] in ['X', '=', 'I']])
-                    qs, qe = qe, qs
-
-                al.append([
-                    rs,
-                    re,
-                    qs,
-                    qe,
-                    abs(re-rs) + 1,
-                    abs(qs-qe) + 1,
-                    format((sum([i[0] for i in cgt if i[1] == '=']) / sum(
-                        [i[0] for i in cgt if i[1] in ['=', 'X', 'I', 'D']])) * 100, '.2f'),
-                    1,
-                    1 if bf[7] == '0' else -1,
-                    l[2],
-                    l[0],
-                    "".join([str(i[0])+i[1] for i in cgt if i[1] in ['=', 'X', 'I', 'D']])
-                ])
-                rcs[l[2]] = 1
-            rcs = list(rcs.keys())
-            for k in list(rc.keys()):
-                if k not in rcs: logger.warning(l[0]+ ' do not align with any query sequence and cannot be analysed. Remove all unplaced scaffolds and contigs from the assemblies.')
+                    qe[n] = 1
+                qs[n] = qe[n] - 1 + st.eq + st.mm + st.ins
+            iden[n] = float(format((st.eq/(st.eq + st.mm + st.ins + st.dele))*100, '.2f'))
+            parsed += 1
+            if not passfilter(iden[n], abs(re[n] - rs[n]) + 1, abs(qs[n] - qe[n]) + 1, filt):
+                dropped += 1
+                savedbytes += COORDSROWBYTES + st.alend - st.alstart
+                continue
+            rchr.append(l[2].decode())
+            qchr.append(l[0].decode())
+            cgs.append(cgb[st.alstart:st.alend].decode())
+            n += 1
+    return [a[:n] for a in arrays], list(rchr), list(qchr), list(cgs), [parsed, dropped, savedbytes]
+# END
+
+
+def samtocoords(f, nc=1, filt=None):
+    """
+    Reads alignments from SAM file. The file is split in byte-ranges which
+    are parsed in parallel when nc > 1.
+    """
+    from pandas import DataFrame
+    logger = logging.getLogger('SAM reader')
+    try:
+        chunks = samchunks(f, nc*4 if nc > 1 else 1)
+        if nc > 1 and len(chunks) > 1:
+            with Pool(processes=min(nc, len(chunks))) as pool:
+                out = pool.starmap(workerCall, [(readsamchunk, f, s, e, filt) for s, e in chunks])
+        else:
+            out = [readsamchunk(f, s, e, filt) for s, e in chunks]
     except Exception as e:
         logger.error('Error in reading SAM file: ' + str(e))
         sys.exit()
-    al = DataFrame(list(al))
-    al[6] = al[6].astype('float')
+    if len(out) == 0:
+        out = [readsamchunk(f, 0, 0)]
+    logFilterStats(logger, np.sum([o[4] for o in out], axis=0), filt)
+    cols = [np.concatenate([o[0][i] for o in out]) for i in range(6)]
+    al = DataFrame({0: cols[0], 1: cols[1], 2: cols[2], 3: cols[3],
+                    4: np.abs(cols[1] - cols[0]) + 1, 5: np.abs(cols[2] - cols[3]) + 1,
+                    6: cols[5], 7: np.ones(len(cols[0]), dtype=np.int_), 8: cols[4],
+                    9: np.array(list(chain.from_iterable(o[1] for o in out)), dtype=object),
+                    10: np.array(list(chain.from_iterable(o[2] for o in out)), dtype=object),
+                    11: np.array(list(chain.from_iterable(o[3] for o in out)), dtype=object)})
     al.sort_values([9,0,1,2,3,10], inplace = True, ascending=True)
     al.index = range(len(al.index))
     return al
 # END
 
-def readSAMBAM(fin, type='B'):
+def readbamrecords(alns, filt=None):
+    """
+    Parses pysam alignments. Returns typed arrays for the numeric coords
+    columns, lists for the string columns, the primary-alignment flags
+    for reference and query sequences and the filtering statistics.
+    Alignments failing filt are not stored.
+    """
+    cdef:
+        long n = 0, size = 1024
+        long[:] astart, aend, bstart, bend, bdir
+        double[:] iden
+        cgstat st
+        bytes cgb
+        int flag
+        long parsed = 0, dropped = 0, savedbytes = 0
+    logger = logging.getLogger('Reading BAM/SAM file')
+    qry_prim = {}
+    ref_prim = {}
+    arrays = [np.empty(size, dtype=np.int_) for _ in range(5)] + [np.empty(size, dtype=np.float64)]
+    astart, aend, bstart, bend, bdir, iden = arrays
+    achr, bchr, cgs = deque(), deque(), deque()
+    for aln in alns:
+        flag = aln.flag
+        rname = aln.reference_name
+        qname = aln.query_name
+        ## Check whether every sequence has at least one primary alignment
+        if rname is not None:
+            if flag < 256 or rname not in ref_prim:
+                ref_prim[rname] = ref_prim.get(rname, False) or flag < 256
+        if flag < 256 or qname not in qry_prim:
+            qry_prim[qname] = qry_prim.get(qname, False) or flag < 256
+
+        ## Pass non-alinging chromosomes
+        cg = aln.cigarstring
+        if cg is None:
+            logger.warning(qname + ' do not align with any reference chromosome and cannot be analysed')
+            continue
+
+        ## Check CIGAR:
+        cgb = cg.encode()
+        st = cgstats(cgb)
+        if not st.valid:
+            logger.error(f'Incorrect CIGAR string found. CIGAR string can only have I/D/H/S/X/=. CIGAR STRING: {cg}. If using minimap2 for alignment, then use the --eqx parameter.')
+            sys.exit()
+        if hasinnerclip(st):
+            logger.error("Incorrect CIGAR string found. Clipped bases inside alignment. H/S can only be in the terminal. CIGAR STRING: " + cg)
+            sys.exit()
+
+        if n == size:
+            size *= 2
+            arrays = [np.concatenate([a, np.empty_like(a)]) for a in arrays]
+            astart, aend, bstart, bend, bdir, iden = arrays
+
+        ## Parse information from the aln object
+        astart[n] = aln.reference_start + 1
+        aend[n] = aln.reference_end
+        if not flag & 16:
+            bdir[n] = 1
+            bstart[n] = st.lclip + 1 if (st.fop == 83 or st.fop == 72) else 1
+            bend[n] = bstart[n] + st.eq + st.mm + st.ins - 1
+        else:
+            bdir[n] = -1
+            bend[n] = st.rclip + 1 if (st.lop == 83 or st.lop == 72) else 1
+            bstart[n] = bend[n] + st.eq + st.mm + st.ins - 1
+        iden[n] = float(format((st.eq/(st.eq + st.mm + st.ins + st.dele))*100, '.2f'))
+        parsed += 1
+        if not passfilter(iden[n], abs(aend[n] - astart[n]) + 1, abs(bend[n] - bstart[n]) + 1, filt):
+            dropped += 1
+            savedbytes += COORDSROWBYTES + st.alend - st.alstart
+            continue
+        achr.append(rname)
+        bchr.append(qname)
+        cgs.append(cg[st.alstart:st.alend])
+        n += 1
+    return [a[:n] for a in arrays], list(achr), list(bchr), list(cgs), ref_prim, qry_prim, [parsed, dropped, savedbytes]
+# END
+
+
+def readbamshard(fin, contigs, threads=1, filt=None):
+    """
+    Reads alignments to the given reference sequences from an indexed BAM
+    file. '*' selects the alignments without coordinates.
+    """
+    import pysam
+    with pysam.AlignmentFile(fin, 'rb', threads=threads) as findata:
+        return readbamrecords(chain.from_iterable(findata.fetch(c) for c in contigs), filt)
+# END
+
+
+def readSAMBAM(fin, type='B', nc=1, filt=None):
     import pysam
     logger = logging.getLogger('Reading BAM/SAM file')
     try:
         if type == 'B':
             findata = pysam.AlignmentFile(fin,'rb')
         elif type == 'S':
-            return samtocoords(fin)
+            return samtocoords(fin, nc, filt)
         else:
             raise ValueError("Wrong parameter")
     except ValueError as e:
@@ -135,66 +411,37 @@ def readSAMBAM(fin, type='B'):
         sys.exit()
 
     try:
-        qry_prim = {}
+        ## For indexed BAMs, reference sequences are distributed among nc
+        ## workers, largest first, and read in parallel
+        if nc > 1 and findata.has_index() and findata.nreferences > 1:
+            shards = [[] for _ in range(nc)]
+            shardsize = [0]*nc
+            for stat in sorted(findata.get_index_statistics(), key=lambda x: x.total, reverse=True):
+                if stat.total == 0:
+                    continue
+                i = shardsize.index(min(shardsize))
+                shards[i].append(stat.contig)
+                shardsize[i] += stat.total
+            if findata.nocoordinate > 0:
+                shards[shardsize.index(min(shardsize))].append('*')
+            shards = [sh for sh in shards if len(sh) > 0]
+            findata.close()
+            with Pool(processes=len(shards)) as pool:
+                out = pool.starmap(workerCall, [(readbamshard, fin, sh, max(2, nc//len(shards)), filt) for sh in shards])
+        else:
+            out = [readbamrecords(findata, filt)]
+            findata.close()
+
+        ## Merge primary alignment flags from all shards
         ref_prim = {}
-        cgdict = {1:'I', 2:'D', 7:'=', 8:'X'}
-        coords = {}
-        index = 0
-        for aln in findata:
-            index += 1
-            ## Check whether every sequence has at least one primary alignment
-            if aln.reference_name is not None:
-                if aln.reference_name not in ref_prim.keys():
-                    ref_prim[aln.reference_name] = False
-            if aln.query_name not in qry_prim.keys():
-                qry_prim[aln.query_name] = False
-            if aln.reference_name is not None:
-                if not ref_prim[aln.reference_name]:
-                    if aln.flag < 256:
-                        ref_prim[aln.reference_name] = True
-            if not qry_prim[aln.query_name]:
-                if aln.flag < 256:
-                    qry_prim[aln.query_name] = True
-
-            ## Pass non-alinging chromosomes
-            if aln.cigarstring is None:
-                logger.warning(aln.query_name + ' do not align with any reference chromosome and cannot be analysed')
-                continue
+        qry_prim = {}
+        for o in out:
+            for k, v in o[4].items():
+                ref_prim[k] = ref_prim.get(k, False) or v
+            for k, v in o[5].items():
+                qry_prim[k] = qry_prim.get(k, False) or v
 
-            ## Check CIGAR:
-            if False in [False if i[0] not in [1,2,4,5,7,8] else True for i in aln.cigartuples]:
-                logger.error(f'Incorrect CIGAR string found. CIGAR string can only have I/D/H/S/X/=. CIGAR STRING: {aln.cigarstring}. If using minimap2 for alignment, then use the --eqx parameter.')
-                sys.exit()
-            if len(aln.cigartuples) > 2:
-                if True in [True if i[0] in [4,5] else False for i in aln.cigartuples[1:-1]]:
-                    logger.error("Incorrect CIGAR string found. Clipped bases inside alignment. H/S can only be in the terminal. CIGAR STRING: " + aln.cigarstring)
-                    sys.exit()
-
-            ## Parse information from the aln object
-            astart = aln.reference_start+1
-            aend = aln.reference_end
-            is_inv = True if np.binary_repr(aln.flag,12)[7] == '1' else False
-            if not is_inv:
-                if aln.cigartuples[0][0] in [4,5]:
-                    bstart = aln.cigartuples[0][1]+1
-                else:
-                    bstart = 1
-                bend = bstart + aln.query_alignment_length - 1
-            else:
-                if aln.cigartuples[-1][0] in [4,5]:
-                    bend = aln.cigartuples[-1][1]+1
-                else:
-                    bend = 1
-                bstart = bend + aln.query_alignment_length - 1
-            alen = abs(aend - astart) + 1
-            blen = abs(bend - bstart) + 1
-            iden = format((sum([i[1] for i in aln.cigartuples if i[0] == 7])/sum([i[1] for i in aln.cigartuples if i[0] in [1,2,7,8]]))*100, '.2f')
-            adir = 1
-            bdir = -1 if is_inv else 1
-            achr = aln.reference_name
-            bchr = aln.query_name
-            cg = "".join([str(i[1]) + cgdict[i[0]] for i in aln.cigartuples if i[0] not in [4,5]])
-            coords[index] = [astart, aend, bstart, bend, alen, blen, iden, adir, bdir, achr, bchr, cg]
+        logFilterStats(logger, np.sum([o[6] for o in out], axis=0), filt)
 
         ## Give warning for chromosomes which do not have any primary alignment
         for k,v in ref_prim.items():
@@ -205,53 +452,97 @@ def readSAMBAM(fin, type='B'):
                 logger.warning('No primary alignment found for query sequence ' + k +'. This could mean that the entire chromosome '+ k + ' is reapeated.')
 
         ## Return alignments
-        coords = pd.DataFrame.from_dict(coords, orient= 'index')
+        cols = [np.concatenate([o[0][i] for o in out]) for i in range(6)]
+        coords = pd.DataFrame({0: cols[0], 1: cols[1], 2: cols[2], 3: cols[3],
+                               4: np.abs(cols[1] - cols[0]) + 1, 5: np.abs(cols[3] - cols[2]) + 1,
+                               6: cols[5], 7: np.ones(len(cols[0]), dtype=np.int_), 8: cols[4],
+                               9: np.array(list(chain.from_iterable(o[1] for o in out)), dtype=object),
+                               10: np.array(list(chain.from_iterable(o[2] for o in out)), dtype=object),
+                               11: np.array(list(chain.from_iterable(o[3] for o in out)), dtype=object)})
         coords.sort_values([9,0,1,2,3,10], inplace = True, ascending=True)
         coords.index = range(len(coords.index))
-        coords[6] = coords[6].astype('float')
         return coords
     except Exception as e:
         logger.error("Error in reading BAM/SAM file. " + str(e))
         sys.exit()
 # END
 
-def readPAF(paf):
-    coords = deque()
+cdef int PAF_CHUNK = 100000
+
+
+def readPAF(paf, filt=None):
+    """
+    Reads PAF file in chunks of PAF_CHUNK records. CIGAR statistics for
+    each record are collected in a single compiled pass and values are written
+    directly to typed column arrays. Alignments failing filt are not stored.
+    """
+    cdef:
+        long[:] astart, aend, bstart, bend, alen, blen, bdir
+        double[:] iden
+        long i = 0
+        cgstat st
+        bytes cgb
+        long parsed = 0, dropped = 0, savedbytes = 0
     logger = logging.getLogger('Reading BAM/SAM file')
+    chunks = deque()
+    achr, bchr, cgs = deque(), deque(), deque()
     try:
+        arrays = [np.empty(PAF_CHUNK, dtype=np.int_) for _ in range(7)] + [np.empty(PAF_CHUNK, dtype=np.float64)]
+        astart, aend, bstart, bend, alen, blen, bdir, iden = arrays
         with open(paf, 'r') as fin:
             for line in fin:
-                line = line.strip().split()
-                astart = int(line[7]) + 1
-                aend = int(line[8])
-                adir = 1
-                bdir = 1 if line[4] == '+' else -1
-                bstart = int(line[2]) + 1 if bdir == 1 else int(line[3])
-                bend = int(line[3]) if bdir == 1 else int(line[2]) + 1
-                alen = abs(aend - astart) + 1
-                blen = abs(bend - bstart) + 1 if bdir == 1 else bstart - bend + 1
-                cg = [i.split(":")[-1] for i in line[12:] if i[:2] == 'cg']
+                line = line.strip().split(None, 12)
+                if i == PAF_CHUNK:
+                    chunks.append(arrays)
+                    arrays = [np.empty(PAF_CHUNK, dtype=np.int_) for _ in range(7)] + [np.empty(PAF_CHUNK, dtype=np.float64)]
+                    astart, aend, bstart, bend, alen, blen, bdir, iden = arrays
+                    i = 0
+                astart[i] = int(line[7]) + 1
+                aend[i] = int(line[8])
+                if line[4] == '+':
+                    bdir[i] = 1
+                    bstart[i] = int(line[2]) + 1
+                    bend[i] = int(line[3])
+                else:
+                    bdir[i] = -1
+                    bstart[i] = int(line[3])
+                    bend[i] = int(line[2]) + 1
+                alen[i] = abs(aend[i] - astart[i]) + 1
+                blen[i] = abs(bend[i] - bstart[i]) + 1
+                cg = [j.split(":")[-1] for j in line[12].split() if j[:2] == 'cg'] if len(line) > 12 else []
                 if len(cg) != 1:
                     logger.error("CIGAR string is not present in PAF at line {}. Exiting.".format("\t".join(line)))
                     sys.exit()
                 cg = cg[0]
+                cgb = cg.encode()
+                st = cgstats(cgb)
                 ## Check CIGAR:
-                if not all([True if i[1] in {'I', 'D', 'H', 'S', 'X', '='} else False for i in cgtpl(cg)]):
+                if not st.valid:
                     logger.error(f'Incorrect CIGAR string found. CIGAR string can only have I/D/H/S/X/=. CIGAR STRING: {cg}. If using minimap2 for alignment, then use the --eqx parameter.')
                     sys.exit()
-                if len(cgtpl(cg)) > 2:
-                    if any([True if i[1] in {'H', 'S'} else False for i in cgtpl(cg)]):
-                        logger.error("Incorrect CIGAR string found. Clipped bases inside alignment. H/S can only be in the terminal. CIGAR STRING: " + str(cg))
-                        sys.exit()
-
-                iden = round((sum([int(i[0]) for i in cgtpl(cg) if i[1] == '='])/sum([int(i[0]) for i in cgtpl(cg) if i[1] in {'=', 'X', 'D', 'I'}]))*100, 2)
-                achr = line[5]
-                bchr = line[0]
-                coords.append([astart, aend, bstart, bend, alen, blen, iden, adir, bdir, achr, bchr, cg])
-        coords = pd.DataFrame(coords)
+                if st.nops > 2 and st.clip:
+                    logger.error("Incorrect CIGAR string found. Clipped bases inside alignment. H/S can only be in the terminal. CIGAR STRING: " + str(cg))
+                    sys.exit()
+                iden[i] = round((st.eq/(st.eq + st.mm + st.dele + st.ins))*100, 2)
+                parsed += 1
+                if not passfilter(iden[i], alen[i], blen[i], filt):
+                    dropped += 1
+                    savedbytes += COORDSROWBYTES + len(cgb)
+                    continue
+                achr.append(line[5])
+                bchr.append(line[0])
+                cgs.append(cg)
+                i += 1
+        chunks.append([a[:i] for a in arrays])
+        logFilterStats(logger, [parsed, dropped, savedbytes], filt)
+        cols = [np.concatenate([c[j] for c in chunks]) for j in range(8)]
+        coords = pd.DataFrame({0: cols[0], 1: cols[1], 2: cols[2], 3: cols[3],
+                               4: cols[4], 5: cols[5], 6: cols[7],
+                               7: np.ones(len(cols[0]), dtype=np.int_), 8: cols[6],
+                               9: np.array(achr, dtype=object), 10: np.array(bchr, dtype=object),
+                               11: np.array(cgs, dtype=object)})
         coords.sort_values([9,0,1,2,3,10], inplace = True, ascending=True)
         coords.index = range(len(coords.index))
-        coords[6] = coords[6].astype('float')
         return coords
     except FileNotFoundError:
         logger.error("Cannot open {} file. Exiting".format(paf))
@@ -261,37 +552,105 @@ def readPAF(paf):
         sys.exit()
 # END
 
+def getChromMaps(acode, bcode, astart, aend, int na, int nb):
+    """
+    Returns a na x nb matrix with the reference genome coverage of the
+    alignments between each pair of chromosomes (number of merged ranges + sum
+    of their lengths, as computed by mergeRanges for each pair). Alignments
+    are sorted once by (aChr, bChr, aStart) and overlapping ranges are merged
+    using a running maximum of aEnd within each chromosome pair.
+    """
+    cdef long n = len(acode)
+    scores = np.zeros((na, nb), dtype=np.int_)
+    if n == 0:
+        return scores
+    astart, aend = np.asarray(astart, dtype=np.int_), np.asarray(aend, dtype=np.int_)
+    s = np.minimum(astart, aend)
+    e = np.maximum(astart, aend)
+    pair = np.asarray(acode, dtype=np.int_)*nb + np.asarray(bcode, dtype=np.int_)
+    order = np.lexsort((s, pair))
+    pair, s, e = pair[order], s[order], e[order]
+    # Offset coordinates so that the running maximum restarts for every pair
+    newpair = np.ones(n, dtype=bool)
+    newpair[1:] = pair[1:] != pair[:-1]
+    off = (np.cumsum(newpair) - 1)*(e.max() + 1)
+    emax = np.maximum.accumulate(e + off) - off
+    # A merged range starts where the alignment starts after all previous ends
+    newrange = newpair.copy()
+    newrange[1:] |= s[1:] > emax[:-1]
+    first = np.flatnonzero(newrange)
+    last = np.append(first[1:] - 1, n - 1)
+    rstart = s[first]
+    rend = emax[last]
+    rpair = pair[first]
+    np.add.at(scores.reshape(-1), rpair, 1 + rend - rstart)
+    return scores
+# END
+
+
+def readTSV(coordsfin, filt=None, chunksize=1000000):
+    """
+    Reads the alignment table in chunks of chunksize rows. When filt is
+    given, alignments failing the filter are removed from each chunk before
+    it is stored. Chunks in which the length/identity columns are not
+    numeric are kept as is and are checked in readCoords.
+    """
+    logger = logging.getLogger('Reading Coords')
+    stats = [0, 0, 0]
+    def readchunks(engine):
+        out = deque()
+        for chunk in pd.read_table(coordsfin, header = None, engine = engine, chunksize = chunksize):
+            stats[0] += chunk.shape[0]
+            if filt is not None and chunk.shape[1] > 6 and all([pd.api.types.is_numeric_dtype(chunk[i]) for i in [4, 5, 6]]):
+                keep = (chunk[6] > filt[0]) & (chunk[4] > filt[1]) & (chunk[5] > filt[1])
+                if not keep.all():
+                    stats[1] += (~keep).sum()
+                    stats[2] += chunk.loc[~keep].memory_usage(deep=True, index=False).sum()
+                    chunk = chunk.loc[keep]
+            out.append(chunk)
+        return pd.concat(out) if len(out) > 1 else out[0]
+    try:
+        coords = readchunks('c')
+    except pd.errors.ParserError:
+        stats = [0, 0, 0]
+        coords = readchunks('python')
+    coords.index = range(coords.shape[0])
+    logFilterStats(logger, stats, filt)
+    return coords
+# END
+
+
 def readCoords(coordsfin, chrmatch, cwdpath, prefix, args, cigar = False):
     logger = logging.getLogger('Reading Coords')
     logger.debug(args.ftype)
     chrlink = {}
+    # Filtering thresholds are applied while reading the alignments
+    filt = (args.minid, args.minlen) if args.f else None
     if args.ftype == 'T':
         logger.info("Reading input from .tsv file")
         try:
-            coords = pd.read_table(coordsfin, header = None)
-        except pd.errors.ParserError:
-            coords = pd.read_table(coordsfin, header = None, engine = "python")
+            coords = readTSV(coordsfin, filt)
         except Exception as e:
             logger.error("Error in reading the alignment file. " + e)
             sys.exit()
     elif args.ftype == 'S':
         logger.info("Reading input from SAM file")
         try:
-            coords = readSAMBAM(coordsfin, type='S')
+            coords = readSAMBAM(coordsfin, type='S', nc=args.nCores, filt=filt)
         except Exception as e:
             logger.error("Error in reading the alignment file. " + e)
             sys.exit()
     elif args.ftype == 'B':
         logger.info("Reading input from BAM file")
         try:
-            coords = readSAMBAM(coordsfin, type='B')
+            coords = readSAMBAM(coordsfin, type='B', nc=args.nCores, filt=filt)
         except Exception as e:
             logger.error("Error in reading the alignment file" + e)
             sys.exit()
     elif args.ftype == 'P':
         logger.info("Reading input from PAF file")
         try:
-            coords = readPAF(coordsfin)
+            coords = readPAF(coordsfin, filt)
         except Exception as e:
             logger.error("Error in reading the alignment file" + e)
             sys.exit()
@@ -386,10 +745,10 @@ def readCoords(coordsfin, chrmatch, cwdpath, prefix, args, cigar = False):
 
     # Filter small alignments
     if args.f:
-        logger.info('Filtering low-quality alignments (alignment quality < 90, alignment length < 100)')
+        logger.info('Filtering low-quality alignments (alignment quality <= {}, alignment length <= {})'.format(args.minid, args.minlen))
         logger.debug('Number of alignments before filtering: {}'.format(coords.shape[0]))
-        coords = coords.loc[coords.iden > 90]
-        coords = coords.loc[(coords.aLen>100) & (coords.bLen>100)]
+        coords = coords.loc[coords.iden > args.minid]
+        coords = coords.loc[(coords.aLen>args.minlen) & (coords.bLen>args.minlen)]
         logger.debug('Number of alignments after filtering: {}'.format(coords.shape[0]))
 
     ## check for bstart > bend when bdir is -1
@@ -420,28 +779,25 @@ def readCoords(coordsfin, chrmatch, cwdpath, prefix, args, cigar = False):
                 sys.exit()
             else:
                 logger.warning("Matching them automatically. For each reference genome, most similar query genome will be selected. Check mapids.txt for mapping used.")
-                chromMaps = defaultdict(dict)
-                for i in np.unique(coords.bChr):
-                    for j in np.unique(coords.aChr):
-                        a = np.array(coords.loc[(coords.bChr == i) & (coords.aChr == j), ["aStart", "aEnd"]])
-                        a = mergeRanges(a)
-                        chromMaps[j][i] = len(a) + (a[:, 1] - a[:, 0]).sum()
-
-                assigned = []
+                achrs, acode = np.unique(coords.aChr, return_inverse=True)
+                bchrs, bcode = np.unique(coords.bChr, return_inverse=True)
+                chromMaps = getChromMaps(acode, bcode, coords.aStart.to_numpy(), coords.aEnd.to_numpy(), len(achrs), len(bchrs))
+
+                assigned = set()
                 fout = open(cwdpath+prefix+"mapids.txt", "w")
-                for chrom in np.unique(coords.aChr):
-                    maxid = max(chromMaps[chrom].items(), key=lambda x: x[1])[0]
+                for i, chrom in enumerate(achrs):
+                    maxid = bchrs[np.argmax(chromMaps[i])]
                     if maxid in assigned:
                         logger.error("{} in genome B is best match for two chromosomes in genome A. Cannot assign chromosomes automatically.".format(maxid))
                         fout.close()
                         fileRemove(cwdpath+prefix+"mapids.txt")
                         sys.exit()
-                    assigned.append(maxid)
+                    assigned.add(maxid)
                     fout.write(chrom+"\t"+maxid+"\n")
                     logger.info("setting {} as {}".format(maxid, chrom))
-                    coords.loc[coords.bChr == maxid, "bChr"] = chrom
                     chrlink[maxid] = chrom
                 fout.close()
+                coords.bChr = coords.bChr.map(lambda x: chrlink.get(x, x))
         else:
             logger.warning("--no-chrmatch is set. Not matching chromosomes automatically.")
             aChromo = set(coords["aChr"])
@@ -486,12 +842,178 @@ def readCoords(coordsfin, chrmatch, cwdpath, prefix, args, cigar = False):
     return coords, chrlink
 
 
+COORDS_CACHE_VERSION = '1'
+
+
+def getCoordsCacheKey(coordsfin, args):
+    """
+    Hash of the alignment file content and the parameters that change the
+    output of readCoords
+    """
+    from hashlib import sha256
+    h = sha256()
+    h.update(COORDS_CACHE_VERSION.encode())
+    with open(coordsfin, 'rb') as fin:
+        for chunk in iter(lambda: fin.read(1 << 22), b''):
+            h.update(chunk)
+    for p in [args.ftype, args.f, args.minid, args.minlen, args.cigar, args.chrmatch]:
+        h.update(('\t' + str(p)).encode())
+    return h.hexdigest()
+# END
+
+
+def writeCoordsCache(coords, chrlink, key, cwdpath, prefix):
+    """
+    Saves the normalised coords table in a columnar format (one .npy file
+    per column) in <prefix>coords.cache. String columns are stored as integer
+    codes and CIGAR strings as a single byte array with offsets.
+    """
+    logger = logging.getLogger('Coords cache')
+    cdir = cwdpath + prefix + 'coords.cache' + os.sep
+    try:
+        os.makedirs(cdir, exist_ok=True)
+        fileRemove(cdir + 'key')
+        np.save(cdir + 'index.npy', coords.index.to_numpy(dtype=np.int_))
+        for col in coords.columns:
+            if col in ['aChr', 'bChr']:
+                ids, codes = np.unique(coords[col].to_numpy(dtype=str), return_inverse=True)
+                np.save(cdir + col + '.npy', codes.astype(np.int32))
+                with open(cdir + col + '.ids', 'w') as fout:
+                    fout.write('\n'.join(ids) + '\n')
+            elif col == 'cigar':
+                cgs = [c.encode() for c in coords[col]]
+                np.save(cdir + 'cigar.npy', np.frombuffer(b''.join(cgs), dtype=np.uint8))
+                np.save(cdir + 'cigar.idx.npy', np.cumsum([0] + [len(c) for c in cgs]))
+            else:
+                np.save(cdir + col + '.npy', coords[col].to_numpy())
+        with open(cdir + 'columns', 'w') as fout:
+            fout.write('\n'.join(coords.columns) + '\n')
+        with open(cdir + 'chrlink', 'w') as fout:
+            for k, v in chrlink.items():
+                fout.write(k + '\t' + v + '\n')
+        fileRemove(cdir + 'mapids.txt')
+        if os.path.isfile(cwdpath + prefix + 'mapids.txt') and len(chrlink) > 0:
+            with open(cwdpath + prefix + 'mapids.txt', 'r') as fin, open(cdir + 'mapids.txt', 'w') as fout:
+                fout.write(fin.read())
+        # Key is written last so that an incomplete cache is never used
+        with open(cdir + 'key', 'w') as fout:
+            fout.write(key + '\n')
+        logger.info('Saved alignments to ' + cdir)
+    except OSError as e:
+        logger.warning('Could not write alignment cache: ' + str(e))
+# END
+
+
+def readCoordsCache(key, cwdpath, prefix):
+    """
+    Returns (coords, chrlink) from <prefix>coords.cache if it was created for
+    the same key, otherwise None. Numeric columns are memory-mapped.
+    """
+    logger = logging.getLogger('Coords cache')
+    cdir = cwdpath + prefix + 'coords.cache' + os.sep
+    try:
+        with open(cdir + 'key', 'r') as fin:
+            if fin.read().strip() != key:
+                logger.info('Alignment cache is outdated. Reading alignments from input.')
+                return None
+    except FileNotFoundError:
+        return None
+    try:
+        with open(cdir + 'columns', 'r') as fin:
+            columns = fin.read().split()
+        data = {}
+        for col in columns:
+            if col in ['aChr', 'bChr']:
+                with open(cdir + col + '.ids', 'r') as fin:
+                    ids = np.array(fin.read().split('\n')[:-1], dtype=object)
+                data[col] = ids[np.load(cdir + col + '.npy', mmap_mode='r')]
+            elif col == 'cigar':
+                cgs = np.load(cdir + 'cigar.npy', mmap_mode='r').tobytes().decode()
+                idx = np.load(cdir + 'cigar.idx.npy', mmap_mode='r')
+                data[col] = np.array([cgs[idx[i]:idx[i+1]] for i in range(len(idx) - 1)], dtype=object)
+            else:
+                data[col] = np.load(cdir + col + '.npy', mmap_mode='c')
+        coords = pd.DataFrame(data, columns=columns, index=np.load(cdir + 'index.npy', mmap_mode='c'))
+        chrlink = {}
+        with open(cdir + 'chrlink', 'r') as fin:
+            for line in fin:
+                line = line.rstrip('\n').split('\t')
+                chrlink[line[0]] = line[1]
+        if os.path.isfile(cdir + 'mapids.txt'):
+            with open(cdir + 'mapids.txt', 'r') as fin, open(cwdpath + prefix + 'mapids.txt', 'w') as fout:
+                fout.write(fin.read())
+    except (OSError, ValueError, IndexError) as e:
+        logger.warning('Could not read alignment cache: ' + str(e) + '. Reading alignments from input.')
+        return None
+    logger.info('Read alignments from ' + cdir)
+    return coords, chrlink
+# END
+
+
+class sharedCoords:
+    """
+    The coords table in a shared memory block. Pickling sends only the name
+    and layout of the block, so that pool workers attach to it instead of
+    receiving a copy of the table. Chromosome columns are stored as integer
+    codes.
+    """
+    def __init__(self, coords):
+        self.columns = list(coords.columns)
+        self.n = coords.shape[0]
+        self.ids = {}
+        arrays = {'index': coords.index.to_numpy(dtype=np.int_)}
+        for col in self.columns:
+            if col in ['aChr', 'bChr']:
+                self.ids[col], codes = np.unique(coords[col].to_numpy(dtype=str), return_inverse=True)
+                arrays[col] = codes.astype(np.int32)
+            else:
+                arrays[col] = coords[col].to_numpy()
+        self.layout = []
+        size = 0
+        for col, arr in arrays.items():
+            self.layout.append((col, arr.dtype.str, size))
+            size += -(-arr.nbytes//8)*8
+        self.shm = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for col, arr in arrays.items():
+            self.column(col)[:] = arr
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['shm'] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state['shm'])
+
+    def column(self, col):
+        for c, dtype, offset in self.layout:
+            if c == col:
+                return np.ndarray(self.n, dtype=dtype, buffer=self.shm.buf, offset=offset)
+
+    def chromosome(self, chromo):
+        """Copy of the alignments between chromo in the two genomes as a DataFrame"""
+        sel = np.zeros(self.n, dtype=bool)
+        if chromo in self.ids['aChr'] and chromo in self.ids['bChr']:
+            sel = (self.column('aChr') == np.searchsorted(self.ids['aChr'], chromo)) & (self.column('bChr') == np.searchsorted(self.ids['bChr'], chromo))
+        data = {}
+        for col in self.columns:
+            if col in ['aChr', 'bChr']:
+                data[col] = np.array(self.ids[col], dtype=object)[self.column(col)[sel]]
+            else:
+                data[col] = self.column(col)[sel]
+        return pd.DataFrame(data, columns=self.columns, index=self.column('index')[sel])
+
+    def unlink(self):
+        self.shm.close()
+        self.shm.unlink()
+# END
+
 def startSyri(args, coords):
+    """Identifies the SRs between the genomes. Returns them as srResults."""
     nCores = args.nCores
     bRT = args.bruteRunTime
     threshold = 50  ##args.threshold
-    cwdPath = args.dir
-    prefix = args.prefix
     tUC = args.TransUniCount
     tUP = args.TransUniPercent
     invgl = args.invgl
@@ -506,49 +1028,70 @@ def startSyri(args, coords):
     logger.info('Analysing chromosomes: {}'.format(uniChromo))
     # Identify intra-chromosomal events (synteny, inversions, intra-trans, intra-dup) for each chromosome as a separate
     # process in parallel
-    with Pool(processes = nCores) as pool:
-        p = pool.map(partial(syri,threshold=threshold,coords=coords, cwdPath= cwdPath, bRT = bRT, prefix = prefix, tUC=tUC, tUP=tUP, invgl=invgl, tdgl=tdgl, tdolp=tdolp), uniChromo)
-    if p != [None]*len(uniChromo):
+    # Cores not needed for the chromosome level parallelisation are used within the chromosomes
+    nc = max(1, nCores//len(uniChromo))
+    from syri.tdfunc import solveClusterTasks, getCTXData, getCTXTree
+    # Chromosomes with the most alignments are started first, so that the largest one does not run alone at the end
+    alnCount = coords.loc[coords.aChr == coords.bChr].aChr.value_counts()
+    order = sorted(uniChromo, key=lambda c: -alnCount.get(c, 0))
+    # Workers read the alignments of their chromosome from shared memory
+    shared = sharedCoords(coords)
+    try:
+        with Pool(processes = nCores) as pool:
+            chromoOut = pool.imap_unordered(partial(syriChromo,threshold=threshold,coords=shared, bRT = bRT, tUC=tUC, tUP=tUP, invgl=invgl, tdgl=tdgl, tdolp=tdolp, nc=nc), order)
+            # Candidate building for cross-chromosomal events does not need the chromosome outputs and is run on the cores freed by the smaller chromosomes
+            ctxData = getCTXData(coords)
+            ctxTrees = [pool.apply_async(getCTXTree, (ctxData[ctxData.bDir == d], threshold, tdgl)) for d in [1, -1]]
+            out = dict(chromoOut)
+            out = [out[chromo] for chromo in uniChromo]
+            # TD clusters of all chromosomes are solved together, so that a chromosome with a few large clusters does not leave the other cores idle
+            tasks = [t for o in out for t in o[0]]
+            solutions = solveClusterTasks(tasks, pool, nCores, bRT, tdolp, threshold)
+            args = []
+            for o in out:
+                args.append((solutions[:len(o[0])],) + o[1])
+                solutions = solutions[len(o[0]):]
+            del(out, tasks)
+            p = pool.starmap(syriTD, args)
+            ctxTrees = [t.get() for t in ctxTrees]
+    finally:
+        shared.unlink()
+    if -1 in p:
         sys.exit()
     # for chromo in uniChromo:
     #     print(chromo)
-    #     syri(chromo,threshold=threshold,coords=coords, cwdPath= cwdPath, bRT = bRT, prefix = prefix, tUC=tUC, tUP=tUP, invgl=invgl, tdgl=tdgl, tdolp=tdolp)
+    #     syri(chromo,threshold=threshold,coords=coords, bRT = bRT, tUC=tUC, tUP=tUP, invgl=invgl, tdgl=tdgl, tdolp=tdolp)
 
     # Merge output of all chromosomes
-    mergeOutputFiles(uniChromo,cwdPath, prefix)
+    intraBlocks = [b for blocks in p for b in blocks]
 
     #Identify cross-chromosomal events in all chromosomes simultaneously
     from syri.tdfunc import getCTX
-    getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores, tdgl, tdolp)
+    ctxBlocks = getCTX(ctxData, srResults.fromBlocks(intraBlocks), threshold, bRT, tUC, tUP, nCores, tdgl, tdolp, trees=ctxTrees)
 
     # Recalculate syntenic blocks by considering the blocks introduced by CX events
-    outSyn(cwdPath, threshold, prefix)
-    return 'Finished'
+    synBlocks = outSyn(srResults.fromBlocks(intraBlocks + ctxBlocks), threshold)
+    return srResults.fromBlocks(synBlocks + [b for b in intraBlocks + ctxBlocks if b[0] != 0])
+
 
+def syriChromo(chromo, **kwargs):
+    """syri() for pool.imap_unordered, which needs the chromosome with the result"""
+    return chromo, syri(chromo, **kwargs)
 
-def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl, tdolp):
+
+def syri(chromo, threshold, coords, bRT, tUC, tUP, invgl, tdgl, tdolp, nc=1):
     logger = logging.getLogger("syri."+chromo)
+    coords = coords.chromosome(chromo)
     coordsData = coords[(coords.aChr == chromo) & (coords.bChr == chromo) & (coords.bDir == 1)]
     logger.info(chromo+" " + str(coordsData.shape))
     logger.info("Identifying Synteny for chromosome " + chromo)
-    df = apply_TS(coordsData.aStart.values,coordsData.aEnd.values,coordsData.bStart.values,coordsData.bEnd.values, threshold)
-    blocks = [alignmentBlock(i, df[i], coordsData.iloc[i]) for i in df.keys()]
-    for block in blocks:
-        i = 0
-        while(i < len(block.children)):
-            block.children = list(set(block.children) - set(blocks[block.children[i]].children))
-            i+=1
-        block.children.sort()
-
-        for child in block.children:
-            blocks[child].addParent(block.id)
-
-        scores = [blocks[parent].score for parent in block.parents]
-        if len(scores) > 0:
-            block.bestParent(block.parents[scores.index(max(scores))], max(scores))
-    synPath = getSynPath(blocks)
+    if max(coordsData.aEnd.max(), coordsData.bEnd.max()) < TS_MAXGAP:
+        synPath = chainSyn(coordsData.aStart.values, coordsData.aEnd.values, coordsData.bStart.values, coordsData.bEnd.values, getChainScores(coordsData), threshold)
+    else:
+        # The gap limit of apply_TS becomes effective, which the chaining does not model
+        synPath = getSynPathTS(coordsData, threshold)
     synData = coordsData.iloc[synPath].copy()
-    del(coordsData, blocks, df)
+    del(coordsData)
     collect()
 
     ##########################################################################
@@ -557,7 +1100,7 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
     logger.info("Identifying Inversions for chromosome " + chromo)
 
     from syri.inversions import getInversions
-    invertedCoordsOri, profitable, bestInvPath, invData, synInInv, badSyn = getInversions(coords,chromo, threshold, synData, tUC, tUP, invgl)
+    invertedCoordsOri, profitable, bestInvPath, invData, synInInv, badSyn = getInversions(coords,chromo, threshold, synData, tUC, tUP, invgl, nc=nc)
 
     ##########################################################
     #### Identify Translocation and duplications
@@ -565,7 +1108,7 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
     logger.info("Identifying translocation and duplication for chromosome " + chromo)
 
     # Import functions
-    from syri.tdfunc import blocksdata, makeTransGroupList, transBlock, getBestClusterSubset, getTransClasses, getDupGenome, getTransCluster
+    from syri.tdfunc import blocksdata, getGenomeGroups, getTransClusters, clusterList, transCandidates, meBlocks, makeClusterTasks
 
     chromBlocks = coords[(coords.aChr == chromo) & (coords.bChr == chromo)]
     inPlaceIndices = sorted(list(synData.index.values) + list(invData.index.values))
@@ -604,23 +1147,11 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
     logger.debug("Translocations : found blocks" + chromo)
 
 
-    allTransGenomeAGroups = makeTransGroupList(allTransBlocks, "aStart", "aEnd", threshold)
-    allTransGenomeBGroups = makeTransGroupList(allTransBlocks, "bStart", "bEnd", threshold)
-
-    allTransGroupIndices = {}
-    for i in range(len(allTransGenomeAGroups)):
-        for block in allTransGenomeAGroups[i].member:
-            allTransGroupIndices[block] = [i]
-    for i in range(len(allTransGenomeBGroups)):
-        for block in allTransGenomeBGroups[i].member:
-            allTransGroupIndices[block].append(i)
+    allTransGenomeAGroups = getGenomeGroups(allTransBlocks.aStart.values.astype(np.int64), allTransBlocks.aEnd.values.astype(np.int64), None, threshold)
+    allTransGenomeBGroups = getGenomeGroups(allTransBlocks.bStart.values.astype(np.int64), allTransBlocks.bEnd.values.astype(np.int64), None, threshold)
 
     logger.debug("Translocations : getting clusters " + chromo)
-    allTransCluster = getTransCluster(allTransGroupIndices, {i:allTransGenomeAGroups[i].member for i in range(len(allTransGenomeAGroups))}, {i:allTransGenomeBGroups[i].member for i in range(len(allTransGenomeBGroups))})
-
-    allTransClusterIndices = dict()
-    for i in range(len(allTransCluster)):
-        allTransClusterIndices.update(dict.fromkeys(allTransCluster[i], i))
+    allTransCluster = clusterList(*getTransClusters(allTransGenomeAGroups.group, allTransGenomeBGroups.group))
 
     logger.debug("Translocations : making blocks data " + chromo +" " + str(datetime.now()))
     logger.debug("memory usage: " + str(psutil.Process(os.getpid()).memory_info()[0]/2.**30))
@@ -638,46 +1169,18 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
                                        tUP)
         sortedInPlace = inPlaceBlocks.sort_values(["bStart","bEnd"])
         buni = getOverlapWithSynBlocks(np.array(allTransBlocks.bStart), np.array(allTransBlocks.bEnd), np.array([chromo]*allTransBlocks.shape[0]), np.array(sortedInPlace.bStart), np.array(sortedInPlace.bEnd), np.array([chromo]*inPlaceBlocks.shape[0]), threshold, allTransBlocks.shape[0], tUC, tUP)
+    else:
+        auni = buni = np.zeros(0, dtype=bool)
 
-    genomeGroupLengths = ([len(i.member) for i in allTransGenomeAGroups], [len(i.member) for i in allTransGenomeBGroups])
-
-    allTransBlocksData = [transBlock(i) for i in range(allTransBlocks.shape[0])]
-    count = 0
-    for row in allTransBlocks.itertuples(index = False):
-        allTransBlocksData[count].aStart = row.aStart
-        allTransBlocksData[count].aEnd = row.aEnd
-        allTransBlocksData[count].bStart = row.bStart
-        allTransBlocksData[count].bEnd = row.bEnd
-        allTransBlocksData[count].dir = row.dir
-        allTransBlocksData[count].transClusterIndex = allTransClusterIndices[count]
-        allTransBlocksData[count].transGroupIndices = allTransGroupIndices[count]
-        allTransBlocksData[count].aUni = auni[count]
-        allTransBlocksData[count].bUni = buni[count]
-        if genomeGroupLengths[0][allTransBlocksData[count].transGroupIndices[0]] == 1:
-            allTransBlocksData[count].genomeAUni = True
-        if genomeGroupLengths[1][allTransBlocksData[count].transGroupIndices[1]] == 1:
-            allTransBlocksData[count].genomeBUni = True
-        if (allTransBlocksData[count].aUni and allTransBlocksData[count].genomeAUni) or (allTransBlocksData[count].bUni and allTransBlocksData[count].genomeBUni):
-            allTransBlocksData[count].setStatus(1)
-        count+=1
+    allTransBlocksData = transCandidates(allTransBlocks, allTransBlocks.dir, allTransCluster, allTransGenomeAGroups, allTransGenomeBGroups, auni, buni)
 
     logger.debug("Translocations : finished making blocks data on" + chromo)
     logger.debug("memory usage: " + str(psutil.Process(os.getpid()).memory_info()[0]/2.**30))
 
-    aUni = np.array([allTransBlocksData[i].aUni for i in range(allTransBlocks.shape[0])], dtype="int")
-    bUni = np.array([allTransBlocksData[i].bUni for i in range(allTransBlocks.shape[0])], dtype="int")
-    status = np.array([allTransBlocksData[i].status for i in range(allTransBlocks.shape[0])], dtype="int")
-    aIndex = np.array([allTransBlocksData[i].transGroupIndices[0] for i in range(allTransBlocks.shape[0])], dtype="int")
-    bIndex = np.array([allTransBlocksData[i].transGroupIndices[1] for i in range(allTransBlocks.shape[0])], dtype="int")
-
     ## get sorted values. sorted based on genome coordinate in allTransBlocks
-    aGroups = {}
-    for i in range(len(allTransGenomeAGroups)):
-        aGroups[i] = allTransBlocks.iloc[allTransGenomeAGroups[i].member].sort_values(['aStart','aEnd']).index.values
-    bGroups = {}
-    for i in range(len(allTransGenomeBGroups)):
-        bGroups[i] = allTransBlocks.iloc[allTransGenomeBGroups[i].member].sort_values(['bStart', 'bEnd']).index.values
-    clstrsize = np.array([len(allTransCluster[i.transClusterIndex]) for i in allTransBlocksData], dtype = 'int')
+    aGroups = allTransGenomeAGroups.asdict()
+    bGroups = allTransGenomeBGroups.asdict()
+    clstrsize = np.array([len(c) for c in allTransCluster], dtype = 'int')[allTransBlocksData.clusterIndex]
 
     if len(allTransBlocks) > 0:
         out = getmeblocks(np.array(allTransBlocks.aStart),
@@ -685,57 +1188,59 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
                           np.array(allTransBlocks.bStart),
                           np.array(allTransBlocks.bEnd),
                           threshold,
-                          aUni,
-                          bUni,
-                          status,
-                          aIndex,
-                          bIndex,
+                          allTransBlocksData.aUni,
+                          allTransBlocksData.bUni,
+                          allTransBlocksData.status,
+                          allTransBlocksData.aIndex,
+                          allTransBlocksData.bIndex,
                           aGroups,
                           bGroups,
                           clstrsize,
                           tdolp)
 
-        for i in range(len(out[0])):
-            if out[0][i]:
-                allTransCluster[allTransClusterIndices[i]].remove(i)
+        for i in np.nonzero(out[0])[0]:
+            allTransCluster[allTransBlocksData.clusterIndex[i]].remove(i)
+        meData = meBlocks(*out[1:])
+    else:
+        meData = None
 
-        for i in out[1].keys():
-            if len(out[1][i]) > 0:
-                allTransBlocksData[i].addMEBlock(list(out[1][i]))
+    tasks = makeClusterTasks(allTransCluster, allTransBlocksData, meData, aGroups, bGroups, chromo)
 
-        for i in out[2].keys():
-            allTransBlocksData[i].setMEList(list(out[2][i][0]),list(out[2][i][1]))
+    tempInvBlocks = []
+    invBlocks = []
+    for i in bestInvPath:
+        invPos = profitable[i].invPos
+        tempInvBlocks.append([invertedCoordsOri.iat[invPos[0],0],invertedCoordsOri.iat[invPos[-1],1],invertedCoordsOri.iat[invPos[-1],3],invertedCoordsOri.iat[invPos[0],2]])
+        invBlocks.append(srBlock(1, chromo, *tempInvBlocks[-1][:2], chromo, *tempInvBlocks[-1][2:], invertedCoordsOri.iloc[invPos, :4].values))
 
-        # del(aUni, bUni, status, aIndex, bIndex, aGroups, bGroups, out)
-        # collect()
+    # The clusters are solved in a pool shared by all chromosomes, and syriTD continues with their solutions.
+    # The state for syriTD is pickled twice (to the parent and to the syriTD worker), so only the columns it
+    # needs are kept. Candidate coordinates are in allTransBlocksData and group dicts are rebuilt from the groups.
+    outPlaceCoords = outPlaceBlocks[["aStart","aEnd","bStart","bEnd"]].values.astype(np.int64)
+    orderedAln = outPlaceCoords[outPlaceBlocks.bDir.values == 1]
+    invertedAln = outPlaceCoords[outPlaceBlocks.bDir.values == -1]
+    return tasks, (chromo, threshold, tdolp, invBlocks, synData[["aStart","aEnd","bStart","bEnd"]], badSyn, synInInv, tempInvBlocks, orderedAln, invertedAln, transBlocks, invTransBlocks, allTransIndexOrder, allTransBlocksData, allTransGenomeAGroups, allTransGenomeBGroups, meData)
 
-    logger.debug("Translocations : finding solutions "+ chromo + str(datetime.now()))
-    clusterSolutions = []
-    for i in range(len(allTransCluster)):
-        if len(allTransCluster[i]) > 0:
-            if len(allTransCluster[i]) > 10000:
-                clusterSolutions.append(getBestClusterSubset(allTransCluster[i], allTransBlocksData, bRT, tdolp, chromo, aGroups, bGroups, threshold))
-            else:
-                clusterSolutions.append(getBestClusterSubset(allTransCluster[i], allTransBlocksData, bRT, tdolp, chromo))
+
+def syriTD(clusterSolutions, chromo, threshold, tdolp, invBlocks, synData, badSyn, synInInv, tempInvBlocks, orderedAln, invertedAln, transBlocks, invTransBlocks, allTransIndexOrder, allTransBlocksData, allTransGenomeAGroups, allTransGenomeBGroups, meData):
+    """
+    Classifies the TDs selected from the clusters of chromo. orderedAln and
+    invertedAln have the aStart, aEnd, bStart, bEnd of the out-of-place
+    alignments. Returns the SR blocks of the chromosome as srBlock, or -1 on
+    error.
+    """
+    logger = logging.getLogger("syri."+chromo)
+    from syri.tdfunc import getTransClasses, getDupGenome
+
+    allTransBlocks = pd.DataFrame({c: getattr(allTransBlocksData, c) for c in ["aStart","aEnd","bStart","bEnd","dir"]})
+    aGroups = allTransGenomeAGroups.asdict()
+    bGroups = allTransGenomeBGroups.asdict()
 
     clusterSolutionBlocks = [i[1] for i in clusterSolutions]
-    #clusterBlocks = unlist(clusterSolutionBlocks)
 
     logger.debug("Translocations : processing translocations " + chromo + str(datetime.now()))
 
-    garb = deque()
-    for i in range(len(allTransBlocksData)):
-        if not allTransBlocksData[i].aUni and not allTransBlocksData[i].bUni:
-            garb.append(0)
-        elif allTransBlocksData[i].status == 1:
-            garb.append(0)
-        elif not allTransBlocksData[i].aUni:
-            garb.append(1)
-        elif not allTransBlocksData[i].bUni:
-            garb.append(2)
-        else:
-            garb.append(3)
-    meclass = np.array(list(garb), np.uint16)
+    meclass = allTransBlocksData.meclass()
 
     transClasses = getTransClasses(clusterSolutionBlocks,
                                    allTransBlocksData,
@@ -745,13 +1250,14 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
                                    allTransBlocks.aEnd.values.astype(np.uint),
                                    allTransBlocks.bStart.values.astype(np.uint),
                                    allTransBlocks.bEnd.values.astype(np.uint),
-                                   aIndex,
-                                   bIndex,
+                                   allTransBlocksData.aIndex,
+                                   allTransBlocksData.bIndex,
                                    aGroups,
                                    bGroups,
                                    threshold,
                                    meclass,
-                                   tdolp)
+                                   tdolp,
+                                   meData)
     dupData = allTransBlocks.iloc[transClasses["duplication"]].sort_values(by = ["aStart","aEnd","bStart","bEnd"])
     invDupData = allTransBlocks.iloc[transClasses["invDuplication"]].sort_values(by = ["aStart","aEnd","bStart","bEnd"])
     TLData = allTransBlocks.iloc[transClasses["translocation"]].sort_values(by = ["aStart","aEnd","bStart","bEnd"])
@@ -764,8 +1270,8 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
                            allTransBlocks.aEnd.values.astype(np.uint),
                            allTransBlocks.bStart.values.astype(np.uint),
                            allTransBlocks.bEnd.values.astype(np.uint),
-                           aIndex,
-                           bIndex,
+                           allTransBlocksData.aIndex,
+                           allTransBlocksData.bIndex,
                            aGroups,
                            bGroups,
                            threshold,
@@ -778,8 +1284,8 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
                               allTransBlocks.aEnd.values.astype(np.uint),
                               allTransBlocks.bStart.values.astype(np.uint),
                               allTransBlocks.bEnd.values.astype(np.uint),
-                              aIndex,
-                              bIndex,
+                              allTransBlocksData.aIndex,
+                              allTransBlocksData.bIndex,
                               aGroups,
                               bGroups,
                               threshold,
@@ -787,130 +1293,367 @@ def syri(chromo, threshold, coords, cwdPath, bRT, prefix, tUC, tUP, invgl, tdgl,
                               tdolp)
 
 
-    fout = open(cwdPath+prefix+chromo+"_invOut.txt","w")
-    tempInvBlocks = []
-    for i in bestInvPath:
-        invPos = profitable[i].invPos
-        tempInvBlocks.append([invertedCoordsOri.iat[invPos[0],0],invertedCoordsOri.iat[invPos[-1],1],invertedCoordsOri.iat[invPos[-1],3],invertedCoordsOri.iat[invPos[0],2]])
-        fout.write("\t".join(map(str,["#",invertedCoordsOri.iat[invPos[0],0],invertedCoordsOri.iat[invPos[-1],1],"-",invertedCoordsOri.iat[invPos[-1],3],invertedCoordsOri.iat[invPos[0],2],"\n"])))
-        for j in invPos:
-            fout.write("\t".join(map(str,invertedCoordsOri.iloc[j][:4])))
-            fout.write("\n")
-    fout.close()
-
-
     ## Grouping Syn blocks : Final synblock identification is done after ctx identification.
     allBlocks, outClusters = groupSyn(tempInvBlocks, dupData, invDupData, invTLData, TLData, threshold, synData, badSyn)
     if outClusters == [[]]:
         logger.error(f"No syntenic region found for chromosome: {chromo}. This is potentially caused by the two assemblies having different strands for this chromosomes. Reverse complement the chromosome to ensure that the same strands are analysed. Exiting.")
         return -1
 
-    orderedBlocks = outPlaceBlocks[outPlaceBlocks.bDir == 1]
-    invertedBlocks = outPlaceBlocks[outPlaceBlocks.bDir == -1]
-
-########################################################################################################################
-    with open(cwdPath+prefix+chromo+"_synOut.txt","w") as fout:
-        for i in outClusters:
-            fout.write("\t".join(map(str,["#",allBlocks.at[i[0],"aStart"],allBlocks.at[i[-1],"aEnd"],"-",allBlocks.at[i[0],"bStart"],allBlocks.at[i[-1],"bEnd"],"\n"])))
-            for j in i:
-                fout.write("\t".join(map(str,allBlocks.loc[j][:-1])))
-                if j in synInInv:
-                    fout.write("\tSyn_in_Inv\n")
-                else:
-                    fout.write("\n")
+    srBlocks = []
+    for i in outClusters:
+        srBlocks.append(srBlock(0, chromo, allBlocks.at[i[0],"aStart"], allBlocks.at[i[-1],"aEnd"], chromo, allBlocks.at[i[0],"bStart"], allBlocks.at[i[-1],"bEnd"], allBlocks.loc[i].iloc[:, :4].values, tags=["Syn_in_Inv" if j in synInInv else "" for j in i]))
+    srBlocks += invBlocks
+    for cls, data, blocks, alnData in [(2, TLData, transBlocks, orderedAln), (3, invTLData, invTransBlocks, invertedAln), (4, dupData, transBlocks, orderedAln), (5, invDupData, invTransBlocks, invertedAln)]:
+        for i in data.index.values:
+            srBlocks.append(srBlock(cls, chromo, data.at[i,"aStart"], data.at[i,"aEnd"], chromo, data.at[i,"bStart"], data.at[i,"bEnd"], alnData[blocks[allTransIndexOrder[i]]], data.at[i,"dupGenomes"] if cls > 3 else ""))
+    return srBlocks
+# END
 ########################################################################################################################
 
-    with open(cwdPath+prefix+chromo+"_dupOut.txt","w") as fout:
-        for i in dupData.index.values:
-            fout.write("\t".join(map(str,["#",dupData.at[i,"aStart"],dupData.at[i,"aEnd"],"-",dupData.at[i,"bStart"],dupData.at[i,"bEnd"],"-", dupData.at[i,"dupGenomes"],"\n"])))
-            for j in transBlocks[allTransIndexOrder[i]]:
-                fout.write("\t".join(map(str,orderedBlocks.iloc[j][:4])))
-                fout.write("\n")
 
-########################################################################################################################
+# Effective default gap limit of apply_TS (the literal default overflows the C int)
+TS_MAXGAP = 1215752192
 
-    with open(cwdPath+prefix+chromo+"_invDupOut.txt","w") as fout:
-        for i in invDupData.index.values:
-            fout.write("\t".join(map(str,["#",invDupData.at[i,"aStart"],invDupData.at[i,"aEnd"],"-",invDupData.at[i,"bStart"],invDupData.at[i,"bEnd"],"-", invDupData.at[i,"dupGenomes"],"\n"])))
-            for j in invTransBlocks[allTransIndexOrder[i]]:
-                fout.write("\t".join(map(str,invertedBlocks.iloc[j][:4])))
-                fout.write("\n")
+cpdef getTSEdges(long[:] astart, long[:] aend, long[:] bstart, long[:] bend, int threshold, int mxgap = 100000000000):
+    """
+    Edges of the alignment DAG in CSR format: i -> j (i < j) when j starts
+    and ends more than threshold after i in both genomes and the gaps are
+    smaller than mxgap.
+    """
+    return getCandidateEdges(astart, aend, bstart, bend, None, None, None, threshold, mxgap)
 
-########################################################################################################################
 
-    with open(cwdPath+prefix+chromo+"_TLOut.txt","w") as fout:
-        for i in TLData.index.values:
-            fout.write("\t".join(map(str,["#",TLData.at[i,"aStart"],TLData.at[i,"aEnd"],"-",TLData.at[i,"bStart"],TLData.at[i,"bEnd"],"\n"])))
-            for j in transBlocks[allTransIndexOrder[i]]:
-                fout.write("\t".join(map(str,orderedBlocks.iloc[j][:4])))
-                fout.write("\n")
+cpdef apply_TS(long[:] astart, long[:] aend, long[:] bstart, long[:] bend, int threshold, int mxgap = 100000000000):
+    indptr, indices = getTSEdges(astart, aend, bstart, bend, threshold, mxgap)
+    return {i: indices[indptr[i]:indptr[i+1]].tolist() for i in range(len(astart))}
 
-########################################################################################################################
 
-    with open(cwdPath+prefix+chromo+"_invTLOut.txt","w") as fout:
-        for i in invTLData.index.values:
-            fout.write("\t".join(map(str,["#",invTLData.at[i,"aStart"],invTLData.at[i,"aEnd"],"-",invTLData.at[i,"bStart"],invTLData.at[i,"bEnd"],"\n"])))
-            for j in invTransBlocks[allTransIndexOrder[i]]:
-                fout.write("\t".join(map(str,invertedBlocks.iloc[j][:4])))
-                fout.write("\n")
+def getSynPathTS(coordsData, threshold):
+    """
+    All-pairs version of the synteny search: builds the alignment DAG with
+    apply_TS and selects the best path using alignmentBlock objects. This is
+    quadratic in the number of alignments and is kept for validating
+    chainSyn.
+    """
+    indptr, indices = getTSEdges(coordsData.aStart.values,coordsData.aEnd.values,coordsData.bStart.values,coordsData.bEnd.values, threshold)
+    indptr, indices = reduceGraph(indptr, indices)
+    acc, parent = getBestParents(indptr, indices, getChainScores(coordsData))
+    return getSynPath(acc, parent)
+# END
 
-    return
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def reduceGraph(long[::1] indptr, long[::1] indices):
+    """
+    Transitive reduction of a DAG stored in CSR format (children of node i
+    are indices[indptr[i]:indptr[i+1]]): a child of i is removed when it is
+    also a child of another child of i. Children stay in increasing order.
+    """
+    cdef:
+        long n = indptr.shape[0] - 1
+        long i, k, c, m, nout = 0
+        long[::1] mark = np.full(n, -1, dtype=np.int64)
+        long[::1] rindptr = np.zeros(n+1, dtype=np.int64)
+        long[::1] rindices = np.empty(indices.shape[0], dtype=np.int64)
+    with nogil:
+        for i in range(n):
+            for k in range(indptr[i], indptr[i+1]):
+                c = indices[k]
+                for m in range(indptr[c], indptr[c+1]):
+                    mark[indices[m]] = i
+            for k in range(indptr[i], indptr[i+1]):
+                if mark[indices[k]] != i:
+                    rindices[nout] = indices[k]
+                    nout += 1
+            rindptr[i+1] = nout
+    return np.asarray(rindptr), np.asarray(rindices[:nout]).copy()
 # END
-########################################################################################################################
 
 
-cpdef apply_TS(long[:] astart, long[:] aend, long[:] bstart, long[:] bend, int threshold, int mxgap = 100000000000):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def getBestParents(long[::1] indptr, long[::1] indices, double[::1] scores):
+    """
+    Longest path DP on a CSR DAG with edges from lower to higher node ids.
+    The best parent of a node is the one with the highest accumulated score,
+    and the lowest id among equals. Returns the accumulated scores and the
+    best parent of each node (-1 for none).
+    """
     cdef:
-        Py_ssize_t                              i, j,  n = len(astart)
-        cpp_map[long, cpp_deq[long]]            df
-        cpp_map[long, cpp_deq[long]].iterator   mapit
-    for i in range(<Py_ssize_t> n):
-        for j in range(<Py_ssize_t> i+1, <Py_ssize_t> n):
-            if (astart[j] - aend[i]) < mxgap:        # Select only alignments with small gaps
-                if (astart[j] - astart[i]) > threshold:
-                    if (aend[j] - aend[i]) > threshold:
-                        if (bstart[j] - bend[i]) < mxgap:        # Select only alignments with small gaps
-                            if (bstart[j] - bstart[i]) > threshold:
-                                if (bend[j] - bend[i]) > threshold:
-                                    df[i].push_back(j)
-    out = {}
-    for i in range(n):
-        if df.count(i)== 1:
-            out[i] = [df[i][j] for j in range(<Py_ssize_t> df[i].size())]
+        long n = indptr.shape[0] - 1
+        long i, k, c
+        double[::1] acc = np.empty(n, dtype=np.float64)
+        double[::1] best = np.full(n, -INFINITY, dtype=np.float64)
+        long[::1] parent = np.full(n, -1, dtype=np.int64)
+    with nogil:
+        for i in range(n):
+            acc[i] = scores[i] + best[i] if parent[i] != -1 else scores[i]
+            for k in range(indptr[i], indptr[i+1]):
+                c = indices[k]
+                if acc[i] > best[c]:
+                    best[c] = acc[i]
+                    parent[c] = i
+    return np.asarray(acc), np.asarray(parent)
+# END
+
+
+def getChainScores(coordsData):
+    """
+    Score of each alignment as used by alignmentBlock.
+    """
+    return ((coordsData.aLen.values + coordsData.bLen.values) * coordsData.iden.values).astype(np.float64)
+# END
+
+
+cdef inline bint chainbetter(double s1, long i1, double s2, long i2) noexcept nogil:
+    return s1 > s2 or (s1 == s2 and i1 < i2)
+
+
+cdef struct chainData:
+    long t
+    long nd         # Size of the Fenwick tree
+    long *ast
+    long *aen
+    long *bst
+    long *ben
+    long *drank     # Rank of bEnd among all alignments
+    long *dcnt      # Number of alignments with bEnd < bend - threshold
+    double *own
+    double *acc
+    double *bacc    # Best predecessor (accumulated score, index) found so far
+    long *bidx
+    double *facc    # Fenwick tree (prefix max) over bEnd rank
+    long *fidx
+    long *items     # Events of a cross step, in aEnd order
+    long *tmp
+
+
+cdef inline long chainkey(long *v, long e, long t) noexcept nogil:
+    """
+    Sort key of event e on the coordinate v. e = 2*i for alignment i as a
+    predecessor (point) and 2*i+1 for alignment i looking for a predecessor
+    (query). A point is before a query exactly when v[point] < v[query] - t.
+    """
+    return 2*v[e >> 1] if e & 1 == 0 else 2*(v[e >> 1] - t - 1) + 1
+
+
+cdef inline void chainoffer(chainData *cd, long j, double a, long i) noexcept nogil:
+    if cd.bidx[j] < 0 or chainbetter(a, i, cd.bacc[j], cd.bidx[j]):
+        cd.bacc[j] = a
+        cd.bidx[j] = i
+
+
+cdef inline void chaintry(chainData *cd, long i, long j) noexcept nogil:
+    # aStart is already ordered by the caller
+    if cd.aen[i] < cd.aen[j] - cd.t and cd.bst[i] < cd.bst[j] - cd.t and cd.ben[i] < cd.ben[j] - cd.t:
+        chainoffer(cd, j, cd.acc[i], i)
+
+
+cdef void chainsweep(chainData *cd, long l, long r) noexcept nogil:
+    """
+    Offers every point in items[l:r] to the queries after it which it
+    precedes in bStart and bEnd. items[l:r] is in aEnd order, so earlier
+    points satisfy the aEnd rule. Leaves items[l:r] in bStart order.
+    """
+    cdef long m, x, y, e, k, p
+    if r - l <= 16:
+        for x in range(l, r):
+            if cd.items[x] & 1 == 0:
+                for y in range(x+1, r):
+                    if cd.items[y] & 1:
+                        chaintry(cd, cd.items[x] >> 1, cd.items[y] >> 1)
+        for x in range(l+1, r):
+            e = cd.items[x]
+            k = chainkey(cd.bst, e, cd.t)
+            y = x - 1
+            while y >= l and chainkey(cd.bst, cd.items[y], cd.t) > k:
+                cd.items[y+1] = cd.items[y]
+                y -= 1
+            cd.items[y+1] = e
+        return
+    m = (l + r) // 2
+    chainsweep(cd, l, m)
+    chainsweep(cd, m, r)
+    # Points of the left half satisfy the aEnd rule for queries of the right half. Sweep both by bStart and select by bEnd rank.
+    x = l
+    for y in range(m, r):
+        e = cd.items[y]
+        if e & 1 == 0:
+            continue
+        k = chainkey(cd.bst, e, cd.t)
+        while x < m and chainkey(cd.bst, cd.items[x], cd.t) < k:
+            if cd.items[x] & 1 == 0:
+                p = cd.drank[cd.items[x] >> 1] + 1
+                while p <= cd.nd:
+                    if cd.fidx[p] < 0 or chainbetter(cd.acc[cd.items[x] >> 1], cd.items[x] >> 1, cd.facc[p], cd.fidx[p]):
+                        cd.facc[p] = cd.acc[cd.items[x] >> 1]
+                        cd.fidx[p] = cd.items[x] >> 1
+                    p += p & -p
+            x += 1
+        p = cd.dcnt[e >> 1]
+        while p > 0:
+            if cd.fidx[p] >= 0:
+                chainoffer(cd, e >> 1, cd.facc[p], cd.fidx[p])
+            p -= p & -p
+    for y in range(l, x):
+        if cd.items[y] & 1 == 0:
+            p = cd.drank[cd.items[y] >> 1] + 1
+            while p <= cd.nd:
+                cd.fidx[p] = -1
+                p += p & -p
+    # Merge the halves by bStart
+    x, y, k = l, m, l
+    while x < m or y < r:
+        if y == r or (x < m and chainkey(cd.bst, cd.items[x], cd.t) <= chainkey(cd.bst, cd.items[y], cd.t)):
+            cd.tmp[k] = cd.items[x]
+            x += 1
         else:
-            out[i] = []
-    return out
+            cd.tmp[k] = cd.items[y]
+            y += 1
+        k += 1
+    for k in range(l, r):
+        cd.items[k] = cd.tmp[k]
 
 
-def getSynPath(blocks):
+cdef void chaincross(chainData *cd, long *ev, long l, long m, long r) noexcept nogil:
+    """Offers the points in ev[l:m] to the queries in ev[m:r], which they precede in aStart"""
+    cdef:
+        long npt = 0, nq = 0, k, x, y
+        cpp_vec[pair[long, long]] keys
+    for k in range(l, m):
+        npt += 1 - (ev[k] & 1)
+    for k in range(m, r):
+        nq += ev[k] & 1
+    if npt == 0 or nq == 0:
+        return
+    if npt * nq <= 64:
+        for x in range(l, m):
+            if ev[x] & 1 == 0:
+                for y in range(m, r):
+                    if ev[y] & 1:
+                        chaintry(cd, ev[x] >> 1, ev[y] >> 1)
+        return
+    for k in range(l, m):
+        if ev[k] & 1 == 0:
+            keys.push_back(pair[long, long](chainkey(cd.aen, ev[k], cd.t), ev[k]))
+    for k in range(m, r):
+        if ev[k] & 1:
+            keys.push_back(pair[long, long](chainkey(cd.aen, ev[k], cd.t), ev[k]))
+    cpp_sort(keys.begin(), keys.end())
+    for k in range(<long> keys.size()):
+        cd.items[k] = keys[k].second
+    chainsweep(cd, 0, keys.size())
+
+
+cdef void chaincdq(chainData *cd, long *ev, long l, long r) noexcept nogil:
+    """
+    Divide and conquer over the events ev[l:r] in aStart order. The best
+    predecessor of an alignment is final once its point is reached, as all
+    points before its query have been offered by then.
+    """
+    cdef long m, j
+    if r - l == 1:
+        if ev[l] & 1 == 0:
+            j = ev[l] >> 1
+            cd.acc[j] = cd.own[j] + cd.bacc[j] if cd.bidx[j] >= 0 else cd.own[j]
+        return
+    m = (l + r) // 2
+    chaincdq(cd, ev, l, m)
+    chaincross(cd, ev, l, m, r)
+    chaincdq(cd, ev, m, r)
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def chainSyn(astart, aend, bstart, bend, scores, long threshold):
+    """
+    Find the highest scoring collinear path of alignments in O(n log^3 n).
+
+    Alignment i can precede j when i < j and all four coordinates of j are
+    more than threshold larger than those of i (the rule used by apply_TS).
+    Alignments must be sorted by aStart, which makes i < j follow from the
+    aStart rule. Every alignment is a point (a possible predecessor) and a
+    query (looking for its predecessor). A divide and conquer over aStart
+    offers the points of one half to the queries of the other. Within it, a
+    second divide and conquer over aEnd offers points to queries through a
+    Fenwick tree over bEnd rank, swept by bStart. The best parent is the
+    highest scoring predecessor with ties broken by the smaller index, so
+    the path is the same as the one from getSynPathTS.
+    Returns positional indices of the selected alignments.
+    """
+    cdef:
+        long[::1] ast = np.ascontiguousarray(astart, dtype=np.int64)
+        long[::1] aen = np.ascontiguousarray(aend, dtype=np.int64)
+        long[::1] bst = np.ascontiguousarray(bstart, dtype=np.int64)
+        long[::1] ben = np.ascontiguousarray(bend, dtype=np.int64)
+        double[::1] own = np.ascontiguousarray(scores, dtype=np.float64)
+        long n = ast.shape[0]
+        long[::1] ev, drank, dcnt, bidx, fidx, items, tmp
+        double[::1] acc, bacc, facc
+        chainData cd
+    if n == 0:
+        return []
+    if threshold < 0:
+        raise ValueError("chainSyn requires a non-negative threshold")
+    if np.any(np.diff(np.asarray(ast)) < 0):
+        raise ValueError("chainSyn requires alignments sorted by aStart")
+    # Points (2*i) and queries (2*i+1) in aStart order
+    evkey = np.concatenate((2*np.asarray(ast), 2*(np.asarray(ast) - threshold - 1) + 1))
+    evid = np.concatenate((2*np.arange(n), 2*np.arange(n) + 1))
+    ev = evid[np.argsort(evkey, kind='stable')].astype(np.int64)
+    dorder = np.argsort(np.asarray(ben), kind='stable')
+    drank = np.empty(n, dtype=np.int64)
+    drank.base[dorder] = np.arange(n)
+    dcnt = np.searchsorted(np.asarray(ben)[dorder], np.asarray(ben) - threshold - 1, side='right').astype(np.int64)
+    acc = np.empty(n, dtype=np.float64)
+    bacc = np.full(n, -np.inf, dtype=np.float64)
+    bidx = np.full(n, -1, dtype=np.int64)
+    facc = np.full(n+1, -np.inf, dtype=np.float64)
+    fidx = np.full(n+1, -1, dtype=np.int64)
+    items = np.empty(2*n, dtype=np.int64)
+    tmp = np.empty(2*n, dtype=np.int64)
+    cd.t, cd.nd = threshold, n
+    cd.ast, cd.aen, cd.bst, cd.ben = &ast[0], &aen[0], &bst[0], &ben[0]
+    cd.drank, cd.dcnt = &drank[0], &dcnt[0]
+    cd.own, cd.acc, cd.bacc, cd.bidx = &own[0], &acc[0], &bacc[0], &bidx[0]
+    cd.facc, cd.fidx = &facc[0], &fidx[0]
+    cd.items, cd.tmp = &items[0], &tmp[0]
+    with nogil:
+        chaincdq(&cd, &ev[0], 0, 2*n)
+    synPath = deque()
+    j = np.argmax(acc)
+    while j != -1:
+        synPath.appendleft(j)
+        j = bidx[j]
+    return list(synPath)
+# END
+
+
+def getSynPath(acc, parent):
     cdef list synPath = []
-    scores = [block.score for block in blocks]
-    cdef int lastBlock = scores.index(max(scores))
-    while blocks[lastBlock].bestParentID != -1:
+    cdef long lastBlock = np.argmax(acc)
+    while parent[lastBlock] != -1:
         synPath.append(lastBlock)
-        lastBlock = blocks[lastBlock].bestParentID        
+        lastBlock = parent[lastBlock]
     synPath.append(lastBlock)
     return(synPath[::-1])
 
 
-def outSyn(cwdPath, threshold, prefix):
-    ctxAnnoDict = {"duplication":"dupCtx",
-                   "invDuplication":"invDupCtx",
-                   "translocation":"TLCtx",
-                   "invTranslocation":"invTLCtx"}
+def outSyn(srdata, threshold):
+    """Syntenic blocks regrouped with the CTX blocks in srdata, as srBlock"""
+    ctxAnnoDict = {6:"TLCtx",
+                   7:"invTLCtx",
+                   8:"dupCtx",
+                   9:"invDupCtx"}
     reCoords =  pd.DataFrame()
 
     synData = []
-    with open(cwdPath+prefix+"synOut.txt","r") as fin:
-        for line in fin:
-            line = line.strip().split("\t")
-            if line[0] == "#":
-                chromo = line[1]
-                continue
-            if len(line) == 4:
-                synData.append(list(map(int,line[:4]))+[chromo,chromo])
-            elif len(line) == 5:
-                synData.append(list(map(int,line[:4]))+[chromo,chromo] + [line[4]])
+    for i in np.flatnonzero(srdata.source == 0):
+        chromo = srdata.chrs[srdata.achr[i]]
+        for j in range(srdata.ptr[i], srdata.ptr[i+1]):
+            line = [int(srdata.alnastart[j]), int(srdata.alnaend[j]), int(srdata.alnbstart[j]), int(srdata.alnbend[j]), chromo, chromo]
+            synData.append(line + [srdata.alntag[j]] if srdata.alntag[j] != "" else line)
 
     synData = pd.DataFrame(synData)
     if len(synData.columns) == 6:
@@ -919,28 +1662,14 @@ def outSyn(cwdPath, threshold, prefix):
         synData.columns = ["aStart","aEnd","bStart","bEnd","aChr","bChr","isinInv"]
     synData["class"] = "syn"
 
-    for i in ["invOut.txt", "TLOut.txt", "invTLOut.txt", "dupOut.txt", "invDupOut.txt","ctxOut.txt"]:
-        data = []
-        with open(cwdPath+prefix+i,"r") as fin:
-            if i != "ctxOut.txt":
-                for line in fin:
-                    line = line.strip().split("\t")
-                    if line[0] == "#":
-                        data.append(list(map(int,getValues(line,[2,3,6,7]))) + [line[1],line[5]])
-                data = pd.DataFrame(data, columns = ["aStart","aEnd","bStart","bEnd","aChr","bChr"], dtype=object)
-                data["class"] = i.split("Out.txt")[0]
-                if len(data)>0:
-                    # reCoords = reCoords.append(data)
-                    reCoords = pd.concat([reCoords, data])
-            else:
-                for line in fin:
-                    line = line.strip().split("\t")
-                    if line[0] == "#":
-                        data.append(list(map(int,getValues(line,[2,3,6,7]))) + [line[1],line[5],ctxAnnoDict[line[8]]])
-                data = pd.DataFrame(data, columns = ["aStart","aEnd","bStart","bEnd","aChr","bChr","class"], dtype=object)
-                if len(data)>0:
-                    # reCoords = reCoords.append(data)
-                    reCoords = pd.concat([reCoords, data])
+    for s in range(1, 7):
+        ids = np.flatnonzero(srdata.source == s)
+        data = [[int(srdata.astart[i]), int(srdata.aend[i]), int(srdata.bstart[i]), int(srdata.bend[i]), srdata.chrs[srdata.achr[i]], srdata.chrs[srdata.bchr[i]]] for i in ids]
+        data = pd.DataFrame(data, columns = ["aStart","aEnd","bStart","bEnd","aChr","bChr"], dtype=object)
+        data["class"] = [ctxAnnoDict[c] for c in srdata.cls[ids]] if s == 6 else SRCLASSES[s]
+        if len(data)>0:
+            # reCoords = reCoords.append(data)
+            reCoords = pd.concat([reCoords, data])
 
     # allBlocks = synData[["aStart","aEnd","bStart","bEnd","aChr","bChr","class"]].append(reCoords)
     allBlocks = pd.concat([synData[["aStart","aEnd","bStart","bEnd","aChr","bChr","class"]], reCoords])
@@ -1045,16 +1774,11 @@ def outSyn(cwdPath, threshold, prefix):
 
     hasSynInInv = "isinInv" in synData.columns
 
-    with open(cwdPath+prefix+"synOut.txt","w", encoding="utf-8") as fout:
-        for i in outClusters:
-            fout.write("\t".join(map(str,["#",allBlocks.at[i[0],"aChr"],allBlocks.at[i[0],"aStart"],allBlocks.at[i[-1],"aEnd"],"-",allBlocks.at[i[0],"aChr"],allBlocks.at[i[0],"bStart"],allBlocks.at[i[-1],"bEnd"]])) +"\n")
-            for j in i:
-                fout.write("\t".join(map(str,allBlocks.loc[j][0:4])))
-                if hasSynInInv and synData.loc[synLocs[j]]["isinInv"] == "Syn_in_Inv":
-                    fout.write("\tSyn_in_Inv\n")
-                else:
-                    fout.write("\n")
-    return None
+    synBlocks = []
+    for i in outClusters:
+        tags = ["Syn_in_Inv" if hasSynInInv and synData.loc[synLocs[j]]["isinInv"] == "Syn_in_Inv" else "" for j in i]
+        synBlocks.append(srBlock(0, allBlocks.at[i[0],"aChr"], allBlocks.at[i[0],"aStart"], allBlocks.at[i[-1],"aEnd"], allBlocks.at[i[0],"aChr"], allBlocks.at[i[0],"bStart"], allBlocks.at[i[-1],"bEnd"], allBlocks.loc[i].iloc[:, :4].values, tags=tags))
+    return synBlocks
 
         
 def groupSyn(tempInvBlocks, dupData, invDupData, invTLData, TLData, threshold, synData, badSyn):
@@ -1166,36 +1890,6 @@ def groupSyn(tempInvBlocks, dupData, invDupData, invTLData, TLData, threshold, s
     outClusters.append(currentCluster)
     return (allBlocks, outClusters)
 
-def mergeOutputFiles(uniChromo,path,prefix):
-    def addData(fName,anno, chromo):
-        fPath = open(path+prefix+chromo+"_"+anno+"Out.txt","r")
-        for line in fPath.readlines():
-            line = line.strip().split("\t")
-            if line[0] == "#":
-                fName.write("\t".join(unlist([line[0], chromo, line[1:4], chromo, line[4:]])) + "\n")
-            else:
-                fName.write("\t".join(line) + "\n")
-        fPath.close()
-        fileRemove(path+prefix+chromo+"_"+anno+"Out.txt")
-                
-    fSyn = open(path+prefix+"synOut.txt","w")
-    fInv = open(path+prefix+"invOut.txt","w")
-    fTL = open(path+prefix+"TLOut.txt","w")
-    fInvTL = open(path+prefix+"invTLOut.txt","w")
-    fDup = open(path+prefix+"dupOut.txt","w")
-    fInvDup = open(path+prefix+"invDupOut.txt","w")
-    
-    files = [fSyn, fInv, fTL, fInvTL, fDup, fInvDup]
-    classes = ["syn","inv","TL","invTL","dup","invDup"]
-    
-    for chromo in uniChromo:
-        for i in range(len(classes)):
-            addData(files[i], classes[i], chromo)
-            
-    for f in files:
-        f.close()
-
-
 class alignmentBlock:
     def __init__(self, id, children, data):
         self.id = id
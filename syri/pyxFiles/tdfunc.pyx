@@ -10,10 +10,12 @@ import time
 from syri.scripts.func import unlist, getValues, intersect
 from multiprocessing import Pool
 from functools import partial
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from gc import collect
 import sys
 
-from syri.pyxFiles.function cimport getOverlapWithSynBlocks, getmeblocks
+from syri.pyxFiles.function cimport getOverlapWithSynBlocks, getmeblocks, getCandidateEdges
 from libcpp.set cimport set as cpp_set
 from cython.operator cimport dereference as deref, preincrement as inc
 from libcpp.map cimport map as cpp_map
@@ -26,79 +28,105 @@ cimport numpy as np
 cimport cython
 
 
-class transBlock:
-    def __init__(self, i):
-        self.aStart = None
-        self.aEnd = None
-        self.bStart = None
-        self.bEnd = None
-        self.dir = None
-        self.transBlocksID = i
-        self.transClusterIndex = None
-        self.status = 0
-        self.overlappingInPlaceBlocks = []
-        self.aUni = False
-        self.bUni = False
-        self.transGroupIndices = None
-        self.genomeAUni = False
-        self.genomeBUni = False
-
-    def checkoverlaps(self, agroups, bgroups):
-        a = self.getoverlappingregions(agroups, "a")
-        b = self.getoverlappingregions(bgroups, "b")
-        self.genomeAUni = True if len(a) == 0 else False
-        self.genomeBUni = True if len(b) == 0 else False
-
-    def getoverlappingregions(self, groups, genome):
-        if genome=="a":
-            reg= groups[self.transGroupIndices[0]].member.copy()
-        elif genome =="b":
-            reg = groups[self.transGroupIndices[1]].member.copy()
-        reg.remove(self.transBlocksID)
-        return reg
-
-    def addOrderedData(self, orderedData):
-        self.orderedData = orderedData
-
-    def addMEBlock(self, blockID):
-        """List of Blocks which prohibit the entry of current block in the
-        optimal solution"""
-        self.meTo = np.array(blockID, dtype = "uint32")
-
-    def setMEList(self, meAlist, meBlist):
-        """Lists of a-overlap and b-overlap blocks. If at least 1 block has
-        been selected from both lists then this block would become redundant"""
-        self.meAlist = np.array(meAlist, dtype="uint32")
-        self.meBlist = np.array(meBlist, dtype="uint32")
-
-    def setStatus(self,stat):
-        """stat = 1 ==> transBlock is important/necessary/unique"""
-        self.status = stat
-
-
-class transGroups:
-    def __init__(self, leftEnd, rightEnd, index, threshold):
-        self.leftEnd = leftEnd
-        self.rightEnd = rightEnd
-        self.member = [index]
-        self.threshold = threshold
-
-    def checkOverlap(self, leftEnd, rightEnd):
-        if leftEnd < self.leftEnd:
-            print("Blocks must be sorted")
-            sys.exit()
-        elif rightEnd < self.rightEnd + self.threshold:
-            return True
-        elif (rightEnd - self.rightEnd) < 0.5*(self.rightEnd - leftEnd):
-            return True
-        elif (leftEnd - self.leftEnd) < 0.5*(self.rightEnd - leftEnd):
-            return True
-        return False
-
-    def addMember(self, leftEnd, rightEnd, index):
-        self.leftEnd = min(self.leftEnd, leftEnd)
-        self.rightEnd = max(self.rightEnd, rightEnd)
-        self.member.append(index)
+class transCandidates:
+    """Candidate TDs as columns. Row i is the candidate at position i of the
+    merged blocks DataFrame. aIndex/bIndex are the genome groups of the
+    candidates, aUni/bUni mark candidates not overlapping syntenic regions and
+    genomeAUni/genomeBUni mark candidates that are alone in their group.
+    status[i] == 1 for candidates which are important/necessary/unique."""
+    def __init__(self, blocks, dir, clusters, agroups, bgroups, auni, buni):
+        n = blocks.shape[0]
+        self.aStart = np.asarray(blocks.aStart, dtype=np.int64)
+        self.aEnd = np.asarray(blocks.aEnd, dtype=np.int64)
+        self.bStart = np.asarray(blocks.bStart, dtype=np.int64)
+        self.bEnd = np.asarray(blocks.bEnd, dtype=np.int64)
+        self.dir = np.asarray(dir, dtype=np.int64)
+        self.clusterIndex = memberIndex(clusters, n)
+        self.aIndex = np.asarray(agroups.group, dtype=np.int64)
+        self.bIndex = np.asarray(bgroups.group, dtype=np.int64)
+        self.aUni = np.asarray(auni, dtype=np.int64)
+        self.bUni = np.asarray(buni, dtype=np.int64)
+        self.genomeAUni = (agroups.sizes() == 1)[self.aIndex]
+        self.genomeBUni = (bgroups.sizes() == 1)[self.bIndex]
+        self.status = ((self.aUni.astype(bool) & self.genomeAUni) | (self.bUni.astype(bool) & self.genomeBUni)).astype(np.int64)
+
+    def __len__(self):
+        return len(self.aStart)
+
+    def meclass(self):
+        """0: redundant or seed, 1: overlaps syntenic region in genome A only, 2: in genome B only, 3: in neither"""
+        return np.select([(self.aUni == 0) & (self.bUni == 0), self.status == 1, self.aUni == 0, self.bUni == 0], [0, 0, 1, 2], 3).astype(np.uint16)
+
+    def getoverlappingregions(self, i, groups, genome):
+        reg = groups.members(self.aIndex[i] if genome == "a" else self.bIndex[i])
+        return [j for j in reg if j != i]
+
+    def take(self, ids):
+        """Candidates ids as a new table, keeping their genome group indices"""
+        sub = transCandidates.__new__(transCandidates)
+        for k, v in vars(self).items():
+            setattr(sub, k, v[ids])
+        return sub
+
+
+def memberIndex(groups, n):
+    """For each of n elements, the index of the group containing it"""
+    index = np.zeros(n, dtype=np.int64)
+    for i in range(len(groups)):
+        index[groups[i]] = i
+    return index
+
+
+class meBlocks:
+    """Mutually exclusive relations between candidate TDs as computed by
+    getmeblocks. kind[i] == 1: block i cannot be selected together with any
+    block in to(i). kind[i] == 2: block i becomes redundant if at least one
+    block from both alist(i) and blist(i) has been selected."""
+    def __init__(self, kind, meto, mea, meb):
+        self.kind = kind
+        self.toptr, self.toidx = meto
+        self.aptr, self.aidx = mea
+        self.bptr, self.bidx = meb
+
+    def to(self, i):
+        return self.toidx[self.toptr[i]:self.toptr[i+1]]
+
+    def alist(self, i):
+        return self.aidx[self.aptr[i]:self.aptr[i+1]]
+
+    def blist(self, i):
+        return self.bidx[self.bptr[i]:self.bptr[i+1]]
+
+    def take(self, ids):
+        """Relations of the blocks ids, renumbered to their positions in ids.
+        ids must be sorted and contain all blocks the relations point to."""
+        def csr(ptr, idx):
+            lens = ptr[ids+1] - ptr[ids]
+            sel = np.repeat(ptr[ids] - np.concatenate(([0], np.cumsum(lens)[:-1])), lens) + np.arange(lens.sum())
+            return np.concatenate(([0], np.cumsum(lens))), np.searchsorted(ids, idx[sel]).astype(idx.dtype)
+        return meBlocks(self.kind[ids], csr(self.toptr, self.toidx), csr(self.aptr, self.aidx), csr(self.bptr, self.bidx))
+
+
+class genomeGroups:
+    """Groups of overlapping candidate TDs in one genome, as computed by
+    getGenomeGroups. members(i) are the candidates in group i, sorted by
+    start and end. group[j] is the group of candidate j."""
+    def __init__(self, ptr, idx, group):
+        self.ptr = ptr
+        self.idx = idx
+        self.group = group
+
+    def __len__(self):
+        return len(self.ptr) - 1
+
+    def members(self, i):
+        return self.idx[self.ptr[i]:self.ptr[i+1]]
+
+    def sizes(self):
+        return np.diff(self.ptr)
+
+    def asdict(self):
+        return {i: self.members(i) for i in range(len(self))}
 
 
 @cython.boundscheck(False)
@@ -166,73 +194,100 @@ cdef inline getmeblocks2(unsigned long[:] ast, unsigned long[:] aen, unsigned lo
         return np.array([amem[index] for index in range(<Py_ssize_t>amem.size()) if meb_a[index]==1], np.uint), np.array([bmem[index] for index in range(<Py_ssize_t>bmem.size()) if meb_b[index] == 1], np.uint)
 
 
-cdef gtc(cpp_map[int, cpp_vec[int]] gind, cpp_map[int, cpp_vec[int]] agrp, cpp_map[int, cpp_vec[int]] bgrp):
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef getGenomeGroups(long[:] start, long[:] end, chrom, long threshold):
+    """
+    Groups candidates which overlap on one genome. Candidates are swept in
+    the order of (chrom, start, end). A candidate joins the current group
+    when it starts before the group ends and either ends within threshold
+    of the group end or overlaps the group by at least half of its
+    remaining length. chrom can be None when all candidates are on one
+    chromosome.
+    """
     cdef:
-        Py_ssize_t                  i, j, k, n = gind.size()
-        long[:]                     vtr = np.zeros(n, dtype='int')  #visited trans
-        long[:]                     vtra = np.zeros(agrp.size(), dtype='int') # visited agrp
-        long[:]                     vtrb = np.zeros(bgrp.size(), dtype='int') # visited bgrp
-        cpp_que[long]               nque        # nodes to check
-        cpp_deq[long]               cgrp        # current group
-        cpp_map[int, cpp_vec[int]].iterator gindit
-    out = deque()
+        Py_ssize_t          i, n = len(start), ng = 0
+        long                s, e, left = 0, right = 0, c, lastc = 0
+        long[:]             idx, ptr, group, ch
+    if chrom is None:
+        order = np.lexsort((np.asarray(end), np.asarray(start)))
+        ch = np.zeros(n, dtype=np.int64)
+    else:
+        ch = np.unique(chrom, return_inverse=True)[1].astype(np.int64)
+        order = np.lexsort((np.asarray(end), np.asarray(start), np.asarray(ch)))
+    idx = order.astype(np.int64)
+    ptr = np.zeros(n+1, dtype=np.int64)
+    group = np.zeros(n, dtype=np.int64)
+    for i in range(n):
+        s = start[idx[i]]
+        e = end[idx[i]]
+        c = ch[idx[i]]
+        if i == 0 or c != lastc or s > right or not (e < right + threshold or (e - right) < 0.5*(right - s) or (s - left) < 0.5*(right - s)):
+            ptr[ng] = i
+            ng += 1
+            left = s
+            right = e
+            lastc = c
+        else:
+            left = min(left, s)
+            right = max(right, e)
+        group[idx[i]] = ng - 1
+    ptr[ng] = n
+    return genomeGroups(np.asarray(ptr[:ng+1]), np.asarray(idx), np.asarray(group))
 
-    gindit = gind.begin()
-    while gindit != gind.end():
-        if vtr[deref(gindit).first] == 0:
-            vtr[deref(gindit).first] = 1
-            cgrp.push_back(deref(gindit).first)
-            vtra[deref(gindit).second[0]] = 1
-            vtrb[deref(gindit).second[1]] = 1
-            # Append elements to the queue
-            for i in agrp[deref(gindit).second[0]]:
-                nque.push(i)
-            for i in bgrp[deref(gindit).second[1]]:
-                nque.push(i)
-
-            while not nque.empty():
-                i = nque.front()
-                nque.pop()
-                if vtr[i] == 0:
-                    vtr[i] = 1
-                    cgrp.push_back(i)
-                    if vtra[gind[i][0]] == 0:
-                        vtra[gind[i][0]] = 1
-                        for j in agrp[gind[i][0]]:
-                            nque.push(j)
-                    if vtrb[gind[i][1]] == 0:
-                        vtrb[gind[i][1]] = 1
-                        for j in bgrp[gind[i][1]]:
-                            nque.push(j)
-            out.append(sorted([cgrp[i] for i in range(<Py_ssize_t> cgrp.size())]))
-            cgrp.clear()
-        inc(gindit)
-    return out
 
-def getTransCluster(gind, agrp, bgrp):
-    return gtc(gind, agrp, bgrp)
-
-
-def makeTransGroupList(transBlocksData, startC, endC, threshold):
-    transBlocksTable = transBlocksData.sort_values([startC,endC])
-    indices = transBlocksTable.index.values
-    if len(transBlocksData) > 0:
-        genomeGroups = [transGroups(transBlocksTable.at[indices[0],startC],\
-                                    transBlocksTable.at[indices[0],endC], indices[0], threshold)]
-        for i in indices[1:]:
-            if transBlocksTable.at[i, startC] > genomeGroups[-1].rightEnd:
-                genomeGroups.append(transGroups(transBlocksTable.at[i,startC],\
-                                                transBlocksTable.at[i,endC], i, threshold))
-            elif genomeGroups[-1].checkOverlap(transBlocksTable.at[i,startC],\
-                             transBlocksTable.at[i,endC]):
-                genomeGroups[-1].addMember(transBlocksTable.at[i,startC],\
-                            transBlocksTable.at[i,endC], i)
-            else:
-                genomeGroups.append(transGroups(transBlocksTable.at[i,startC],\
-                                                transBlocksTable.at[i,endC], i, threshold))
-        return genomeGroups
-    else:
-        return []
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef inline long ufind(long[:] parent, long x):
+    while parent[x] != x:
+        parent[x] = parent[parent[x]]
+        x = parent[x]
+    return x
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cpdef getTransClusters(long[:] agroup, long[:] bgroup):
+    """
+    Connected components of candidates linked by sharing a group in either
+    genome, found with union-find. Returns the clusters as CSR arrays
+    (ptr, idx). Clusters are ordered by their smallest candidate and
+    members are sorted.
+    """
+    cdef:
+        Py_ssize_t          i, n = len(agroup), nc = 0
+        long                r, x
+        long[:]             parent = np.arange(n, dtype=np.int64)
+        long[:]             afirst = np.full(max(np.max(agroup)+1 if n > 0 else 0, 1), -1, dtype=np.int64)
+        long[:]             bfirst = np.full(max(np.max(bgroup)+1 if n > 0 else 0, 1), -1, dtype=np.int64)
+        long[:]             label = np.full(n, -1, dtype=np.int64)
+        long[:]             cid = np.zeros(n, dtype=np.int64)
+
+    for i in range(n):
+        # Candidate i is joined with the first candidate of each of its groups
+        for x in (afirst[agroup[i]], bfirst[bgroup[i]]):
+            if x >= 0:
+                r = ufind(parent, x)
+                if r != ufind(parent, i):
+                    parent[ufind(parent, i)] = r
+        if afirst[agroup[i]] < 0:
+            afirst[agroup[i]] = i
+        if bfirst[bgroup[i]] < 0:
+            bfirst[bgroup[i]] = i
+    for i in range(n):
+        r = ufind(parent, i)
+        if label[r] < 0:
+            label[r] = nc
+            nc += 1
+        cid[i] = label[r]
+    idx = np.argsort(np.asarray(cid), kind='stable')
+    ptr = np.concatenate(([0], np.cumsum(np.bincount(np.asarray(cid), minlength=nc))))
+    return ptr, idx
+
+
+def clusterList(ptr, idx):
+    """CSR clusters as lists of candidates"""
+    return [idx[ptr[i]:ptr[i+1]].tolist() for i in range(len(ptr)-1)]
 
 
 def count_uniq_elems(coordinates):
@@ -343,89 +398,439 @@ def mergeTransBlocks(transBlocks, orderedBlocks, invTransBlocks, invertedBlocks,
         return transBlocksData, orderedIndex
 
 
-def bruteSubsetSelector(cluster, transBlocksData, seedBlocks, bRT):
+cdef extern from *:
+    int __builtin_ctzll(unsigned long long) nogil
+    int __builtin_clzll(unsigned long long) nogil
+    int __builtin_popcountll(unsigned long long) nogil
+
+ctypedef unsigned long long u64
+
+# Set of up to 128 cluster positions
+cdef struct bset:
+    u64 lo
+    u64 hi
+
+cdef inline bset bsbit(int k) noexcept nogil:
+    cdef bset r
+    r.lo = ((<u64> 1) << k) if k < 64 else 0
+    r.hi = ((<u64> 1) << (k - 64)) if k >= 64 else 0
+    return r
+
+cdef inline bset bsor(bset a, bset b) noexcept nogil:
+    a.lo |= b.lo
+    a.hi |= b.hi
+    return a
+
+cdef inline bset bsand(bset a, bset b) noexcept nogil:
+    a.lo &= b.lo
+    a.hi &= b.hi
+    return a
+
+cdef inline bset bsandnot(bset a, bset b) noexcept nogil:
+    a.lo &= ~b.lo
+    a.hi &= ~b.hi
+    return a
+
+cdef inline bint bsany(bset a) noexcept nogil:
+    return a.lo != 0 or a.hi != 0
+
+cdef inline bint bstest(bset a, int k) noexcept nogil:
+    return ((a.lo >> k) & 1) if k < 64 else ((a.hi >> (k - 64)) & 1)
+
+cdef inline int bsfirst(bset a) noexcept nogil:
+    if a.lo:
+        return __builtin_ctzll(a.lo)
+    if a.hi:
+        return 64 + __builtin_ctzll(a.hi)
+    return -1
+
+cdef inline int bscount(bset a) noexcept nogil:
+    return __builtin_popcountll(a.lo) + __builtin_popcountll(a.hi)
+
+cdef inline int bsprev(bset a, int k) noexcept nogil:
+    # Highest set bit below k
+    cdef u64 lo = a.lo, hi = 0
+    if k < 64:
+        lo &= ((<u64> 1) << k) - 1
+    else:
+        hi = a.hi & (((<u64> 1) << (k - 64)) - 1)
+    if hi:
+        return 127 - __builtin_clzll(hi)
+    if lo:
+        return 63 - __builtin_clzll(lo)
+    return -1
+
+cdef inline int bsnext(bset a, int k) noexcept nogil:
+    # Lowest set bit above k
+    cdef u64 lo = 0, hi = a.hi
+    if k < 63:
+        lo = a.lo & ~(((<u64> 1) << (k + 1)) - 1)
+    elif k < 127:
+        hi &= ~(((<u64> 1) << (k - 63)) - 1)
+    else:
+        hi = 0
+    if lo:
+        return __builtin_ctzll(lo)
+    if hi:
+        return 64 + __builtin_ctzll(hi)
+    return -1
+
+
+cdef bset tobset(idx, dict pos):
+    cdef bset r
+    r.lo = 0
+    r.hi = 0
+    for c in idx:
+        if c in pos:
+            r = bsor(r, bsbit(pos[c]))
+    return r
+
+
+# Largest cluster for which bruteSubsetSelector is used
+MAXBRUTE = 64
+# Number of search nodes for which combinations are tested in the order of the original brute force enumeration
+BRUTENODES = 200000
+# Number of search nodes for the second search, which selects large blocks first
+SEARCHNODES = 1000000
+
+
+cdef class clusterSearch:
+    """
+    Exact search for the best subset of a TD cluster. Cluster members are
+    bit positions; mutually exclusive sets are bitsets. A combination is
+    valid when each block passes the meData checks against the blocks before
+    it in the cluster. Score is updated incrementally as in count_uniq_elems.
+    """
+    cdef:
+        int                     n
+        object                  cluster, transBlocksData
+        bset                    seeds
+        cpp_vec[bset]           to, al, bl, crossa, crossb
+        cpp_vec[unsigned char]  kind
+        cpp_vec[long]           st, en, ln                      # st, en: genome*n + pos
+        cpp_vec[int]            order, rank                     # order: genome*n + rank
+        cpp_vec[bset]           tie
+        int                     nuni[2]
+        bset                    incl[2]                         # included ranks
+        cpp_vec[long]           dagscore, dagend
+        cpp_vec[int]            seq
+        cpp_vec[bset]           undecided
+        cpp_vec[long]           undecidedlen
+        int                     nties
+        bint                    inclfirst, exactties, hasbest, failed
+        long                    nodes, maxnodes
+        double                  start, maxtime
+        long                    bestscore
+        int                     bestcnt
+        bset                    bestcomb
+
+    def __init__(self, cluster, transBlocksData, seedBlocks, meData):
+        cdef:
+            int                 i, j, g, x
+            unsigned char[::1]  mekind = meData.kind
+        self.n = len(cluster)
+        self.cluster = cluster
+        self.transBlocksData = transBlocksData
+        pos = {c: i for i, c in enumerate(cluster)}
+        self.seeds = tobset(seedBlocks, pos)
+        for i in range(self.n):
+            self.kind.push_back(mekind[cluster[i]])
+            self.to.push_back(tobset(meData.to(cluster[i]), pos))
+            self.al.push_back(tobset(meData.alist(cluster[i]), pos))
+            self.bl.push_back(tobset(meData.blist(cluster[i]), pos))
+        # crossa[x]/crossb[x]: blocks k with kind 2 having x in alist(k)/blist(k)
+        self.crossa.resize(self.n)
+        self.crossb.resize(self.n)
+        for i in range(self.n):
+            if self.kind[i] != 2:
+                continue
+            for x in range(self.n):
+                if bstest(self.al[i], x):
+                    self.crossa[x] = bsor(self.crossa[x], bsbit(i))
+                if bstest(self.bl[i], x):
+                    self.crossb[x] = bsor(self.crossb[x], bsbit(i))
+
+        # Unique regions of the blocks, ranked in the order count_uniq_elems sorts them for getScore
+        self.ln.resize(self.n)
+        self.rank.resize(2*self.n, -1)
+        self.order.resize(2*self.n)
+        self.tie.resize(2*self.n)
+        self.dagscore.resize(self.n)
+        self.dagend.resize(self.n)
+        cl = np.asarray(cluster, dtype=np.int64)
+        seedset = set(seedBlocks)
+        notseed = [c not in seedset for c in cluster]
+        for g in range(2):
+            self.incl[g].lo = 0
+            self.incl[g].hi = 0
+            starts = (transBlocksData.aStart if g == 0 else transBlocksData.bStart)[cl].tolist()
+            ends = (transBlocksData.aEnd if g == 0 else transBlocksData.bEnd)[cl].tolist()
+            for i in range(self.n):
+                self.st.push_back(starts[i])
+                self.en.push_back(ends[i])
+            uni = np.nonzero((transBlocksData.aUni if g == 0 else transBlocksData.bUni)[cl])[0].tolist()
+            uni.sort(key=lambda i: (starts[i], notseed[i], i))
+            self.nuni[g] = len(uni)
+            for j in range(len(uni)):
+                self.order[g*self.n + j] = uni[j]
+                self.rank[g*self.n + uni[j]] = j
+                self.ln[uni[j]] += ends[uni[j]] - starts[uni[j]]
+                # Blocks with equal start can be sorted in any order by count_uniq_elems
+                for x in uni:
+                    if x != uni[j] and starts[x] == starts[uni[j]]:
+                        self.tie[g*self.n + uni[j]] = bsor(self.tie[g*self.n + uni[j]], bsbit(x))
+
+    def solve(self, long brutenodes, long searchnodes, double maxtime):
+        """
+        First tests combinations in the order of the original brute force
+        enumeration. If that needs more than brutenodes steps, the search is
+        repeated selecting large blocks first, which prunes much better. This
+        second search orders blocks with equal start as a stable sort would,
+        instead of scoring such combinations with getScore.
+        Returns False if the second search needs more than searchnodes steps
+        or maxtime seconds. result() then has the best combination found by
+        the second search until it was stopped.
+        """
+        self.setorder(list(range(self.n)), False)
+        self.exactties = True
+        self.run(brutenodes, 0)
+        if not self.failed:
+            return True
+        # Second search, capped at searchnodes steps. Blocks with equal start
+        # are scored in their stable sort order (start, seeds first, cluster
+        # position), not with getScore, so among combinations with tied
+        # blocks it can keep a different one than the enumeration would.
+        # When the cap is hit, the best combination found until then is kept.
+        self.setorder(sorted(range(self.n), key=lambda i: (-self.ln[i], i)), True)
+        self.exactties = False
+        self.run(searchnodes, maxtime)
+        return not self.failed
+
+    def found(self):
+        return self.hasbest
+
+    def result(self):
+        return self.bestscore, self.getcomb(self.bestcomb)
+
+    cdef setorder(self, seq, bint inclfirst):
+        cdef int k
+        cdef bset und
+        und.lo = 0
+        und.hi = 0
+        self.seq = seq
+        self.inclfirst = inclfirst
+        self.undecided.clear()
+        self.undecidedlen.clear()
+        self.undecided.push_back(und)
+        self.undecidedlen.push_back(0)
+        for k in range(self.n):
+            if not bstest(self.seeds, self.seq[k]):
+                und = bsor(und, bsbit(self.seq[k]))
+                self.undecidedlen.push_back(self.undecidedlen.back() + self.ln[self.seq[k]])
+            else:
+                self.undecidedlen.push_back(self.undecidedlen.back())
+            self.undecided.push_back(und)
+
+    cdef run(self, long maxnodes, double maxtime):
+        cdef:
+            int     x, cnt = 0
+            long    score = 0, lsum = 0
+            bset    Q
+        Q.lo = 0
+        Q.hi = 0
+        self.nties = 0
+        self.hasbest = False
+        self.failed = False
+        self.nodes = 0
+        self.maxnodes = maxnodes
+        self.maxtime = maxtime
+        self.start = time.time()
+        for g in range(2):
+            self.incl[g].lo = 0
+            self.incl[g].hi = 0
+        for x in range(self.n):
+            if bstest(self.seeds, x):
+                score += self.insert(x, Q)
+                Q = bsor(Q, bsbit(x))
+                lsum += self.ln[x]
+                cnt += 1
+        self.search(self.n, Q, score, lsum, cnt)
+
+    cdef getcomb(self, bset Q):
+        # Seeds first, as in bruteSubsetSelector
+        return [self.cluster[x] for x in range(self.n) if bstest(self.seeds, x)] + [self.cluster[x] for x in range(self.n) if bstest(Q, x) and not bstest(self.seeds, x)]
+
+    cdef bint feasible(self, bset Q) noexcept:
+        # Add blocks in cluster order and check them against the already added blocks
+        cdef:
+            bset    P = self.seeds, skip = self.seeds, rest = bsandnot(Q, self.seeds), m
+            int     x, k
+        x = bsfirst(rest)
+        while x != -1:
+            rest = bsandnot(rest, bsbit(x))
+            if bstest(skip, x):
+                return False
+            if self.kind[x] == 1 and bsany(bsand(self.to[x], P)):
+                return False
+            if self.kind[x] == 2 and bsany(bsand(self.al[x], P)) and bsany(bsand(self.bl[x], P)):
+                return False
+            m = bsand(self.crossa[x], P)
+            k = bsfirst(m)
+            while k != -1:
+                skip = bsor(skip, self.bl[k])
+                m = bsandnot(m, bsbit(k))
+                k = bsfirst(m)
+            m = bsand(self.crossb[x], P)
+            k = bsfirst(m)
+            while k != -1:
+                skip = bsor(skip, self.al[k])
+                m = bsandnot(m, bsbit(k))
+                k = bsfirst(m)
+            if self.kind[x] == 1 and bsany(P):
+                skip = bsor(skip, self.to[x])
+            elif self.kind[x] == 2:
+                if bsany(bsand(self.al[x], P)):
+                    skip = bsor(skip, self.bl[x])
+                if bsany(bsand(bsandnot(self.bl[x], self.al[x]), P)):
+                    skip = bsor(skip, self.al[x])
+                skip = bsor(skip, bsand(self.al[x], self.bl[x]))
+            P = bsor(P, bsbit(x))
+            x = bsfirst(rest)
+        return True
+
+    cdef inline long term(self, int g, int x, int y) noexcept:
+        # Contribution of the consecutive pair (x, y) in count_uniq_elems
+        cdef long d = self.st[g*self.n + y] - self.en[g*self.n + x], o = self.en[g*self.n + x] - self.en[g*self.n + y]
+        return (d if d < 0 else 0) + (o if o > 0 else 0)
+
+    cdef long insert(self, int x, bset Q) noexcept:
+        # Score change on adding block x to the combination Q
+        cdef:
+            int     g, r, p, q
+            long    d = 0
+        for g in range(2):
+            r = self.rank[g*self.n + x]
+            if r == -1:
+                continue
+            p = bsprev(self.incl[g], r)
+            q = bsnext(self.incl[g], r)
+            d += self.en[g*self.n + x] - self.st[g*self.n + x]
+            if p != -1:
+                d += self.term(g, self.order[g*self.n + p], x)
+            if q != -1:
+                d += self.term(g, x, self.order[g*self.n + q])
+            if p != -1 and q != -1:
+                d -= self.term(g, self.order[g*self.n + p], self.order[g*self.n + q])
+            self.incl[g] = bsor(self.incl[g], bsbit(r))
+            self.nties += bscount(bsand(self.tie[g*self.n + x], Q))
+        return d
+
+    cdef void remove(self, int x, bset Q) noexcept:
+        cdef int g
+        for g in range(2):
+            if self.rank[g*self.n + x] != -1:
+                self.incl[g] = bsandnot(self.incl[g], bsbit(self.rank[g*self.n + x]))
+                self.nties -= bscount(bsand(self.tie[g*self.n + x], Q))
+
+    cdef long bound(self, bset und, bset Q) noexcept:
+        # Highest score for Q extended by blocks from und. Score is the sum
+        # of the bases of each block not covered by the block before it, so
+        # the best extension is a longest path over the sorted blocks.
+        cdef:
+            int     g, r, x, p, m, lastf
+            long    total = 0, v, c, e, s, mx
+            bint    forced
+        for g in range(2):
+            m = 0
+            lastf = -1
+            for r in range(self.nuni[g]):
+                x = self.order[g*self.n + r]
+                forced = bstest(Q, x)
+                if not forced and not bstest(und, x):
+                    continue
+                s = self.st[g*self.n + x]
+                e = self.en[g*self.n + x]
+                v = -1
+                if lastf == -1:
+                    v = e - s
+                for p in range(lastf if lastf != -1 else 0, m):
+                    if not (self.exactties and bsany(self.tie[g*self.n + x])):
+                        c = self.dagscore[p] + max(0, e - max(s, self.dagend[p]))
+                    else:
+                        c = self.dagscore[p] + e - s
+                    if c > v:
+                        v = c
+                self.dagscore[m] = v
+                # Blocks with equal start can precede each other in any order
+                self.dagend[m] = s if self.exactties and bsany(self.tie[g*self.n + x]) else e
+                m += 1
+                if forced:
+                    lastf = m - 1
+            mx = 0
+            for p in range(lastf if lastf != -1 else 0, m):
+                if self.dagscore[p] > mx:
+                    mx = self.dagscore[p]
+            total += mx
+        return total
+
+    cdef leaf(self, bset Q, long score, int cnt):
+        if cnt == 0:
+            return
+        if self.exactties and self.nties > 0:
+            score = getScore(self.getcomb(Q), self.transBlocksData)
+        # Same selection rule as updateBestComb
+        if not self.hasbest or (score - self.bestscore > 1000) or (score > self.bestscore and cnt <= self.bestcnt) or (self.bestscore - score < 1000 and cnt < self.bestcnt):
+            self.hasbest = True
+            self.bestscore = score
+            self.bestcnt = cnt
+            self.bestcomb = Q
+
+    cdef int search(self, int k, bset Q, long score, long lsum, int cnt) except -1:
+        # Blocks seq[k:] are decided, Q has the selected blocks
+        cdef:
+            int     x
+            long    d
+            bset    Q2
+        self.nodes += 1
+        if self.maxnodes >= 0 and self.nodes > self.maxnodes:
+            self.failed = True
+        elif self.maxtime > 0 and (self.nodes & 1023) == 0 and time.time() - self.start > self.maxtime:
+            self.failed = True
+        if self.failed:
+            return 0
+        # No combination in this branch can replace the current best one
+        if self.hasbest and lsum + self.undecidedlen[k] <= self.bestscore - 1000:
+            return 0
+        if self.hasbest and self.bound(self.undecided[k], Q) <= self.bestscore - 1000:
+            return 0
+        if k == 0:
+            self.leaf(Q, score, cnt)
+            return 0
+        x = self.seq[k-1]
+        if not self.inclfirst:
+            self.search(k-1, Q, score, lsum, cnt)
+        if not bstest(self.seeds, x):
+            Q2 = bsor(Q, bsbit(x))
+            if self.feasible(Q2):
+                d = self.insert(x, Q)
+                self.search(k-1, Q2, score + d, lsum + self.ln[x], cnt + 1)
+                self.remove(x, Q)
+        if self.inclfirst:
+            self.search(k-1, Q, score, lsum, cnt)
+        return 0
+
+
+def bruteSubsetSelector(cluster, transBlocksData, seedBlocks, bRT, meData, nc=1):
     logger = logging.getLogger('Brute-force TD identification')
-    posComb = [seedBlocks]
-    skipList = [seedBlocks]
-    for i in cluster:
-        startTime = time.time()
-        if hasattr(transBlocksData[i], "meTo"):
-            newPosComb = []
-            newSkipList = []
-            for j in range(len(posComb)):
-                if not any(a in posComb[j] for a in transBlocksData[i].meTo) and i not in skipList[j]:
-                    newPosComb.append(posComb[j] + [i])
-                    skipIndices = []
-                    for k in posComb[j]:
-                        if hasattr(transBlocksData[k],"meAlist"):
-                            if i in transBlocksData[k].meAlist:
-                                skipIndices.extend(transBlocksData[k].meBlist)
-                            if i in transBlocksData[k].meBlist:
-                                skipIndices.extend(transBlocksData[k].meAlist)
-                        skipIndices.extend(transBlocksData[i].meTo)
-                    newSkipList.append(skipList[j] + skipIndices)
-            posComb.extend(newPosComb)
-            skipList.extend(newSkipList)
-        elif hasattr(transBlocksData[i], "meAlist"):
-            newPosComb = []
-            newSkipList = []
-            for j in range(len(posComb)):
-                check1 = not any(a in posComb[j] for a in transBlocksData[i].meAlist)
-                check2 = not any(a in posComb[j] for a in transBlocksData[i].meBlist)
-                if ( check1 or check2) and i not in skipList[j]:
-                    newPosComb.append(posComb[j] + [i])
-                    skipIndices = []
-                    for k in posComb[j]:
-                        if hasattr(transBlocksData[k],"meAlist"):
-                            if i in transBlocksData[k].meAlist:
-                                skipIndices.extend(transBlocksData[k].meBlist)
-                            if i in transBlocksData[k].meBlist:
-                                skipIndices.extend(transBlocksData[k].meAlist)
-                        if k in transBlocksData[i].meAlist:
-                            skipIndices.extend(transBlocksData[i].meBlist)
-                        elif k in transBlocksData[i].meBlist:
-                            skipIndices.extend(transBlocksData[i].meAlist)
-                    for meElement in transBlocksData[i].meAlist:
-                        if meElement in transBlocksData[i].meBlist:
-                            skipIndices.append(meElement)
-                    newSkipList.append(skipList[j] + skipIndices)
-            posComb.extend(newPosComb)
-            skipList.extend(newSkipList)
-        else:
-            newPosComb = []
-            newSkipList = []
-            for j in range(len(posComb)):
-                if i not in skipList[j]:
-                    newPosComb.append(posComb[j]+[i])
-                    skipIndices = []
-                    for k in posComb[j]:
-                        if hasattr(transBlocksData[k],"meAlist"):
-                            if i in transBlocksData[k].meAlist:
-                                skipIndices.extend(transBlocksData[k].meBlist)
-                            if i in transBlocksData[k].meBlist:
-                                skipIndices.extend(transBlocksData[k].meAlist)
-                    newSkipList.append(skipList[j]+skipIndices)
-            posComb.extend(newPosComb)
-            skipList.extend(newSkipList)
-        timeTaken = time.time() - startTime
-        remainingIterations = len(cluster) - cluster.index(i)
-
-        if (timeTaken*(1.5**remainingIterations) > bRT):
-            logger.info("Cluster is too big for Brute Force, using randomized-greedy approach\nTime taken for last iteration " +
-                  str(timeTaken) + ". iterations remaining " + str(remainingIterations))
-            return "Failed"
-
-
-    if [] in posComb:
-        posComb.remove([])
-    ## Find the best set of alignments from a cluster applicable only in case where the number
-    ## of all possible combinations is small
-    bestScore = getScore(posComb[0], transBlocksData)
-    bestComb = posComb[0]
-    for i in range(1, len(posComb)):
-        outBlocks = posComb[i]
-        bestScore, bestComb = updateBestComb(bestScore, bestComb, outBlocks, transBlocksData)
-    return( bestScore, bestComb)
+    solver = clusterSearch(cluster, transBlocksData, seedBlocks, meData)
+    if solver.solve(BRUTENODES, SEARCHNODES, bRT):
+        return solver.result()
+    logger.info("Cluster is too big for Brute Force, using randomized-greedy approach. Cluster size: " + str(len(cluster)))
+    bestScore, bestComb = greedySubsetSelector(cluster, transBlocksData, seedBlocks, meData, 100, nc)
+    # The best combination of the stopped search is kept unless the greedy selection is better
+    if solver.found():
+        bestScore, bestComb = updateBestComb(bestScore, bestComb, solver.result()[1], transBlocksData)
+    return bestScore, bestComb
 
 
 def updateBestComb(bestScore, bestComb, outBlocks, transBlocksData):
@@ -437,38 +842,21 @@ def updateBestComb(bestScore, bestComb, outBlocks, transBlocksData):
 
 
 def getScore(outBlocks, transBlocksData):
-    aIndices = np.array([[transBlocksData[j].aStart, transBlocksData[j].aEnd] for j in outBlocks if transBlocksData[j].aUni])
-    bIndices = np.array([[transBlocksData[j].bStart, transBlocksData[j].bEnd] for j in outBlocks if transBlocksData[j].bUni])
+    outBlocks = np.asarray(outBlocks, dtype=np.int64)
+    a = outBlocks[transBlocksData.aUni[outBlocks] != 0]
+    b = outBlocks[transBlocksData.bUni[outBlocks] != 0]
+    aIndices = np.column_stack((transBlocksData.aStart[a], transBlocksData.aEnd[a]))
+    bIndices = np.column_stack((transBlocksData.bStart[b], transBlocksData.bEnd[b]))
     aScore = count_uniq_elems(aIndices) if len(aIndices) > 0 else 0
     bScore = count_uniq_elems(bIndices) if len(bIndices) > 0 else 0
     return(aScore + bScore)
 
 
 
-def readAnnoCoords(cwdPath, uniChromo, prefix):
-    annoCoords = pd.DataFrame(columns=["aStart","aEnd","bStart","bEnd","aChr","bChr"])
-    synData = []
-    fin = open(cwdPath+prefix+"synOut.txt","r")
-    for line in fin:
-        line = line.strip().split("\t")
-        if line[0] == "#":
-            chromo = line[1]
-            continue
-        synData.append(list(map(int,line[:4]))+[chromo,chromo])
-    fin.close()
-    synData = pd.DataFrame(synData,columns = ["aStart","aEnd","bStart","bEnd","aChr","bChr"])
-    annoCoords = pd.concat([annoCoords, synData])
-
-    for i in ["invOut.txt", "TLOut.txt", "invTLOut.txt", "dupOut.txt", "invDupOut.txt"]:
-        data = []
-        fin = open(cwdPath+prefix+i,"r")
-        for line in fin:
-            line = line.strip().split("\t")
-            if line[0] == "#":
-                data.append(list(map(int,getValues(line,[2,3,6,7]))) + [line[1],line[5]])
-        fin.close()
-        data = pd.DataFrame(data, columns = ["aStart","aEnd","bStart","bEnd","aChr","bChr"], dtype=object)
-        annoCoords = pd.concat([annoCoords, data])
+def readAnnoCoords(srdata):
+    """Syntenic alignments and the intra-chromosomal SRs in srdata"""
+    synData = srdata.members(np.flatnonzero(srdata.source == 0))[["aStart","aEnd","bStart","bEnd","aChr","bChr"]]
+    annoCoords = pd.concat([synData, srdata.blocks(range(1, 6))])
 
     annoCoords[["aStart","aEnd","bStart","bEnd"]] = annoCoords[["aStart","aEnd","bStart","bEnd"]].astype("int64")
     annoCoords.sort_values(by = ["bChr","bStart","bEnd","aChr","aStart","aEnd"],inplace = True)
@@ -479,7 +867,31 @@ def readAnnoCoords(cwdPath, uniChromo, prefix):
     return(annoCoords)
 
 
-def getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores, tdgl, tdolp):
+def getCTXData(coords):
+    """Inter-chromosomal alignments, with inverted alignments flipped to the forward strand, ordered by their reference coordinates"""
+    ctxData = coords.loc[coords['aChr'] != coords['bChr']].copy()
+    ctxData.index = range(len(ctxData))
+    invCTXIndex = ctxData.index[ctxData.bDir == -1]
+    ctxData.loc[invCTXIndex,"bStart"] = ctxData.loc[invCTXIndex].bStart + ctxData.loc[invCTXIndex].bEnd
+    ctxData.loc[invCTXIndex, "bEnd"] = ctxData.loc[invCTXIndex].bStart - ctxData.loc[invCTXIndex].bEnd
+    ctxData.loc[invCTXIndex, "bStart"] = ctxData.loc[invCTXIndex].bStart - ctxData.loc[invCTXIndex].bEnd
+    ctxData.sort_values(by= ["aChr","aStart","aEnd","bChr","bStart","bEnd"], inplace = True)
+    ctxData["aIndex"] = range(ctxData.shape[0])
+    ctxData.sort_values(by= ["bChr","bStart","bEnd","aChr","aStart","aEnd"], inplace = True)
+    ctxData["bIndex"] = range(ctxData.shape[0])
+    ctxData.sort_values("aIndex", inplace = True)
+    return ctxData
+
+
+def getCTX(ctxData, srdata, threshold, bRT, tUC, tUP, nCores, tdgl, tdolp, trees=None, shard=True):
+    """
+    ctxData is the output of getCTXData and srdata has the intra-chromosomal
+    SRs. trees can have the getCTXTree output for its ordered and inverted
+    blocks, when they have been computed already. With shard=False, the
+    candidates of each direction are found in one process. Returns the CTX
+    blocks as srBlock.
+    """
+    from syri.srdata import srBlock, CTXCLASSES
     logger = logging.getLogger("getCTX")
     logger.info("Identifying cross-chromosomal translocation and duplication for chromosome" + str(datetime.now()))
 
@@ -490,17 +902,16 @@ def getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores,
                 dupGenomes[index] = ""
                 continue
             found = False
-            tempTransBlock = allTransBlocksData[index]
-            if not tempTransBlock.aUni:
+            if not allTransBlocksData.aUni[index]:
                 dupGenomes[index] = "B"
                 continue
-            elif not tempTransBlock.bUni:
+            elif not allTransBlocksData.bUni[index]:
                 dupGenomes[index] = "A"
                 continue
-            elif tempTransBlock.genomeAUni:
+            elif allTransBlocksData.genomeAUni[index]:
                 dupGenomes[index] = "A"
                 continue
-            elif tempTransBlock.genomeBUni:
+            elif allTransBlocksData.genomeBUni[index]:
                 dupGenomes[index] = "B"
                 continue
             if meclass[index] != 3:
@@ -518,18 +929,7 @@ def getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores,
 
     logger.debug("Reading Coords" + str(datetime.now()))
 
-    annoCoords = readAnnoCoords(cwdPath, uniChromo, prefix)
-    ctxData = coords.loc[coords['aChr'] != coords['bChr']].copy()
-    ctxData.index = range(len(ctxData))
-    invCTXIndex = ctxData.index[ctxData.bDir == -1]
-    ctxData.loc[invCTXIndex,"bStart"] = ctxData.loc[invCTXIndex].bStart + ctxData.loc[invCTXIndex].bEnd
-    ctxData.loc[invCTXIndex, "bEnd"] = ctxData.loc[invCTXIndex].bStart - ctxData.loc[invCTXIndex].bEnd
-    ctxData.loc[invCTXIndex, "bStart"] = ctxData.loc[invCTXIndex].bStart - ctxData.loc[invCTXIndex].bEnd
-    ctxData.sort_values(by= ["aChr","aStart","aEnd","bChr","bStart","bEnd"], inplace = True)
-    ctxData["aIndex"] = range(ctxData.shape[0])
-    ctxData.sort_values(by= ["bChr","bStart","bEnd","aChr","aStart","aEnd"], inplace = True)
-    ctxData["bIndex"] = range(ctxData.shape[0])
-    ctxData.sort_values("aIndex", inplace = True)
+    annoCoords = readAnnoCoords(srdata)
 
     logger.debug("CTX identification: ctxdata size" + str(ctxData.shape))
 
@@ -540,46 +940,44 @@ def getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores,
 
     logger.debug("Making Tree")
 
-    nCorestemp = nCores if nCores < 2 else 2
-
-    with Pool(processes = nCorestemp) as pool:
-        blks = pool.starmap(partial(getBlocks, annoCoords=annoCoords, threshold=threshold, tUC=tUC, tUP=tUP, tdgl=tdgl), [[orderedBlocks, 0], [invertedBlocks, 1]])
-
-    transBlocks = blks[0]
-    invTransBlocks = blks[1]
-    del(blks)
+    if trees is None:
+        trees = [None, None]
+    # Candidate blocks only link alignments between the same pair of chromosomes, so every (aChr, bChr, direction) is an independent shard
+    shards = []
+    for isinv, blocks, tree in [(0, orderedBlocks, trees[0]), (1, invertedBlocks, trees[1])]:
+        groups = blocks.groupby(['aChr', 'bChr'], sort=False).indices.items() if shard else [(None, np.arange(len(blocks)))]
+        for key, ids in groups:
+            if len(ids) == 0:
+                continue
+            shardAnno = annoCoords if key is None else annoCoords.loc[(annoCoords.aChr == key[0]) | (annoCoords.bChr == key[1])]
+            shards.append((isinv, ids, [blocks.iloc[ids], isinv, None if tree is None else subTree(tree, ids), shardAnno]))
+    # Largest shards first, as the path search is quadratic in the number of alignments
+    shards.sort(key=lambda x: -len(x[1]))
+    logger.debug("Number of CTX shards: " + str(len(shards)))
+
+    with Pool(processes = nCores) as pool:
+        blks = pool.starmap(partial(getBlocks, threshold=threshold, tUC=tUC, tUP=tUP, tdgl=tdgl), [s[2] for s in shards], chunksize=1)
+
+    # Merge the shards. getProfitableTrans orders blocks with the same first alignment by the shard's alignment
+    # ids, so blocks are sorted by all their alignments to get the same order for any sharding
+    transBlocks = [[], []]
+    for (isinv, ids, _), blk in zip(shards, blks):
+        transBlocks[isinv] += [ids[b].tolist() for b in blk]
+    for b in transBlocks:
+        b.sort()
+    transBlocks, invTransBlocks = transBlocks
+    del(blks, shards)
     collect()
     logger.debug("finding Blocks")
     logger.debug("Preparing for cluster analysis")
 
     ctxTransBlocks, ctxTransIndexOrder = mergeTransBlocks(transBlocks, orderedBlocks, invTransBlocks, invertedBlocks, ctx = True)
 
-    ctxTransGenomeAGroups = []
-    for chromo in uniChromo:
-        ctxTransGenomeAGroups += makeTransGroupList(ctxTransBlocks.loc[ctxTransBlocks.aChr == chromo, ["aStart","aEnd","bStart","bEnd"]], "aStart","aEnd",threshold)
-
-
-    ctxTransGenomeBGroups = []
-    for chromo in uniChromo:
-        ctxTransGenomeBGroups += makeTransGroupList(ctxTransBlocks.loc[ctxTransBlocks.bChr == chromo, ["aStart","aEnd","bStart","bEnd"]], "bStart","bEnd",threshold)
-
-
-    ctxGroupIndices = {}
-    for i in range(len(ctxTransGenomeAGroups)):
-        for block in ctxTransGenomeAGroups[i].member:
-            ctxGroupIndices[block] = [i]
-
-    for i in range(len(ctxTransGenomeBGroups)):
-        for block in ctxTransGenomeBGroups[i].member:
-            ctxGroupIndices[block].append(i)
+    ctxTransGenomeAGroups = getGenomeGroups(ctxTransBlocks.aStart.values.astype(np.int64), ctxTransBlocks.aEnd.values.astype(np.int64), ctxTransBlocks.aChr.values, threshold)
+    ctxTransGenomeBGroups = getGenomeGroups(ctxTransBlocks.bStart.values.astype(np.int64), ctxTransBlocks.bEnd.values.astype(np.int64), ctxTransBlocks.bChr.values, threshold)
 
     logger.debug("Getting clusters")
-    # ctxCluster = getTransCluster(ctxGroupIndices, ctxTransGenomeAGroups, ctxTransGenomeBGroups)
-    ctxCluster = getTransCluster(ctxGroupIndices, {i:ctxTransGenomeAGroups[i].member for i in range(len(ctxTransGenomeAGroups))}, {i:ctxTransGenomeBGroups[i].member for i in range(len(ctxTransGenomeBGroups))})
-
-    ctxClusterIndices = dict()
-    for i in range(len(ctxCluster)):
-        ctxClusterIndices.update(dict.fromkeys(ctxCluster[i], i))
+    ctxCluster = clusterList(*getTransClusters(ctxTransGenomeAGroups.group, ctxTransGenomeBGroups.group))
 
     if len(ctxTransBlocks) > 0:
         auni = getOverlapWithSynBlocks(np.array(ctxTransBlocks.aStart), np.array(ctxTransBlocks.aEnd),
@@ -592,45 +990,17 @@ def getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores,
                                    np.array(ctxTransBlocks.bChr), np.array(sortedInPlace.bStart),
                                    np.array(sortedInPlace.bEnd), np.array(sortedInPlace.bChr), 50,
                                      ctxTransBlocks.shape[0], tUC, tUP)
+    else:
+        auni = buni = np.zeros(0, dtype=bool)
 
-    genomeGroupLengths = ([len(i.member) for i in ctxTransGenomeAGroups], [ len(i.member) for i in ctxTransGenomeBGroups])
-
-    ctxBlocksData = [transBlock(i) for i in range(ctxTransBlocks.shape[0])]
-
-    count=0
-    for row in ctxTransBlocks.itertuples(index = False):
-        ctxBlocksData[count].aStart = row.aStart
-        ctxBlocksData[count].aEnd = row.aEnd
-        ctxBlocksData[count].bStart = row.bStart
-        ctxBlocksData[count].bEnd = row.bEnd
-        ctxBlocksData[count].dir = row.bDir
-        ctxBlocksData[count].transClusterIndex = ctxClusterIndices[count]
-        ctxBlocksData[count].transGroupIndices = ctxGroupIndices[count]
-        ctxBlocksData[count].aUni = auni[count]
-        ctxBlocksData[count].bUni = buni[count]
-        if genomeGroupLengths[0][ctxBlocksData[count].transGroupIndices[0]] == 1:
-            ctxBlocksData[count].genomeAUni = True
-        if genomeGroupLengths[1][ctxBlocksData[count].transGroupIndices[1]] == 1:
-            ctxBlocksData[count].genomeBUni = True
-        if (ctxBlocksData[count].aUni and ctxBlocksData[count].genomeAUni) or (ctxBlocksData[count].bUni and ctxBlocksData[count].genomeBUni):
-            ctxBlocksData[count].setStatus(1)
-        count+=1
+    ctxBlocksData = transCandidates(ctxTransBlocks, ctxTransBlocks.bDir, ctxCluster, ctxTransGenomeAGroups, ctxTransGenomeBGroups, auni, buni)
 
     logger.debug("Finding ME Blocks")
-    aUni = np.array([ctxBlocksData[i].aUni for i in range(ctxTransBlocks.shape[0])], dtype="int")
-    bUni = np.array([ctxBlocksData[i].bUni for i in range(ctxTransBlocks.shape[0])], dtype="int")
-    status = np.array([ctxBlocksData[i].status for i in range(ctxTransBlocks.shape[0])], dtype="int")
-    aIndex = np.array([ctxBlocksData[i].transGroupIndices[0] for i in range(ctxTransBlocks.shape[0])], dtype="int")
-    bIndex = np.array([ctxBlocksData[i].transGroupIndices[1] for i in range(ctxTransBlocks.shape[0])], dtype="int")
 
     ## get sorted values. sorted based on genome coordinate in ctxTransBlocks
-    aGroups = {}
-    for i in range(len(ctxTransGenomeAGroups)):
-        aGroups[i] = ctxTransBlocks.iloc[ctxTransGenomeAGroups[i].member].sort_values(['aStart', 'aEnd']).index.values
-    bGroups = {}
-    for i in range(len(ctxTransGenomeBGroups)):
-        bGroups[i] = ctxTransBlocks.iloc[ctxTransGenomeBGroups[i].member].sort_values(['bStart', 'bEnd']).index.values
-    clstrsize = np.array([len(ctxCluster[i.transClusterIndex]) for i in ctxBlocksData], int)
+    aGroups = ctxTransGenomeAGroups.asdict()
+    bGroups = ctxTransGenomeBGroups.asdict()
+    clstrsize = np.array([len(c) for c in ctxCluster], int)[ctxBlocksData.clusterIndex]
 
     if len(ctxTransBlocks) > 0:
         out = getmeblocks(np.array(ctxTransBlocks.aStart),
@@ -638,54 +1008,31 @@ def getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores,
                           np.array(ctxTransBlocks.bStart),
                           np.array(ctxTransBlocks.bEnd),
                           threshold,
-                          aUni,
-                          bUni,
-                          status,
-                          aIndex,
-                          bIndex,
+                          ctxBlocksData.aUni,
+                          ctxBlocksData.bUni,
+                          ctxBlocksData.status,
+                          ctxBlocksData.aIndex,
+                          ctxBlocksData.bIndex,
                           aGroups,
                           bGroups,
                           clstrsize,
                           tdolp)
 
-        for i in range(len(out[0])):
-            if out[0][i]:
-                ctxCluster[ctxClusterIndices[i]].remove(i)
-
-        for i in out[1].keys():
-            if len(out[1][i]) > 0:
-                ctxBlocksData[i].addMEBlock(list(out[1][i]))
-
-        for i in out[2].keys():
-            ctxBlocksData[i].setMEList(list(out[2][i][0]),list(out[2][i][1]))
+        for i in np.nonzero(out[0])[0]:
+            ctxCluster[ctxBlocksData.clusterIndex[i]].remove(i)
+        meData = meBlocks(*out[1:])
+    else:
+        meData = None
 
     logger.debug("Finding best subset of clusters")
 
+    tasks = makeClusterTasks(ctxCluster, ctxBlocksData, meData, aGroups, bGroups, 'CTX')
     with Pool(processes=nCores) as pool:
-        clusterSolutions = pool.map(partial(getBestClusterSubset,
-                                            transBlocksData=ctxBlocksData,
-                                            tdolp=tdolp,
-                                            chromo='CTX',
-                                            bRT=bRT,
-                                            aGroups=aGroups,
-                                            bGroups=bGroups,
-                                            threshold=threshold), ctxCluster)
-
-    clusterSolutionBlocks = [i[1] for i in clusterSolutions if i != None]
-
-    garb = deque()
-    for i in range(len(ctxBlocksData)):
-        if not ctxBlocksData[i].aUni and not ctxBlocksData[i].bUni:
-            garb.append(0)
-        elif ctxBlocksData[i].status == 1:
-            garb.append(0)
-        elif not ctxBlocksData[i].aUni:
-            garb.append(1)
-        elif not ctxBlocksData[i].bUni:
-            garb.append(2)
-        else:
-            garb.append(3)
-    meclass = np.array(list(garb), np.uint16)
+        clusterSolutions = solveClusterTasks(tasks, pool, nCores, bRT, tdolp, threshold)
+
+    clusterSolutionBlocks = [i[1] for i in clusterSolutions]
+
+    meclass = ctxBlocksData.meclass()
 
     transClasses = getTransClasses(clusterSolutionBlocks,
                                    ctxBlocksData,
@@ -695,13 +1042,14 @@ def getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores,
                                    ctxTransBlocks.aEnd.values.astype(np.uint),
                                    ctxTransBlocks.bStart.values.astype(np.uint),
                                    ctxTransBlocks.bEnd.values.astype(np.uint),
-                                   aIndex,
-                                   bIndex,
+                                   ctxBlocksData.aIndex,
+                                   ctxBlocksData.bIndex,
                                    aGroups,
                                    bGroups,
                                    threshold,
                                    meclass,
-                                   tdolp)
+                                   tdolp,
+                                   meData)
 
     indices = sorted(unlist(list(transClasses.values())))
     keys = [key for index in indices for key in list(transClasses.keys()) if index in transClasses[key]]
@@ -713,29 +1061,32 @@ def getCTX(coords, cwdPath, uniChromo, threshold, bRT, prefix, tUC, tUP, nCores,
                            ctxTransBlocks.aEnd.values.astype(np.uint),
                            ctxTransBlocks.bStart.values.astype(np.uint),
                            ctxTransBlocks.bEnd.values.astype(np.uint),
-                           aIndex,
-                           bIndex,
+                           ctxBlocksData.aIndex,
+                           ctxBlocksData.bIndex,
                            aGroups,
                            bGroups,
                            threshold,
                            meclass,
                            tdolp)
 
-    fout = open(cwdPath+prefix+"ctxOut.txt","w")
+    ctxBlocks = []
     for index in indices:
-        if ctxBlocksData[index].dir == 1:
-            alignIndices = transBlocks[ctxTransIndexOrder[index]]
-            fout.write("#\t" + "\t".join(map(str,[ctxTransBlocks.iloc[index]["aChr"], ctxTransBlocks.iloc[index]["aStart"], ctxTransBlocks.iloc[index]["aEnd"], "-", ctxTransBlocks.iloc[index]["bChr"], ctxTransBlocks.iloc[index]["bStart"],ctxTransBlocks.iloc[index]["bEnd"]])) + "\t" + blocksClasses[index]+ "\t" +  dupGenomes[index]+"\n")
-            for i in alignIndices:
-                fout.write("\t".join(map(str,orderedBlocks.iloc[i,0:4]))+"\n")
-        elif ctxBlocksData[index].dir == -1:
-            alignIndices = invTransBlocks[ctxTransIndexOrder[index]]
-            fout.write("#\t" + "\t".join(map(str,[ctxTransBlocks.iloc[index]["aChr"], ctxTransBlocks.iloc[index]["aStart"], ctxTransBlocks.iloc[index]["aEnd"], "-", ctxTransBlocks.iloc[index]["bChr"], ctxTransBlocks.iloc[index]["bStart"],ctxTransBlocks.iloc[index]["bEnd"]]))+ "\t" + blocksClasses[index] + "\t" +  dupGenomes[index]+ "\n")
-            for i in alignIndices:
-                fout.write("\t".join(map(str,invertedBlocks.iloc[i,[0,1,3,2]])) + "\n")
-    fout.close()
-
-    return 0
+        if ctxBlocksData.dir[index] == 1:
+            aln = orderedBlocks.iloc[transBlocks[ctxTransIndexOrder[index]], 0:4].values
+        elif ctxBlocksData.dir[index] == -1:
+            aln = invertedBlocks.iloc[invTransBlocks[ctxTransIndexOrder[index]], [0,1,3,2]].values
+        else:
+            continue
+        block = ctxTransBlocks.iloc[index]
+        ctxBlocks.append(srBlock(CTXCLASSES[blocksClasses[index]], block["aChr"], block["aStart"], block["aEnd"], block["bChr"], block["bStart"], block["bEnd"], aln, dupGenomes[index]))
+    return ctxBlocks
+
+def edgesToDict(indptr, indices):
+    """
+    Convert CSR edges to a dict of children lists for nodes having children.
+    """
+    return {i: indices[indptr[i]:indptr[i+1]].tolist() for i in np.nonzero(np.diff(indptr))[0]}
+
 
 cpdef makeBlocksTree(long[:] aStart, long[:] aEnd, long[:] bStart, long[:] bEnd, int threshold, long[:] left, long[:] right, int tdgl):
     """Compute whether two alignments can be part of one translation block. For this:
@@ -744,79 +1095,48 @@ cpdef makeBlocksTree(long[:] aStart, long[:] aEnd, long[:] bStart, long[:] bEnd,
     
     Returns
     --------
-    outOrderedBlocks: pandas DataFrame,
-    Dataframe of type Object. Lower half is NA, upper half contains whether two
-    alignments can be connected (True) or not (False).
+    outOrderedBlocks: dict,
+    For each alignment having a candidate, list of alignments that can follow it in a block.
     """
-    cdef:
-        ssize_t                                     i,j, n = len(aStart)
-        cpp_map[long, cpp_deq[long]]                out
-        cpp_map[long, cpp_deq[long]].iterator       it
-
-    for i in range(<Py_ssize_t> n):
-        for j in range(<Py_ssize_t> i+1, <Py_ssize_t> n):
-            if (aStart[j] - aEnd[i]) < tdgl:        # Select only alignments with small gaps
-                if (aStart[j] - aStart[i]) > threshold:
-                    if (aEnd[j] - aEnd[i]) > threshold:
-                        if (bStart[j] - bEnd[i]) < tdgl:        # Select only alignments with small gaps
-                            if (bStart[j] - bStart[i]) > threshold:
-                                if (bEnd[j] - bEnd[i]) > threshold:
-                                    # Alignments could form a block when they are not separated by inPlaceBlocks. For this, we check whether the alignments have a common intersecting inPlaceAlignments.
-                                    if right[i]-1 >= left[j]+1 and right[i] <= right[j]:
-                                        out[i].push_back(j)
-                                    elif left[i] >= left[j] and left[i]+1 <= right[j]-1:
-                                        out[i].push_back(j)
-
-    it = out.begin()
-    outdict = {}
-    while it != out.end():
-        outdict[deref(it).first] = [deref(it).second[i] for i in range(<Py_ssize_t> deref(it).second.size())]
-        inc(it)
-    return(outdict)
+    indptr, indices = getCandidateEdges(aStart, aEnd, bStart, bEnd, None, None, None, threshold, tdgl)
+    src = np.repeat(np.arange(len(aStart)), np.diff(indptr))
+    l, r = np.asarray(left), np.asarray(right)
+    # Alignments could form a block when they are not separated by inPlaceBlocks. For this, we check whether the alignments have a common intersecting inPlaceAlignments.
+    keep = ((r[src]-1 >= l[indices]+1) & (r[src] <= r[indices])) | ((l[src] >= l[indices]) & (l[src]+1 <= r[indices]-1))
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(src[keep], minlength=len(aStart)))))
+    return edgesToDict(indptr, indices[keep])
+
 
 cpdef makeBlocksTree_ctx(long[:] astart, long[:] aend, long[:] bstart, long[:] bend, long[:] bdir, np.ndarray achr, np.ndarray bchr, int threshold, int tdgl):
     """Compute whether two alignments can be part of one translation block. For this:
        they should be syntenic with respect to each other.
     """
-    cdef:
-        Py_ssize_t                                  i,j, n = len(astart)
-        cpp_map[long, cpp_deq[long]]                out
-        cpp_map[long, cpp_deq[long]].iterator       it
-        long[:]                                     achr_int, bchr_int
-    _, achr_int = np.unique(achr, return_inverse=True)
-    _, bchr_int = np.unique(bchr, return_inverse=True)
-    for i in range(<Py_ssize_t> n):
-        for j in range(<Py_ssize_t> i, <Py_ssize_t> n):
-            if achr_int[i] != achr_int[j]:
-                continue
-            if bchr_int[i] != bchr_int[j]:
-                continue
-            if (astart[j] - aend[i]) < tdgl:
-                if (astart[j] - astart[i]) > threshold:
-                    if (aend[j] - aend[i]) > threshold:
-                        if bdir[i] == 1:
-                            if (bstart[j] - bend[i]) < tdgl:
-                                if (bstart[j] - bstart[i]) > threshold:
-                                    if (bend[j] - bend[i]) > threshold:
-                                        out[i].push_back(j)
-                        else:
-                            if (bend[i] - bstart[j]) < tdgl:
-                                if (bstart[i] - bstart[j]) > threshold:
-                                    if (bend[i] - bend[j]) > threshold:
-                                        out[i].push_back(j)
-    it = out.begin()
-    outdict = {}
-    while it != out.end():
-        outdict[deref(it).first] = [deref(it).second[i] for i in range(<Py_ssize_t> deref(it).second.size())]
-        inc(it)
-    return outdict
-
-
-def getBlocks(orderedBlocks, isinv, annoCoords, threshold, tUC, tUP, tdgl):
+    achr_int = pd.factorize(achr)[0].astype(np.int64)
+    bchr_int = pd.factorize(bchr)[0].astype(np.int64)
+    return edgesToDict(*getCandidateEdges(astart, aend, bstart, bend, bdir, achr_int, bchr_int, threshold, tdgl))
+
+
+def getCTXTree(orderedBlocks, threshold, tdgl):
+    """Collinear successors of the ctx alignments in orderedBlocks. Does not depend on the intra-chromosomal annotations."""
+    if len(orderedBlocks) == 0:
+        return {}
+    return makeBlocksTree_ctx(orderedBlocks.aStart.values, orderedBlocks.aEnd.values, orderedBlocks.bStart.values, orderedBlocks.bEnd.values, orderedBlocks.bDir.values, orderedBlocks.aChr.values, orderedBlocks.bChr.values, threshold, tdgl)
+
+
+def subTree(tree, ids):
+    """Part of tree between the alignments ids (sorted positions), renumbered to their positions in ids"""
+    sub = {}
+    for i in range(len(ids)):
+        if ids[i] in tree:
+            sub[i] = set(np.searchsorted(ids, sorted(tree[ids[i]])).tolist())
+    return sub
+
+
+def getBlocks(orderedBlocks, isinv, tree, annoCoords, threshold, tUC, tUP, tdgl):
     if len(orderedBlocks) == 0:
         return([])
 
-    outOrderedBlocks = makeBlocksTree_ctx(orderedBlocks.aStart.values, orderedBlocks.aEnd.values, orderedBlocks.bStart.values, orderedBlocks.bEnd.values, orderedBlocks.bDir.values, orderedBlocks.aChr.values, orderedBlocks.bChr.values, threshold, tdgl)
+    outOrderedBlocks = getCTXTree(orderedBlocks, threshold, tdgl) if tree is None else tree
 
     transBlocks = getProfitableTrans(outOrderedBlocks,
                                      orderedBlocks.aStart.values,
@@ -1223,12 +1543,12 @@ cdef greedySubsetSelector2(long[:] cluster, transBlocksData, long[:] seedBlocks,
     bestScore = 0
     bestComb = []
 
-    astart = np.array([transBlocksData[i].aStart for i in range(n)], dtype=np.uint)
-    aend = np.array([transBlocksData[i].aEnd for i in range(n)], dtype=np.uint)
-    bstart = np.array([transBlocksData[i].bStart for i in range(n)], dtype=np.uint)
-    bend = np.array([transBlocksData[i].bEnd for i in range(n)], dtype=np.uint)
-    aindex = np.array([transBlocksData[i].transGroupIndices[0] for i in range(n)], dtype=np.uint)
-    bindex = np.array([transBlocksData[i].transGroupIndices[1] for i in range(n)], dtype=np.uint)
+    astart = transBlocksData.aStart.astype(np.uint)
+    aend = transBlocksData.aEnd.astype(np.uint)
+    bstart = transBlocksData.bStart.astype(np.uint)
+    bend = transBlocksData.bEnd.astype(np.uint)
+    aindex = transBlocksData.aIndex.astype(np.uint)
+    bindex = transBlocksData.bIndex.astype(np.uint)
 
     tempcluster = np.zeros(len(transBlocksData), dtype=np.uint16)
     outblocks = np.zeros(len(transBlocksData), dtype=np.uint16)
@@ -1252,19 +1572,7 @@ cdef greedySubsetSelector2(long[:] cluster, transBlocksData, long[:] seedBlocks,
             transBlocksScore[i] = aend[i] - astart[i] + bend[i] - bstart[i] + 2
 
 
-    garb = deque()
-    for i in range(n):
-        if not transBlocksData[i].aUni and not transBlocksData[i].bUni:
-            garb.append(0)
-        elif transBlocksData[i].status == 1:
-            garb.append(0)
-        elif not transBlocksData[i].aUni:
-            garb.append(1)
-        elif not transBlocksData[i].bUni:
-            garb.append(2)
-        else:
-            garb.append(3)
-    meclass = np.array(list(garb), np.uint16)
+    meclass = transBlocksData.meclass()
 
     while ntmp > 0:
         outchanged = True
@@ -1428,22 +1736,14 @@ cdef greedySubsetSelectorHeuristic(long[:] cluster, transBlocksData, long[:] see
 
     bestScore = 0
     bestComb = []
-    astart = np.array([transBlocksData[i].aStart for i in range(n)], dtype=np.uint)
-    aend = np.array([transBlocksData[i].aEnd for i in range(n)], dtype=np.uint)
-    bstart = np.array([transBlocksData[i].bStart for i in range(n)], dtype=np.uint)
-    bend = np.array([transBlocksData[i].bEnd for i in range(n)], dtype=np.uint)
-    aindex = np.array([transBlocksData[i].transGroupIndices[0] for i in range(n)], dtype=np.uint)
-    bindex = np.array([transBlocksData[i].transGroupIndices[1] for i in range(n)], dtype=np.uint)
-
-    garb = deque()
-    for i in range(n):
-        if not transBlocksData[i].aUni and not transBlocksData[i].bUni: garb.append(0)
-        elif transBlocksData[i].status == 1:                            garb.append(0)
-        elif not transBlocksData[i].aUni:                               garb.append(1)
-        elif not transBlocksData[i].bUni:                               garb.append(2)
-        else:                                                           garb.append(3)
-
-    meclass = np.array(list(garb), np.uint16)
+    astart = transBlocksData.aStart.astype(np.uint)
+    aend = transBlocksData.aEnd.astype(np.uint)
+    bstart = transBlocksData.bStart.astype(np.uint)
+    bend = transBlocksData.bEnd.astype(np.uint)
+    aindex = transBlocksData.aIndex.astype(np.uint)
+    bindex = transBlocksData.bIndex.astype(np.uint)
+
+    meclass = transBlocksData.meclass()
     ntmp = 0
     tempcluster = np.zeros(n, dtype=np.uint16)
     outblocks = np.zeros(n, dtype=np.uint16)
@@ -1690,77 +1990,113 @@ cdef greedySubsetSelectorHeuristic(long[:] cluster, transBlocksData, long[:] see
 
 
 
-@cython.boundscheck(False)
-@cython.wraparound(False)
-cdef greedySubsetSelector(cluster, transBlocksData, seedblocks, iterCount = 100):
-    cdef:
-        Py_ssize_t                                      i, j, k, l
-        cpp_bool                                        fnd, outchanged, changed
-        long                                   n = len(transBlocksData)
-        long                                   ncls = len(cluster)
-        long                                            length=0, ntmp=0            # number of temp cluster still need to be classified
-        unsigned long                                   newblock
-        unsigned long[:]                                astart, aend, bstart, bend, aindex, bindex, clstrsize
-        unsigned short int[:]                           meclass
-        unsigned long[:]                                meto, mealist, meblist
-        unsigned short int                              auni, buni, status
-        unsigned short int[:]                           tempcluster, outblocks, skiplist
-        unsigned short int[:]                           intrlist
-
-
-    np.random.seed(1)
-    bestScore = 0
-    bestComb = []
-
-    ## initiate transBlocksScore
-    tempcluster = np.zeros(n, dtype=np.uint16)
-    outblocks = np.zeros(n, dtype=np.uint16)
-    skiplist = np.zeros(n, dtype=np.uint16)
-    for i in range(ncls):
-        tempcluster[cluster[i]] = 1
-    for i in range(len(seedblocks)):
-        outblocks[seedblocks[i]] = 1
-        tempcluster[seedblocks[i]] = 0
-    transBlocksScore = {}
-    for i in np.nonzero(tempcluster)[0].astype(int):
-        transBlocksScore[i] = (transBlocksData[i].aEnd - transBlocksData[i].aStart) + (transBlocksData[i].bEnd - transBlocksData[i].bStart)
+cdef inline u64 splitmix64(u64 *state) noexcept nogil:
+    cdef u64 z
+    state[0] += <u64> 0x9E3779B97F4A7C15
+    z = state[0]
+    z = (z ^ (z >> 30)) * <u64> 0xBF58476D1CE4E5B9
+    z = (z ^ (z >> 27)) * <u64> 0x94D049BB133111EB
+    return z ^ (z >> 31)
 
-    # Find best cluster subset
-    for i in range(iterCount):
 
-        # Initialise arrays
-        ntmp = 0
-        tempcluster = np.zeros(n, dtype=np.uint16)
-        outblocks = np.zeros(n, dtype=np.uint16)
-        skiplist = np.zeros(n, dtype=np.uint16)
-        for i in range(ncls):
-            tempcluster[cluster[i]] = 1
-            ntmp+=1
-        for i in range(len(seedblocks)):
-            outblocks[seedblocks[i]] = 1
-            tempcluster[seedblocks[i]] = 0
-            ntmp-=1
-        length = 0
+cdef class greedySearch:
+    """
+    Randomised greedy selection of a TD cluster subset. Works on the blocks
+    of the cluster and the blocks they are mutually exclusive to, numbered
+    in the order of their IDs. Each restart has its own random number
+    stream, seeded from the cluster coordinates and the restart number, so
+    restarts can run in any order and on any number of threads.
+    """
+    cdef:
+        int                 n, ncls, iterCount
+        long[::1]           ids, score
+        unsigned char[::1]  kind, incluster, isseed
+        long[::1]           toptr, aptr, bptr
+        int[::1]            toidx, aidx, bidx
+        unsigned char[:, ::1]   selected
+        u64                 seed
+
+    def __init__(self, cluster, transBlocksData, seedblocks, meData, int iterCount):
+        cdef:
+            Py_ssize_t      i
+            u64             h = 0
+        members = np.unique(np.asarray(cluster, dtype=np.int64))
+        ids = np.unique(np.concatenate([members] + [np.asarray(f(i), dtype=np.int64) for i in members for f in (meData.to, meData.alist, meData.blist)]))
+        pos = {c: i for i, c in enumerate(ids)}
+        self.n = len(ids)
+        self.ncls = len(members)
+        self.iterCount = iterCount
+        self.ids = ids
+        self.incluster = np.isin(ids, members).astype(np.uint8)
+        self.isseed = np.isin(ids, np.asarray(seedblocks, dtype=np.int64)).astype(np.uint8)
+        self.kind = np.zeros(self.n, dtype=np.uint8)
+        self.score = np.zeros(self.n, dtype=np.int64)
+        for i in range(self.n):
+            if self.incluster[i]:
+                self.kind[i] = meData.kind[ids[i]]
+                c = ids[i]
+                self.score[i] = (transBlocksData.aEnd[c] - transBlocksData.aStart[c]) + (transBlocksData.bEnd[c] - transBlocksData.bStart[c])
+                for v in (transBlocksData.aStart[c], transBlocksData.aEnd[c], transBlocksData.bStart[c], transBlocksData.bEnd[c]):
+                    h ^= <u64> v
+                    h = splitmix64(&h)
+        self.seed = h
+        self.toptr, self.toidx = self.localcsr(meData.to, pos)
+        self.aptr, self.aidx = self.localcsr(meData.alist, pos)
+        self.bptr, self.bidx = self.localcsr(meData.blist, pos)
+        self.selected = np.zeros((iterCount, self.n), dtype=np.uint8)
+
+    def localcsr(self, getlist, pos):
+        lists = [[pos[j] for j in getlist(self.ids[i])] if self.incluster[i] else [] for i in range(self.n)]
+        ptr = np.zeros(self.n + 1, dtype=np.int64)
+        ptr[1:] = np.cumsum([len(l) for l in lists])
+        return ptr, np.fromiter(chain.from_iterable(lists), dtype=np.int32, count=ptr[-1])
+
+    def runrange(self, int start, int end):
+        cdef:
+            int             it
+            unsigned char[::1]  tempcluster = np.empty(self.n, dtype=np.uint8)
+            unsigned char[::1]  skiplist = np.empty(self.n, dtype=np.uint8)
+            int[::1]        top = np.empty(20, dtype=np.int32)
+        with nogil:
+            for it in range(start, end):
+                self.restart(it, tempcluster, skiplist, top)
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    cdef void restart(self, int it, unsigned char[::1] tempcluster, unsigned char[::1] skiplist, int[::1] top) noexcept nogil:
+        cdef:
+            Py_ssize_t          j, k, p, q
+            long                ntmp = 0, length = 0, total
+            int                 ntop, newblock
+            bint                fnd
+            u64                 state = self.seed ^ ((<u64> it + 1) * <u64> 0xD1B54A32D192ED03)
+            double              u, cdf
+            unsigned char[::1]  outblocks = self.selected[it]
+        for j in range(self.n):
+            tempcluster[j] = self.incluster[j] and not self.isseed[j]
+            outblocks[j] = self.isseed[j]
+            skiplist[j] = 0
+            ntmp += tempcluster[j]
 
         while ntmp > 0:
             # Run the loop as long as there are some changes happening
             while ntmp != length:
                 length = ntmp
                 # Remove blocks for which corresponding mutually exclusive elements have already been selected
-                for j in range(n):
+                for j in range(self.n):
                     if tempcluster[j] == 0:
                         continue
-                    if hasattr(transBlocksData[j],"meTo"):
-                        for k in transBlocksData[j].meTo:
-                            if outblocks[k] == 1:
+                    if self.kind[j] == 1:
+                        for p in range(self.toptr[j], self.toptr[j+1]):
+                            if outblocks[self.toidx[p]] == 1:
                                 tempcluster[j] = 0
                                 ntmp-=1
                                 skiplist[j]=1
-                    elif hasattr(transBlocksData[j], "meAlist"):
-                        for k in transBlocksData[j].meAlist:
-                            if outblocks[k] == 1:
-                                for l in transBlocksData[j].meBlist:
-                                    if outblocks[l] == 1:
+                    elif self.kind[j] == 2:
+                        for p in range(self.aptr[j], self.aptr[j+1]):
+                            if outblocks[self.aidx[p]] == 1:
+                                for q in range(self.bptr[j], self.bptr[j+1]):
+                                    if outblocks[self.bidx[q]] == 1:
                                         tempcluster[j] = 0
                                         ntmp-=1
                                         skiplist[j] = 1
@@ -1768,28 +2104,28 @@ cdef greedySubsetSelector(cluster, transBlocksData, seedblocks, iterCount = 100)
                                 break
 
                 # Select blocks for which corresponding mutually exclusive elements have already been rejected
-                for j in range(n):
+                for j in range(self.n):
                     if tempcluster[j]==0:
                         continue
-                    if hasattr(transBlocksData[j],"meTo"):
+                    if self.kind[j] == 1:
                         fnd = False
-                        for k in transBlocksData[j].meTo:
-                            if skiplist[k] == 0:
+                        for p in range(self.toptr[j], self.toptr[j+1]):
+                            if skiplist[self.toidx[p]] == 0:
                                 fnd = True
                                 break
                         if not fnd:
                             tempcluster[j] = 0
                             ntmp-=1
                             outblocks[j] = 1
-                    elif hasattr(transBlocksData[j], "meAlist"):
+                    elif self.kind[j] == 2:
                         fnd = False
-                        for k in transBlocksData[j].meAlist:
-                            if skiplist[k] == 0:
+                        for p in range(self.aptr[j], self.aptr[j+1]):
+                            if skiplist[self.aidx[p]] == 0:
                                 fnd = True
                                 break
                         if not fnd:
-                            for k in transBlocksData[j].meBlist:
-                                if skiplist[k] == 0:
+                            for p in range(self.bptr[j], self.bptr[j+1]):
+                                if skiplist[self.bidx[p]] == 0:
                                     fnd = True
                                     break
                         if not fnd:
@@ -1799,86 +2135,197 @@ cdef greedySubsetSelector(cluster, transBlocksData, seedblocks, iterCount = 100)
 
             # Select one of the top 20 blocks to break the deadlock
             if ntmp > 0:
-                topBlocks = sorted(np.nonzero(tempcluster)[0], key = lambda x: transBlocksScore[x], reverse = True)[:20]
-                totalScore = sum(transBlocksScore[i] for i in topBlocks)
-                prob = [transBlocksScore[i]/totalScore for i in topBlocks]
-                newblock = int(np.random.choice(topBlocks, size = 1, p = prob))
+                ntop = 0
+                for j in range(self.n):
+                    if tempcluster[j] == 0:
+                        continue
+                    if ntop == 20 and self.score[j] <= self.score[top[19]]:
+                        continue
+                    k = ntop if ntop < 20 else 19
+                    while k > 0 and self.score[top[k-1]] < self.score[j]:
+                        if k < 20:
+                            top[k] = top[k-1]
+                        k -= 1
+                    top[k] = j
+                    if ntop < 20:
+                        ntop += 1
+                total = 0
+                for k in range(ntop):
+                    total += self.score[top[k]]
+                # Pick a block with probability proportional to its score
+                u = (splitmix64(&state) >> 11) * (1.0/9007199254740992.0)
+                cdf = 0
+                newblock = top[ntop-1]
+                for k in range(ntop):
+                    cdf += (<double> self.score[top[k]])/total
+                    if u < cdf:
+                        newblock = top[k]
+                        break
                 outblocks[newblock] = 1
                 tempcluster[newblock] = 0
                 ntmp-=1
 
                 # Remove blocks contradicting the selected block
-                if hasattr(transBlocksData[newblock],"meTo"):
-                    for j in transBlocksData[newblock].meTo:
+                if self.kind[newblock] == 1:
+                    for p in range(self.toptr[newblock], self.toptr[newblock+1]):
+                        j = self.toidx[p]
                         if tempcluster[j] == 1:
                             tempcluster[j] = 0
                             ntmp-=1
                         skiplist[j] = 1
 
-                elif hasattr(transBlocksData[newblock],"meAlist"):
+                elif self.kind[newblock] == 2:
                     fnd = False
-                    for j in transBlocksData[newblock].meAlist:
-                        if outblocks[j] == 1:
+                    for p in range(self.aptr[newblock], self.aptr[newblock+1]):
+                        if outblocks[self.aidx[p]] == 1:
                             fnd = True
-                            for k in transBlocksData[newblock].meBlist:
+                            for q in range(self.bptr[newblock], self.bptr[newblock+1]):
+                                k = self.bidx[q]
                                 if tempcluster[k] == 1:
                                     tempcluster[k] = 0
                                     ntmp-=1
                                 skiplist[k] = 1
                             break
                     if not fnd:
-                        for j in transBlocksData[newblock].meBlist:
-                            if outblocks[j] == 1:
-                                for k in transBlocksData[newblock].meAlist:
+                        for p in range(self.bptr[newblock], self.bptr[newblock+1]):
+                            if outblocks[self.bidx[p]] == 1:
+                                for q in range(self.aptr[newblock], self.aptr[newblock+1]):
+                                    k = self.aidx[q]
                                     if tempcluster[k] == 1:
                                         tempcluster[k] = 0
                                         ntmp-=1
                                     skiplist[k] = 1
                                 break
-                    for j in transBlocksData[newblock].meAlist:
-                        if j in transBlocksData[newblock].meBlist:
-                            if tempcluster[j] == 1:
-                                tempcluster[j] = 0
-                                ntmp-=1
-                            skiplist[j] = 1
-        bestScore, bestComb = updateBestComb(bestScore, bestComb, np.nonzero(outblocks)[0], transBlocksData)
+                    for p in range(self.aptr[newblock], self.aptr[newblock+1]):
+                        j = self.aidx[p]
+                        for q in range(self.bptr[newblock], self.bptr[newblock+1]):
+                            if self.bidx[q] == j:
+                                if tempcluster[j] == 1:
+                                    tempcluster[j] = 0
+                                    ntmp-=1
+                                skiplist[j] = 1
+                                break
+
+    def selection(self, int it):
+        return np.asarray(self.ids)[np.nonzero(self.selected[it])[0]]
+
+
+cdef greedySubsetSelector(cluster, transBlocksData, seedblocks, meData, iterCount = 100, nc = 1):
+    search = greedySearch(cluster, transBlocksData, seedblocks, meData, iterCount)
+    if nc > 1 and iterCount > 1:
+        bounds = np.linspace(0, iterCount, min(nc, iterCount) + 1).astype(int)
+        with ThreadPoolExecutor(max_workers=nc) as pool:
+            list(pool.map(search.runrange, bounds[:-1], bounds[1:]))
+    else:
+        search.runrange(0, iterCount)
+    bestScore = 0
+    bestComb = []
+    for i in range(iterCount):
+        bestScore, bestComb = updateBestComb(bestScore, bestComb, search.selection(i), transBlocksData)
     return(bestScore, bestComb)
 
 
-def getBestClusterSubset(cluster, transBlocksData, bRT, tdolp, chromo='', aGroups=None, bGroups=None, threshold=None):
+def getBestClusterSubset(cluster, transBlocksData, bRT, tdolp, chromo='', aGroups=None, bGroups=None, threshold=None, meData=None, nc=1):
     logger = logging.getLogger('tdcluster'+chromo)
     if len(cluster) == 0:
         return
-    seedBlocks = [i for i in cluster if transBlocksData[i].status == 1]
+    seedBlocks = [i for i in cluster if transBlocksData.status[i] == 1]
     if len(cluster) > 100000:
         logger.info('Large (>100000 candidates) TD cluster (with '+ str(len(cluster)) +' candidate TDs) identified. Using low-memory high-runtime approach. Iterative sampling disabled. Using less stringent progressive elimination.')
         output = greedySubsetSelectorHeuristic(np.array(cluster, int), transBlocksData, np.array(seedBlocks, int), aGroups, bGroups, threshold, tdolp)
     elif len(cluster) > 10000:
         logger.info('Large (>10000 candidates) TD cluster (with '+ str(len(cluster)) +' candidate TDs) identified. Using low-memory high-runtime approach. Iterative sampling disabled.')
         output = greedySubsetSelector2(np.array(cluster, int), transBlocksData, np.array(seedBlocks, int), aGroups, bGroups, threshold, tdolp)
-    elif len(cluster) < 50:
-        output = bruteSubsetSelector(cluster, transBlocksData, seedBlocks, bRT)
-        if output == "Failed":
-            output = greedySubsetSelector(cluster, transBlocksData, seedBlocks)
+    elif len(cluster) <= MAXBRUTE:
+        output = bruteSubsetSelector(cluster, transBlocksData, seedBlocks, bRT, meData, nc)
     else:
-        output = greedySubsetSelector(cluster, transBlocksData, seedBlocks)
+        output = greedySubsetSelector(cluster, transBlocksData, seedBlocks, meData, 100, nc)
     return output
 
 
-def getTransClasses(clusterSolutionBlocks, transData, transagroups, transbgroups, astart, aend, bstart, bend, aindex, bindex, agroup, bgroup, threshold, meclass, float tdolp):
+class clusterTask:
+    """
+    A TD cluster with the candidate, group and ME data needed to select its
+    best subset. The blocks of the cluster are renumbered to their positions
+    in ids, which keeps their order, so the selectors give the same result as
+    on the complete data.
+    """
+    def __init__(self, cluster, ids, transBlocksData, meData, aGroups, bGroups, chromo):
+        self.ids = ids
+        self.chromo = chromo
+        self.cluster = np.searchsorted(ids, cluster).tolist()
+        self.transBlocksData = transBlocksData.take(ids)
+        if len(cluster) > 10000:
+            self.meData = None
+            self.aGroups = {g: np.searchsorted(ids, aGroups[g]) for g in np.unique(self.transBlocksData.aIndex)}
+            self.bGroups = {g: np.searchsorted(ids, bGroups[g]) for g in np.unique(self.transBlocksData.bIndex)}
+            # Selectors for large clusters compare every pair of candidates in a group
+            self.cost = len(cluster)**2
+        else:
+            self.meData = meData.take(ids)
+            self.aGroups = self.bGroups = None
+            self.cost = len(cluster) + len(self.meData.toidx) + len(self.meData.aidx) + len(self.meData.bidx)
+            if len(cluster) > MAXBRUTE:
+                self.cost *= 100
+
+    def solve(self, bRT, tdolp, threshold, nc):
+        score, comb = getBestClusterSubset(self.cluster, self.transBlocksData, bRT, tdolp, self.chromo, self.aGroups, self.bGroups, threshold, self.meData, nc)
+        return score, self.ids[np.asarray(comb, dtype=np.int64)]
+
+
+def makeClusterTasks(clusters, transBlocksData, meData, aGroups, bGroups, chromo=''):
+    """Tasks for the non-empty clusters. A task has all blocks of the original cluster, including the ones removed by getmeblocks, as ME relations and groups point to them."""
+    order = np.argsort(transBlocksData.clusterIndex, kind='stable')
+    ptr = np.concatenate(([0], np.cumsum(np.bincount(transBlocksData.clusterIndex, minlength=len(clusters)))))
+    return [clusterTask(clusters[i], order[ptr[i]:ptr[i+1]], transBlocksData, meData, aGroups, bGroups, chromo) for i in range(len(clusters)) if len(clusters[i]) > 0]
+
+
+def solveTaskBatch(batch, bRT, tdolp, threshold, nc):
+    return [task.solve(bRT, tdolp, threshold, nc) for task in batch]
+
+
+def solveClusterTasks(tasks, pool, nCores, bRT, tdolp, threshold):
+    """
+    Solves the tasks on pool, largest estimated cost first. Small tasks are
+    sent in batches to limit the communication overhead. Solutions are
+    returned in the order of tasks.
+    """
+    if len(tasks) == 0:
+        return []
+    order = sorted(range(len(tasks)), key=lambda i: -tasks[i].cost)
+    mincost = sum(t.cost for t in tasks)/(8*nCores)
+    batches = []
+    cost = mincost
+    for i in order:
+        if cost >= mincost:
+            batches.append([])
+            cost = 0
+        batches[-1].append(i)
+        cost += tasks[i].cost
+    # Idle cores are used by the selectors when there are few batches
+    nc = max(1, nCores//len(batches))
+    out = [None]*len(tasks)
+    solved = pool.imap(partial(solveTaskBatch, bRT=bRT, tdolp=tdolp, threshold=threshold, nc=nc), [[tasks[i] for i in b] for b in batches])
+    for b, sols in zip(batches, solved):
+        for i, sol in zip(b, sols):
+            out[i] = sol
+    return out
+
+
+def getTransClasses(clusterSolutionBlocks, transData, transagroups, transbgroups, astart, aend, bstart, bend, aindex, bindex, agroup, bgroup, threshold, meclass, float tdolp, meData=None):
     logger = logging.getLogger('gettransclasses')
     def settl(j):
-        if transData[j].dir == 1:
+        if transData.dir[j] == 1:
             transClasses["translocation"].append(j)
-        elif transData[j].dir == -1:
+        elif transData.dir[j] == -1:
             transClasses["invTranslocation"].append(j)
         else:
             logger.info("Wrong alignment direction" + j)
 
     def setdup(j):
-        if transData[j].dir == 1:
+        if transData.dir[j] == 1:
              transClasses["duplication"].append(j)
-        elif transData[j].dir == -1:
+        elif transData.dir[j] == -1:
             transClasses["invDuplication"].append(j)
         else:
             logger.info("Wrong alignment direction" + j)
@@ -1890,17 +2337,17 @@ def getTransClasses(clusterSolutionBlocks, transData, transagroups, transbgroups
 
     for i in clusterSolutionBlocks:
         for j in i:
-            if not transData[j].aUni and not transData[j].bUni:
+            if not transData.aUni[j] and not transData.bUni[j]:
                 logger.error("Redundant candidate selected as TD" + str(j))
-            elif transData[j].status == 1:
-                if not transData[j].aUni or not transData[j].bUni:
+            elif transData.status[j] == 1:
+                if not transData.aUni[j] or not transData.bUni[j]:
                     setdup(j)
-                elif transData[j].aUni and transData[j].bUni:
-                    if transData[j].genomeAUni and transData[j].genomeBUni:
+                elif transData.aUni[j] and transData.bUni[j]:
+                    if transData.genomeAUni[j] and transData.genomeBUni[j]:
                         settl(j)
-                    elif not transData[j].genomeAUni:
+                    elif not transData.genomeAUni[j]:
                         istrans = 1
-                        for k in transData[j].getoverlappingregions(groups = transagroups,genome="a"):
+                        for k in transData.getoverlappingregions(j, transagroups, "a"):
                             if k in i:
                                 if getScore([k], transData) >= getScore([j],transData):
                                     istrans = 0
@@ -1909,9 +2356,9 @@ def getTransClasses(clusterSolutionBlocks, transData, transagroups, transbgroups
                             settl(j)
                         else:
                             setdup(j)
-                    elif not transData[j].genomeBUni:
+                    elif not transData.genomeBUni[j]:
                         istrans = 1
-                        for k in transData[j].getoverlappingregions(groups = transbgroups,genome="b"):
+                        for k in transData.getoverlappingregions(j, transbgroups, "b"):
                             if k in i:
                                 if getScore([k], transData) >= getScore([j],transData):
                                     istrans = 0
@@ -1920,16 +2367,16 @@ def getTransClasses(clusterSolutionBlocks, transData, transagroups, transbgroups
                             settl(j)
                         else:
                             setdup(j)
-            elif not transData[j].aUni or not transData[j].bUni:
+            elif not transData.aUni[j] or not transData.bUni[j]:
                 setdup(j)
-            elif transData[j].aUni and transData[j].bUni:
-                if hasattr(transData[j],"meTo"):
-                    if len(np.intersect1d(transData[j].meTo, i)) > 0:
+            elif transData.aUni[j] and transData.bUni[j]:
+                if meData is not None and meData.kind[j] == 1:
+                    if len(np.intersect1d(meData.to(j), i)) > 0:
                         setdup(j)
                     else:
                         settl(j)
-                elif hasattr(transData[j],"meAlist"):
-                    if len(np.intersect1d(transData[j].meAlist, i)) > 0 or len(np.intersect1d(transData[j].meBlist, i)) > 0:
+                elif meData is not None and meData.kind[j] == 2:
+                    if len(np.intersect1d(meData.alist(j), i)) > 0 or len(np.intersect1d(meData.blist(j), i)) > 0:
                         setdup(j)
                     else:
                         settl(j)
@@ -1956,17 +2403,16 @@ def getDupGenome(dupData, allTransBlocksData, transClasses, astart, aend, bstart
     dupGenomes = []
     for row in dupData.itertuples(index = True):
         found = False
-        tempTransBlock = allTransBlocksData[row.Index]
-        if not tempTransBlock.aUni:
+        if not allTransBlocksData.aUni[row.Index]:
             dupGenomes.append("B")
             continue
-        elif not tempTransBlock.bUni:
+        elif not allTransBlocksData.bUni[row.Index]:
             dupGenomes.append("A")
             continue
-        elif tempTransBlock.genomeAUni:
+        elif allTransBlocksData.genomeAUni[row.Index]:
             dupGenomes.append("A")
             continue
-        elif tempTransBlock.genomeBUni:
+        elif allTransBlocksData.genomeBUni[row.Index]:
             dupGenomes.append("B")
             continue
         if meclass[row.Index] != 3:
@@ -3,6 +3,7 @@
 
 import numpy as np
 from syri.scripts.func import *
+from syri.srdata import srResults
 from collections import deque, defaultdict
 from datetime import date
 import pandas as pd
@@ -17,93 +18,19 @@ np.random.seed(1)
 ##################################################################
 
 
-def getsrtable(cwdpath, prefix):
-    import re
-
-    files = ["synOut.txt", "invOut.txt", "TLOut.txt", "invTLOut.txt", "dupOut.txt", "invDupOut.txt", "ctxOut.txt"]
-    entries = defaultdict()
-
-    re_dup = re.compile("dup", re.I)
-    align_num = 1
-    sr_num = 0
-    for file in files:
-        sr_type = file.split("O")[0]
-        if sr_type == "syn":
-            sr_type = "SYN"
-        elif sr_type == "inv":
-            sr_type = "INV"
-        elif sr_type == "TL":
-            sr_type = "TRANS"
-        elif sr_type == "invTL":
-            sr_type = "INVTR"
-        elif sr_type == "dup":
-            sr_type = "DUP"
-        elif sr_type == "invDup":
-            sr_type = "INVDP"
-
-        with open(cwdpath + prefix + file, "r") as fin:
-            for line in fin:
-                line = line.strip().split("\t")
-                if line[0] == "#":
-                    sr_num += 1
-                    if file == 'ctxOut.txt':
-                        if line[8] == "translocation":
-                            sr_type = "TRANS"
-                        elif line[8] == "invTranslocation":
-                            sr_type = "INVTR"
-                        elif line[8] == "duplication":
-                            sr_type = "DUP"
-                        elif line[8] == "invDuplication":
-                            sr_type = "INVDP"
-                    entries[sr_type + str(sr_num)] = {
-                        'achr': line[1],
-                        'astart': line[2],
-                        'aend': line[3],
-                        'bchr': line[5],
-                        'bstart': line[6],
-                        'bend': line[7],
-                        'vartype': sr_type,
-                        'parent': "-",
-                        'dupclass': "-",
-                        'aseq': "-",
-                        "bseq": "-"
-                    }
-                    if re_dup.search(file):
-                        entries[sr_type + str(sr_num)]["dupclass"] = "copygain" if line[9] == "B" else "copyloss"
-                    if file == "ctxOut.txt":
-                        entries[sr_type + str(sr_num)]["vartype"] = sr_type
-                        if re_dup.search(line[8]):
-                            entries[sr_type + str(sr_num)]["dupclass"] = "copygain" if line[9] == "B" else "copyloss"
-                else:
-                    entries[sr_type + "AL" + str(align_num)] = {
-                        'achr': entries[sr_type + str(sr_num)]['achr'],
-                        'astart': line[0],
-                        'aend': line[1],
-                        'bchr': entries[sr_type + str(sr_num)]['bchr'],
-                        'bstart': line[2],
-                        'bend': line[3],
-                        'vartype': sr_type + "AL",
-                        'parent': sr_type + str(sr_num),
-                        'dupclass': "-",
-                        'aseq': "-",
-                        "bseq": "-"
-                    }
-                    align_num += 1
-
-    anno = pd.DataFrame.from_dict(entries, orient="index")
-    anno.loc[:, ['astart', 'aend', 'bstart', 'bend']] = anno.loc[:, ['astart', 'aend', 'bstart', 'bend']].astype('int')
-    anno['id'] = anno.index.values
-    anno = anno.loc[:, ['achr', 'astart', 'aend', 'aseq', 'bseq', 'bchr', 'bstart', 'bend', 'id', 'parent', 'vartype', 'dupclass']]
-    anno.sort_values(['achr', 'astart', 'aend'], inplace=True)
-    return anno
+def getsrtable(cwdpath, prefix, srdata=None):
+    if srdata is None:
+        srdata = srResults.fromFiles(cwdpath, prefix)
+    return srdata.srtable()
 # END
 
 
 def extractseq(gen: str, pos: defaultdict):
     chrs = defaultdict(dict)
-    for chrid, seq in readfasta(gen).items():
+    gseq = getGenomeStore(gen)
+    for chrid in gseq.lengths.keys():
         if chrid in pos.keys():
-            chrs[chrid] = {i: seq[i-1] for i in pos[chrid]}
+            chrs[chrid] = {i: gseq.fetch(chrid, i-1, i).decode() for i in pos[chrid]}
     return chrs
 # END
 
@@ -380,9 +307,10 @@ def parsesnps(f: str, anno: pd.DataFrame, count: int, ref: str):
 # END
 
 
-def getTSV(cwdpath: str, prefix: str, ref: str, hdrseq: bool, maxs: int):
+def getTSV(cwdpath: str, prefix: str, ref: str, hdrseq: bool, maxs: int, srdata=None):
     """
     :param cwdpath: Path containing all input files
+    :param srdata: srResults of the SR stage. Read from the SR output files when not given
     :return: A TSV file containing genomic annotation for the entire genome
     """
     import pandas as pd
@@ -392,7 +320,7 @@ def getTSV(cwdpath: str, prefix: str, ref: str, hdrseq: bool, maxs: int):
     logger.debug('cwdpath:' + cwdpath + ", prefix:" + prefix + ", ref:" + ref)
 
     logger.debug('Get SR anno')
-    anno = getsrtable(cwdpath, prefix)
+    anno = getsrtable(cwdpath, prefix, srdata)
     logger.debug("Number of SR annotations: " + str(anno.shape[0]))
     count = 1
     # Read structure variants
@@ -596,10 +524,6 @@ def getVCF(finname, foutname, cwdpath, prefix, sname, chr_sizes):
               'vartype': str,
               'dupclass': str}
     data = data.astype(dtypes)
-    # Translation string for fixing IUPAC codes in sequence strings
-    old = 'ACGTNacgtnRYSWKMBDHVryswkmbdhv'
-    rev = 'ACGTNacgtnACCAGACAAAaccagacaaa'
-    tab = str.maketrans(old, rev)
     try:
         data['achr'] = data['achr'].astype('int')
     except ValueError as ve:
@@ -674,8 +598,9 @@ def getVCF(finname, foutname, cwdpath, prefix, sname, chr_sizes):
                 elif line[3] == '-' and line[4] == '-':
                     _info = ";".join(['END=' + line[2], 'ChrB='+line[5], 'StartB='+line[6], 'EndB='+line[7], 'Parent='+line[9], 'VarType=ShV', 'DupType=.'])
                 elif line[3] != '-' and line[4] != '-':
-                    if line[3].translate(tab).upper() == line[4].translate(tab).upper(): continue
-                    pos = [line[0], line[1], line[8], line[3].translate(tab), line[4].translate(tab), '.', 'PASS']
+                    aseq, bseq = iupactoacgt(line[3]), iupactoacgt(line[4])
+                    if aseq.upper() == bseq.upper(): continue
+                    pos = [line[0], line[1], line[8], aseq, bseq, '.', 'PASS']
                     _info = ";".join(['END=' + line[2], 'ChrB=' + line[5], 'StartB='+line[6], 'EndB='+line[7], 'Parent=' + line[9], 'VarType=ShV', 'DupType=.'])
 
             pos.append(_info)
@@ -95,13 +95,30 @@ def mergeRanges(ranges):
 
 
 def revcomp(seq):
-    assert type(seq) == str
+    """
+    Reverse complement of a sequence. Works for both str and bytes.
+    """
     old = 'ACGTRYKMBDHVacgtrykmbdhv'
     rev = 'TGCAYRMKVHDBtgcayrmkvhdb'
+    if type(seq) == bytes:
+        return seq.translate(bytes.maketrans(old.encode(), rev.encode()))[::-1]
+    assert type(seq) == str
     tab = str.maketrans(old, rev)
     return seq.translate(tab)[::-1]
 
 
+def iupactoacgt(seq):
+    """
+    Replace IUPAC ambiguity codes with one of the bases they represent (used
+    for writing VCF). Works for both str and bytes.
+    """
+    old = 'ACGTNacgtnRYSWKMBDHVryswkmbdhv'
+    rev = 'ACGTNacgtnACCAGACAAAaccagacaaa'
+    if type(seq) == bytes:
+        return seq.translate(bytes.maketrans(old.encode(), rev.encode()))
+    return seq.translate(str.maketrans(old, rev))
+
+
 def readfasta(f):
     from gzip import open as gzopen
     from gzip import BadGzipFile
@@ -154,6 +171,161 @@ def readfasta(f):
     return out
 # END
 
+class genomeStore:
+    """
+    Random access to the sequences of a FASTA file.
+
+    Chromosome lengths and offsets are read from the faidx index (<f>.fai)
+    when it is present and up to date, otherwise the index is created by
+    scanning the file once. Plain FASTA files are memory-mapped and only the
+    requested regions are read. BGZF compressed files are accessed through
+    pysam.FastaFile. Other gzip files, and files with irregular line lengths,
+    are loaded to memory once.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.index = {}     # chrid -> [length, offset, linebases, linewidth]
+        self.seqs = None    # chrid -> bytes, for files that cannot be memory-mapped
+        self.fasta = None   # pysam.FastaFile for BGZF files
+        self.mm = None
+        with open(f, 'rb') as fin:
+            magic = fin.read(16)
+        if magic[:2] == b'\x1f\x8b':
+            if magic[12:14] == b'BC':
+                try:
+                    import pysam
+                    self.fasta = pysam.FastaFile(f)
+                    for chrid, ln in zip(self.fasta.references, self.fasta.lengths):
+                        self.index[chrid] = [ln, -1, -1, -1]
+                    return
+                except (ImportError, OSError, ValueError):
+                    self.fasta = None
+            self.loadseqs()
+            return
+        if not self.readfai():
+            if not self.buildfai():
+                self.loadseqs()
+                return
+        from mmap import mmap, ACCESS_READ
+        import os
+        if os.path.getsize(f) > 0:
+            with open(f, 'rb') as fin:
+                self.mm = mmap(fin.fileno(), 0, access=ACCESS_READ)
+
+    def readfai(self):
+        import os
+        fai = self.f + '.fai'
+        if not os.path.isfile(fai) or os.path.getmtime(fai) < os.path.getmtime(self.f):
+            return False
+        try:
+            with open(fai, 'r') as fin:
+                for line in fin:
+                    line = line.strip().split('\t')
+                    self.index[line[0]] = [int(line[1]), int(line[2]), int(line[3]), int(line[4])]
+        except (IndexError, ValueError):
+            self.index = {}
+            return False
+        return True
+
+    def buildfai(self):
+        """
+        Scans the FASTA file and creates index in memory. Returns False if
+        the line lengths are not uniform within a sequence.
+        """
+        import sys
+        index = {}
+        chrid = None
+        pos = 0
+        with open(self.f, 'rb') as fin:
+            for line in fin:
+                if line[:1] == b'>':
+                    chrid = line[1:].split()[0].decode() if len(line[1:].split()) > 0 else ''
+                    if chrid in index:
+                        sys.exit(" Duplicate chromosome IDs are not accepted. Chromosome ID {} is duplicated. Provided chromosome with unique IDs".format(chrid))
+                    pos += len(line)
+                    index[chrid] = [0, pos, 0, 0, False]
+                    continue
+                pos += len(line)
+                if chrid is None:
+                    continue
+                rec = index[chrid]
+                nb = len(line.rstrip(b'\r\n'))
+                if nb == 0:
+                    # Blank lines are only accepted at the end of a sequence
+                    rec[4] = rec[2] > 0
+                    continue
+                # A line after a shorter line means irregular line lengths
+                if rec[4] or (rec[2] > 0 and (nb > rec[2] or len(line) - nb != rec[3] - rec[2])):
+                    return False
+                if rec[2] == 0:
+                    rec[2], rec[3] = nb, len(line)
+                elif nb < rec[2]:
+                    rec[4] = True
+                rec[0] += nb
+        self.index = {k: v[:4] for k, v in index.items()}
+        return True
+
+    def loadseqs(self):
+        self.seqs = {}
+        for chrid, seq in readfasta(self.f).items():
+            self.seqs[chrid] = seq.encode()
+            self.index[chrid] = [len(seq), -1, -1, -1]
+
+    @property
+    def lengths(self):
+        return {k: v[0] for k, v in self.index.items()}
+
+    def fetch(self, chrid, start=0, end=None):
+        """
+        Returns the sequence chrid[start:end] (0-based, end exclusive) as bytes.
+        Raises KeyError for unknown chromosome IDs.
+        """
+        ln, off, lb, lw = self.index[chrid]
+        end = ln if end is None else min(end, ln)
+        start = max(start, 0)
+        if start >= end:
+            return b''
+        if self.seqs is not None:
+            return self.seqs[chrid][start:end]
+        if self.fasta is not None:
+            return self.fasta.fetch(chrid, start, end).encode()
+        s = off + (start // lb)*lw + start % lb
+        e = off + ((end - 1) // lb)*lw + (end - 1) % lb + 1
+        seq = self.mm[s:e]
+        if lw != lb:
+            seq = seq.replace(b'\n', b'').replace(b'\r', b'')
+        return seq
+
+    def fetcharray(self, chrid, start=0, end=None):
+        """
+        Returns chrid[start:end] as a numpy uint8 array. For memory-mapped
+        files with single-line sequences this is a view of the file.
+        """
+        import numpy as np
+        ln, off, lb, lw = self.index[chrid]
+        end = ln if end is None else min(end, ln)
+        start = max(start, 0)
+        if self.mm is not None and start < end and (end - 1) // lb == start // lb:
+            s = off + (start // lb)*lw + start % lb
+            return np.frombuffer(self.mm, dtype=np.uint8, count=end - start, offset=s)
+        return np.frombuffer(self.fetch(chrid, start, end), dtype=np.uint8)
+# END
+
+
+genomeStores = {}
+
+
+def getGenomeStore(f):
+    """
+    Returns the genomeStore for f. Stores are created once and shared by all
+    stages of a run.
+    """
+    if f not in genomeStores:
+        genomeStores[f] = genomeStore(f)
+    return genomeStores[f]
+# END
+
+
 def cgtpl(cg):
     """
     Takes a cigar string as input and returns a cigar tuple
@@ -126,12 +126,21 @@ def syri(args):
     ###################################################################
     # Read alignments and compare lengths with genome fasta
     ###################################################################
-    from syri.synsearchFunctions import readCoords
-    from syri.scripts.func import readfasta
+    from syri.synsearchFunctions import readCoords, getCoordsCacheKey, readCoordsCache, writeCoordsCache
+    from syri.scripts.func import getGenomeStore
     import numpy as np
 
     # chrlink is a dict with query genome ID as key and matching reference genome as values
-    coords, chrlink = readCoords(args.infile.name, args.chrmatch, args.dir, args.prefix, args, args.cigar)
+    cached = None
+    if args.cache:
+        cachekey = getCoordsCacheKey(args.infile.name, args)
+        cached = readCoordsCache(cachekey, args.dir, args.prefix)
+    if cached is not None:
+        coords, chrlink = cached
+    else:
+        coords, chrlink = readCoords(args.infile.name, args.chrmatch, args.dir, args.prefix, args, args.cigar)
+        if args.cache:
+            writeCoordsCache(coords, chrlink, cachekey, args.dir, args.prefix)
     achrs = np.unique(coords.aChr).tolist()
     bchrs = np.unique(coords.bChr).tolist()
     for chrid in achrs + bchrs:
@@ -151,7 +160,7 @@ def syri(args):
     key_found = []
     achr_ref_length = {}
     if args.ref is not None:
-        for chrid, seq in readfasta(args.ref.name).items():
+        for chrid, seqlen in getGenomeStore(args.ref.name).lengths.items():
             if chrid in achrs:
                 try:
                     i = int(chrid)
@@ -160,8 +169,8 @@ def syri(args):
                 except ValueError as e:
                     pass
                 key_found = key_found + [chrid]
-                achr_ref_length[chrid] = len(seq)
-                if len(seq) < achr_size[chrid]:
+                achr_ref_length[chrid] = seqlen
+                if seqlen < achr_size[chrid]:
                     logger.error('Length of reference sequence of ' + chrid + ' is less than the maximum coordinate of its aligned regions. Exiting.')
                     sys.exit()
         for achr in achrs:
@@ -172,7 +181,7 @@ def syri(args):
     key_found = []
     if args.qry is not None:
         if len(chrlink) > 0:
-            for chrid, seq in readfasta(args.qry.name).items():
+            for chrid, seqlen in getGenomeStore(args.qry.name).lengths.items():
                 if chrid in list(chrlink.keys()):
                     try:
                         i = int(chrid)
@@ -181,7 +190,7 @@ def syri(args):
                     except ValueError as e:
                         pass
                     key_found = key_found + [chrid]
-                    if len(seq) < bchr_size[chrlink[chrid]]:
+                    if seqlen < bchr_size[chrlink[chrid]]:
                         logger.error('Length of query sequence of ' + chrid + ' is less than the maximum coordinate of its aligned regions. Exiting.')
                         sys.exit()
             for bchr in list(chrlink.keys()):
@@ -189,7 +198,7 @@ def syri(args):
                     logger.error('Chromosome ID ' + bchr + ' is present in alignments but not in query genome fasta. Exiting.')
                     sys.exit()
         else:
-            for chrid, seq in readfasta(args.qry.name).items():
+            for chrid, seqlen in getGenomeStore(args.qry.name).lengths.items():
                 if chrid in list(bchr_size.keys()):
                     try:
                         i = int(chrid)
@@ -198,7 +207,7 @@ def syri(args):
                     except ValueError as e:
                         pass
                     key_found = key_found + [chrid]
-                    if len(seq) < bchr_size[chrid]:
+                    if seqlen < bchr_size[chrid]:
                         logger.error('Length of query sequence of ' + chrid + ' is less than the maximum coordinate of its aligned regions. Exiting.')
                         sys.exit()
             for bchr in list(bchr_size.keys()):
@@ -210,9 +219,14 @@ def syri(args):
     ###################################################################
     # Identify structural rearrangements
     ###################################################################
+    # SR blocks are passed to the SV, ShV and output stages in memory. The SR files are only an export (-k)
     from syri.synsearchFunctions import startSyri
+    from syri.srdata import srResults
+    srdata = None
     if not args.nosr:
-        startSyri(args, coords[["aStart", "aEnd", "bStart", "bEnd", "aLen", "bLen", "iden", "aDir", "bDir", "aChr", "bChr"]])
+        srdata = startSyri(args, coords[["aStart", "aEnd", "bStart", "bEnd", "aLen", "bLen", "iden", "aDir", "bDir", "aChr", "bChr"]])
+        if args.keep:
+            srdata.toFiles(args.dir, args.prefix)
 
     ###################################################################
     # Identify structural variations
@@ -224,21 +238,25 @@ def syri(args):
         else:
             fin = ["synOut.txt", "invOut.txt", "TLOut.txt", "invTLOut.txt", "ctxOut.txt"]
         logger.info("Finding SVs in " + ", ".join(fin))
-        listDir = os.listdir(args.dir)
-        for file in fin:
-            if args.prefix+file not in listDir:
-                logger.error(file + " is not present in the directory. Exiting")
-                sys.exit()
+        if args.nosr:
+            listDir = os.listdir(args.dir)
+            for file in fin:
+                if args.prefix+file not in listDir:
+                    logger.error(file + " is not present in the directory. Exiting")
+                    sys.exit()
         from syri.findsv import readSRData, getSV, addsvseq, getNotAligned
         if args.ref is None or args.qry is None:
             logger.error("Reference and query assembly fasta files are required for SV identification.")
             sys.exit()
+    # With --nosr, the SR blocks are read once from the files of an earlier run
+    if srdata is None and not (args.nosv and args.nosnp and args.novcf):
+        srdata = srResults.fromFiles(args.dir, args.prefix)
     if not args.nosv:
-        allAlignments = readSRData(args.dir, args.prefix, args.all)
-        getSV(args.dir, allAlignments, args.prefix, args.offset)
+        allAlignments = readSRData(args.dir, args.prefix, args.all, srdata)
+        getSV(args.dir, allAlignments, args.prefix, args.offset, args.nCores)
         #TODO: finalise the below SV call
         addsvseq(args.dir + args.prefix + "sv.txt", args.ref.name, args.qry.name, chrlink)
-        getNotAligned(args.dir, args.prefix, args.ref.name, args.qry.name, chrlink)
+        getNotAligned(args.dir, args.prefix, args.ref.name, args.qry.name, chrlink, srdata)
 
     ###################################################################
     # Identify snps/indels
@@ -250,7 +268,7 @@ def syri(args):
             if args.delta is None:
                 logger.error("Please provide delta file. Exiting")
                 sys.exit()
-        getshv(args, coords, chrlink)
+        getshv(args, coords, chrlink, srdata)
 
     ###################################################################
     # Combine Output
@@ -264,14 +282,14 @@ def syri(args):
         if args.ref is None:
             logger.error("Reference genome fasta file is required for combining outputs.")
             sys.exit()
-        getTSV(args.dir, args.prefix, args.ref.name, args.hdrseq, args.maxs)
+        getTSV(args.dir, args.prefix, args.ref.name, args.hdrseq, args.maxs, srdata)
         logger.info('Generating VCF')
         getVCF("syri.out", "syri.vcf", args.dir, args.prefix, args.sname, achr_ref_length)
         getsum("syri.out", "syri.summary", args.dir, args.prefix)
 
     from syri.scripts.func import fileRemove
     if not args.keep:
-        for fin in ["synOut.txt", "invOut.txt", "TLOut.txt", "invTLOut.txt", "dupOut.txt", "invDupOut.txt", "ctxOut.txt", "sv.txt", "notAligned.txt", "snps.txt"]:
+        for fin in ["sv.txt", "notAligned.txt", "snps.txt"]:
             fileRemove(args.dir + args.prefix + fin)
     logger.info("Finished syri")
 
@@ -287,12 +305,15 @@ def main():
     other = parser.add_argument_group("Additional arguments")
     other.add_argument('-F', dest="ftype", help="Input file type. T: Table, S: SAM, B: BAM, P: PAF", default="T", choices=['T', 'S', 'B', 'P'])
     other.add_argument('-f', dest='f', help='As a default, syri filters out low quality and small alignments. Use this parameter to use the full list of alignments without any filtering.', default=True, action='store_false')
+    other.add_argument('--min-iden', dest='minid', help='Alignments with identity less than or equal to this value are removed when filtering is on (see -f).', type=float, default=90)
+    other.add_argument('--min-alnlen', dest='minlen', help='Alignments with length (in either genome) less than or equal to this value are removed when filtering is on (see -f).', type=int, default=100)
     other.add_argument('-k', dest="keep", help="Keep intermediate output files", default=False, action="store_true")
     other.add_argument('--dir', dest='dir', help="path to working directory (if not current directory). All files must be in this directory.", action='store')
     other.add_argument("--prefix", dest="prefix", help="Prefix to add before the output file Names", type=str, default="")
     other.add_argument("--seed", dest="seed", help="seed for generating random numbers", type=int, default=1)
     other.add_argument('--nc', dest="nCores", help="number of cores to use in parallel (max is number of chromosomes)", type=int, default=1)
     other.add_argument('--novcf', dest="novcf", help="Do not combine all files into one output file", default=False, action="store_true")
+    other.add_argument('--cache', dest="cache", help="Save the parsed alignments in <prefix>coords.cache in the working directory and reuse them in later runs with the same input file and filtering parameters (-F, -f, --min-iden, --min-alnlen, --cigar, --no-chrmatch)", default=False, action="store_true")
     other.add_argument('--samplename', dest="sname", help="Sample name to be used in the output VCF file.", type=str, default='sample')
 
     # Parameters for identification of structural rearrangements
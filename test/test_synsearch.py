@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import os
+import unittest
+import numpy as np
+import pandas as pd
+
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+
+class TestChainSyn(unittest.TestCase):
+    """chainSyn should select the same syntenic path as the all-pairs getSynPathTS"""
+    @staticmethod
+    def chain(coords, threshold):
+        from syri.synsearchFunctions import chainSyn, getChainScores
+        return list(chainSyn(coords.aStart.values, coords.aEnd.values, coords.bStart.values, coords.bEnd.values, getChainScores(coords), threshold))
+    # END
+
+    def test_test_data(self):
+        from syri.synsearchFunctions import getSynPathTS
+        coords = pd.read_table(os.path.join(TESTDATA, 'out.filtered.coords'), header=None)
+        coords.columns = ["aStart", "aEnd", "bStart", "bEnd", "aLen", "bLen", "iden", "aDir", "bDir", "aChr", "bChr"]
+        coords = coords.loc[coords.bDir == 1].sort_values(["aStart", "aEnd", "bStart", "bEnd"])
+        coords.index = range(len(coords))
+        for threshold in [0, 50, 500]:
+            assert self.chain(coords, threshold) == list(getSynPathTS(coords, threshold))
+    # END
+
+    def test_random_tied_scores(self):
+        from syri.synsearchFunctions import getSynPathTS
+        rng = np.random.default_rng(1)
+        for _ in range(500):
+            n = int(rng.integers(1, 150))
+            span = int(rng.integers(5, 2000))
+            astart = np.sort(rng.integers(1, span, n))
+            bstart = rng.integers(1, span, n)
+            # Few distinct lengths and identities, so that many paths have the same score
+            coords = pd.DataFrame({"aStart": astart,
+                                   "aEnd": astart + rng.integers(0, span//5 + 1, n),
+                                   "bStart": bstart,
+                                   "bEnd": bstart + rng.integers(0, span//5 + 1, n),
+                                   "aLen": rng.integers(1, 4, n),
+                                   "bLen": rng.integers(1, 4, n),
+                                   "iden": np.full(n, 100.0)})
+            threshold = int(rng.integers(0, 60))
+            assert self.chain(coords, threshold) == list(getSynPathTS(coords, threshold))
+    # END
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+import os
+import unittest
+from collections import deque
+import numpy as np
+import pandas as pd
+
+TESTDATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_data')
+
+class transGroups:
+    """Reference: the list based grouping which getGenomeGroups replaced"""
+    def __init__(self, leftEnd, rightEnd, index, threshold):
+        self.leftEnd = leftEnd
+        self.rightEnd = rightEnd
+        self.member = [index]
+        self.threshold = threshold
+
+    def checkOverlap(self, leftEnd, rightEnd):
+        assert leftEnd >= self.leftEnd, "Blocks must be sorted"
+        if rightEnd < self.rightEnd + self.threshold:
+            return True
+        elif (rightEnd - self.rightEnd) < 0.5*(self.rightEnd - leftEnd):
+            return True
+        elif (leftEnd - self.leftEnd) < 0.5*(self.rightEnd - leftEnd):
+            return True
+        return False
+
+    def addMember(self, leftEnd, rightEnd, index):
+        self.leftEnd = min(self.leftEnd, leftEnd)
+        self.rightEnd = max(self.rightEnd, rightEnd)
+        self.member.append(index)
+
+
+def makeTransGroupList(transBlocksData, startC, endC, threshold):
+    transBlocksTable = transBlocksData.sort_values([startC, endC])
+    genomeGroups = []
+    for i in transBlocksTable.index.values:
+        s, e = transBlocksTable.at[i, startC], transBlocksTable.at[i, endC]
+        if len(genomeGroups) > 0 and s <= genomeGroups[-1].rightEnd and genomeGroups[-1].checkOverlap(s, e):
+            genomeGroups[-1].addMember(s, e, i)
+        else:
+            genomeGroups.append(transGroups(s, e, i, threshold))
+    return genomeGroups
+
+
+def gtc(gind, agrp, bgrp):
+    """Reference: breadth-first clustering which getTransClusters replaced. gind is visited in key order."""
+    vtr, vtra, vtrb = set(), set(), set()
+    out = []
+    for k in sorted(gind):
+        if k in vtr:
+            continue
+        cgrp = []
+        nque = deque([k])
+        while nque:
+            i = nque.popleft()
+            if i in vtr:
+                continue
+            vtr.add(i)
+            cgrp.append(i)
+            if gind[i][0] not in vtra:
+                vtra.add(gind[i][0])
+                nque.extend(agrp[gind[i][0]])
+            if gind[i][1] not in vtrb:
+                vtrb.add(gind[i][1])
+                nque.extend(bgrp[gind[i][1]])
+        out.append(sorted(cgrp))
+    return out
+
+
+def randomCandidates(rng, n, nchr=1):
+    # Small coordinate range and few lengths, so that starts and ends are often tied
+    astart = rng.integers(0, 300, n)
+    bstart = rng.integers(0, 300, n)
+    return pd.DataFrame({"aStart": astart,
+                         "aEnd": astart + rng.choice([0, 1, 5, 20, 50, 100], n),
+                         "bStart": bstart,
+                         "bEnd": bstart + rng.choice([0, 1, 5, 20, 50, 100], n),
+                         "aChr": rng.choice(["c" + str(i) for i in range(nchr)], n),
+                         "bChr": rng.choice(["c" + str(i) for i in range(nchr)], n)})
+
+
+class TestTDGroups(unittest.TestCase):
+    """getGenomeGroups and getTransClusters should reproduce the groups and clusters of the previous implementation"""
+    def test_genome_groups(self):
+        from syri.tdfunc import getGenomeGroups
+        rng = np.random.default_rng(1)
+        for _ in range(300):
+            data = randomCandidates(rng, int(rng.integers(0, 80)))
+            threshold = int(rng.choice([0, 5, 50]))
+            for s, e in [("aStart", "aEnd"), ("bStart", "bEnd")]:
+                groups = getGenomeGroups(data[s].values.astype(np.int64), data[e].values.astype(np.int64), None, threshold)
+                ref = makeTransGroupList(data, s, e, threshold)
+                assert [groups.members(i).tolist() for i in range(len(groups))] == [g.member for g in ref]
+    # END
+
+    def test_genome_groups_chromosomes(self):
+        from syri.tdfunc import getGenomeGroups
+        rng = np.random.default_rng(2)
+        for _ in range(300):
+            data = randomCandidates(rng, int(rng.integers(0, 80)), 3)
+            threshold = int(rng.choice([0, 5, 50]))
+            for s, e, c in [("aStart", "aEnd", "aChr"), ("bStart", "bEnd", "bChr")]:
+                groups = getGenomeGroups(data[s].values.astype(np.int64), data[e].values.astype(np.int64), data[c].values, threshold)
+                ref = []
+                for chrom in sorted(data[c].unique()):
+                    ref += makeTransGroupList(data.loc[data[c] == chrom], s, e, threshold)
+                assert [groups.members(i).tolist() for i in range(len(groups))] == [g.member for g in ref]
+    # END
+
+    def test_trans_clusters(self):
+        from syri.tdfunc import getGenomeGroups, getTransClusters, clusterList
+        rng = np.random.default_rng(3)
+        for _ in range(300):
+            data = randomCandidates(rng, int(rng.integers(0, 80)))
+            threshold = int(rng.choice([0, 5, 50]))
+            agroups = makeTransGroupList(data, "aStart", "aEnd", threshold)
+            bgroups = makeTransGroupList(data, "bStart", "bEnd", threshold)
+            gind = {}
+            for i in range(len(agroups)):
+                for block in agroups[i].member:
+                    gind[block] = [i]
+            for i in range(len(bgroups)):
+                for block in bgroups[i].member:
+                    gind[block].append(i)
+            ref = gtc(gind, {i: agroups[i].member for i in range(len(agroups))}, {i: bgroups[i].member for i in range(len(bgroups))})
+            a = getGenomeGroups(data.aStart.values.astype(np.int64), data.aEnd.values.astype(np.int64), None, threshold)
+            b = getGenomeGroups(data.bStart.values.astype(np.int64), data.bEnd.values.astype(np.int64), None, threshold)
+            assert clusterList(*getTransClusters(a.group, b.group)) == ref
+    # END
+
+
+def bruteEnumeration(cluster, transBlocksData, seedBlocks, meData):
+    """Reference: the combination enumeration which clusterSearch replaced, reading the ME relations from meData"""
+    from syri.tdfunc import getScore, updateBestComb
+    meTo = lambda i: list(meData.to(i))
+    meA = lambda i: list(meData.alist(i))
+    meB = lambda i: list(meData.blist(i))
+    posComb = [list(seedBlocks)]
+    skipList = [list(seedBlocks)]
+    for i in cluster:
+        newPosComb = []
+        newSkipList = []
+        for j in range(len(posComb)):
+            if i in skipList[j]:
+                continue
+            if meData.kind[i] == 1 and any(a in posComb[j] for a in meTo(i)):
+                continue
+            if meData.kind[i] == 2 and any(a in posComb[j] for a in meA(i)) and any(a in posComb[j] for a in meB(i)):
+                continue
+            newPosComb.append(posComb[j] + [i])
+            skipIndices = []
+            for k in posComb[j]:
+                if meData.kind[k] == 2:
+                    if i in meA(k):
+                        skipIndices.extend(meB(k))
+                    if i in meB(k):
+                        skipIndices.extend(meA(k))
+                if meData.kind[i] == 1:
+                    skipIndices.extend(meTo(i))
+                elif meData.kind[i] == 2:
+                    if k in meA(i):
+                        skipIndices.extend(meB(i))
+                    elif k in meB(i):
+                        skipIndices.extend(meA(i))
+            if meData.kind[i] == 2:
+                skipIndices.extend([a for a in meA(i) if a in meB(i)])
+            newSkipList.append(skipList[j] + skipIndices)
+        posComb.extend(newPosComb)
+        skipList.extend(newSkipList)
+    if [] in posComb:
+        posComb.remove([])
+    bestScore = getScore(posComb[0], transBlocksData)
+    bestComb = posComb[0]
+    for i in range(1, len(posComb)):
+        bestScore, bestComb = updateBestComb(bestScore, bestComb, posComb[i], transBlocksData)
+    return bestScore, bestComb
+
+
+class candidateTable:
+    def __init__(self, rng, n):
+        self.aStart = rng.integers(0, 20000, n)
+        self.aEnd = self.aStart + rng.integers(0, 5000, n)
+        self.bStart = rng.integers(0, 20000, n)
+        self.bEnd = self.bStart + rng.integers(0, 5000, n)
+        self.aUni = rng.integers(0, 2, n)
+        self.bUni = rng.integers(0, 2, n)
+
+
+def randomMeBlocks(rng, n):
+    from syri.tdfunc import meBlocks
+    kind = rng.choice([0, 1, 2], n).astype(np.uint8)
+    csr = lambda lists: (np.concatenate(([0], np.cumsum([len(l) for l in lists]))).astype(np.int64), np.array([j for l in lists for j in l], dtype=np.int64))
+    others = lambda i, k: [int(j) for j in rng.choice([j for j in range(n) if j != i], min(k, n-1), replace=False)]
+    to = [others(i, int(rng.integers(1, 4))) if kind[i] == 1 else [] for i in range(n)]
+    al = [others(i, int(rng.integers(1, 3))) if kind[i] == 2 else [] for i in range(n)]
+    bl = [others(i, int(rng.integers(1, 3))) if kind[i] == 2 else [] for i in range(n)]
+    return meBlocks(kind, csr(to), csr(al), csr(bl))
+
+
+class TestClusterSearch(unittest.TestCase):
+    """clusterSearch should select the same subset as the enumeration of all valid combinations"""
+    def test_brute_enumeration(self):
+        from syri.tdfunc import clusterSearch
+        rng = np.random.default_rng(4)
+        for _ in range(400):
+            n = int(rng.integers(1, 14))
+            data = candidateTable(rng, n)
+            meData = randomMeBlocks(rng, n)
+            cluster = sorted(rng.choice(n, int(rng.integers(1, n+1)), replace=False).tolist())
+            seedBlocks = [i for i in cluster if rng.random() < 0.15]
+            solver = clusterSearch(cluster, data, seedBlocks, meData)
+            assert solver.solve(-1, -1, 0)
+            score, comb = solver.result()
+            refscore, refcomb = bruteEnumeration(cluster, data, seedBlocks, meData)
+            assert score == refscore and comb == refcomb
+    # END
+
+    def test_node_cap(self):
+        from syri.tdfunc import clusterSearch, getScore
+        rng = np.random.default_rng(5)
+        for _ in range(100):
+            n = int(rng.integers(8, 14))
+            data = candidateTable(rng, n)
+            meData = randomMeBlocks(rng, n)
+            cluster = list(range(n))
+            solver = clusterSearch(cluster, data, [], meData)
+            # n+1 nodes reach the first leaf of the second search, which stops there and keeps it
+            if not solver.solve(0, n+1, 0):
+                assert solver.found()
+                score, comb = solver.result()
+                assert score == getScore(comb, data)
+    # END
+
+
+def splitChromosomes(coords, alen, blen):
+    """The single test chromosome cut into pieces of alen (reference) and blen (query) bases, so that many alignments are between different chromosomes"""
+    coords = coords.copy()
+    for g, l in [("a", alen), ("b", blen)]:
+        piece = np.minimum(coords[g + "Start"], coords[g + "End"]) // l
+        coords[g + "Chr"] = "C" + piece.astype(str)
+        coords[g + "Start"] -= piece*l
+        coords[g + "End"] -= piece*l
+    return coords
+
+
+class TestCTXShards(unittest.TestCase):
+    """Sharding the CTX candidate search by chromosome pair and direction should not change the CTX blocks"""
+    def test_sharded_ctx(self):
+        from syri.tdfunc import getCTX, getCTXData
+        from syri.srdata import srResults, srBlock
+        coords = pd.read_table(os.path.join(TESTDATA, 'out.filtered.coords'), header=None)
+        coords.columns = ["aStart", "aEnd", "bStart", "bEnd", "aLen", "bLen", "iden", "aDir", "bDir", "aChr", "bChr"]
+        coords = splitChromosomes(coords, 4000000, 3000000)
+        # The forward alignments within a chromosome are used as the syntenic regions
+        intra = coords.loc[(coords.aChr == coords.bChr) & (coords.bDir == 1)]
+        srdata = srResults.fromBlocks([srBlock(0, r.aChr, r.aStart, r.aEnd, r.bChr, r.bStart, r.bEnd, [[r.aStart, r.aEnd, r.bStart, r.bEnd]]) for r in intra.itertuples()])
+        ctxData = getCTXData(coords)
+        assert len(ctxData.groupby(["aChr", "bChr", "bDir"])) > 4
+        out = []
+        for shard in [True, False]:
+            blocks = getCTX(ctxData, srdata, 50, 60, 1000, 0.5, 2, 500000, 0.8, shard=shard)
+            out.append([b[:8] + (b[8].tolist(),) for b in blocks])
+        assert len(out[0]) > 0
+        assert out[0] == out[1]
+    # END